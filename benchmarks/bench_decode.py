@@ -0,0 +1,86 @@
+"""Decoding and remapping benchmark of the daily data responses.
+
+Compare json.loads of the text with per-record loops over DAILY_MAP and
+the decoders module (raw bytes, fastest installed backend, precompiled
+extractors).
+
+Usage: PYTHONPATH=. python benchmarks/bench_decode.py [DAYS]
+"""
+import copy
+from datetime import date, timedelta
+import json
+import os
+import sys
+import time
+
+from pyhydroquebec import decoders
+from pyhydroquebec.consts import DAILY_MAP
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "..", "tests", "fixtures")
+
+
+def build_body(days):
+    """Return the raw body of a daily data response of `days` days."""
+    with open(os.path.join(FIXTURES, "portal_responses.json")) as fhf:
+        record = json.load(fhf)['daily_record']
+    records = []
+    for offset in range(days):
+        day_record = copy.deepcopy(record)
+        day_record['courant']['dateJourConso'] = str(date(2000, 1, 1) + timedelta(days=offset))
+        records.append(day_record)
+    return json.dumps({"success": True, "results": records}).encode()
+
+
+def decode_loops(body):
+    """Decode and remap as before the decoders module."""
+    json_res = json.loads(body.decode())
+    current = {}
+    compare = {}
+    for day_data in json_res.get('results', []):
+        day = day_data['courant']['dateJourConso']
+        current[day] = {}
+        if 'compare' in day_data:
+            compare[day] = {}
+        for key, data in DAILY_MAP.items():
+            current[day][key] = day_data['courant'][data['raw_name']]
+            if 'compare' in day_data:
+                compare[day][key] = day_data['compare'][data['raw_name']]
+    return current, compare
+
+
+def decode_extractors(body):
+    """Decode and remap with the decoders module."""
+    json_res = decoders.decode_json(body)
+    current = {}
+    compare = {}
+    for day_data in json_res.get('results', []):
+        day = day_data['courant']['dateJourConso']
+        current[day] = decoders.extract_daily(day_data['courant'])
+        if 'compare' in day_data:
+            compare[day] = decoders.extract_daily(day_data['compare'])
+    return current, compare
+
+
+def measure(name, decode, body, repeat=20):
+    """Print the best time of `repeat` decodings."""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        decode(body)
+        durations.append(time.perf_counter() - start)
+    print("{:12s} {:10.2f} ms".format(name, min(durations) * 1000))
+
+
+def main():
+    """Run the benchmark."""
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else 3650
+    body = build_body(days)
+    assert decode_loops(body) == decode_extractors(body)
+    print("{} days, {:.0f} KiB, JSON backend: {}".format(days, len(body) / 1024,
+                                                         decoders.json_backend()))
+    measure("loops", decode_loops, body)
+    measure("extractors", decode_extractors, body)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""Benchmark of the fetch paths against a local fake portal.
+
+No network access is needed: the fake portal of tests/fake_portal.py
+replays recorded responses with a configurable latency.
+For each scenario, the wall time, the number of portal requests and
+connections, and the peak memory (tracemalloc) are reported.
+
+The request counts do not depend on the latency. With --baseline, the
+run fails if a scenario sends more requests than in the baseline file
+(benchmarks/baseline.json in CI), ie when a fetch path loses its caching.
+
+Usage: python benchmarks/bench_portal.py [--latency SECONDS] [--json] [--baseline FILE]
+"""
+import argparse
+import asyncio
+from datetime import datetime, timedelta
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "tests"))
+
+from fake_portal import FakePortal, FakePortalClient  # noqa: E402 pylint: disable=C0413
+from pyhydroquebec.__main__ import fetch_data  # noqa: E402 pylint: disable=C0413
+from pyhydroquebec.consts import get_hq_timezone  # noqa: E402 pylint: disable=C0413
+
+
+async def bench_login(portal):
+    """Log in and fetch the summaries of all the customers."""
+    client = FakePortalClient(portal)
+    await client.login()
+    await client.close_session()
+
+
+async def bench_fetch_data(portal):
+    """Run the basic report of the CLI."""
+    client = FakePortalClient(portal)
+    await fetch_data(client, None, fetch_hourly=True)
+    await client.close_session()
+
+
+async def bench_daemon_cycle(portal):
+    """Run one cycle of the MQTT daemon on all the accounts and contracts."""
+    from pyhydroquebec.mqtt_daemon import MqttHydroQuebec  # pylint: disable=C0415
+
+    class FakeMqttClient():
+        """Count the published messages."""
+
+        published = 0
+
+        def publish(self, topic, payload=None, retain=False):
+            """Count a message."""
+            self.published += 1
+
+    accounts = [{"username": "user{}".format(index), "password": "password",
+                 "contracts": [{"id": portal.contract_id("user{}".format(index), customer)}
+                               for customer in range(portal.customers)]}
+                for index in range(portal.accounts)]
+    with tempfile.NamedTemporaryFile("w", suffix=".yaml") as config:
+        json.dump({"accounts": accounts}, config)
+        config.flush()
+        for name in ("MQTT_USERNAME", "MQTT_PASSWORD", "MQTT_HOST"):
+            os.environ.setdefault(name, "bench")
+        os.environ.setdefault("MQTT_PORT", "1883")
+        os.environ.setdefault("LOG_LEVEL", "WARNING")
+        os.environ["CONFIG"] = config.name
+        daemon = MqttHydroQuebec()
+    daemon.mqtt_client = FakeMqttClient()
+    await daemon._init_main_loop()  # pylint: disable=W0212
+    # Clients are reused by the daemon when the password does not change
+    for account in accounts:
+        daemon._clients[account['username']] = FakePortalClient(  # pylint: disable=W0212
+            portal, account['username'], account['password'], cache=daemon.cache,
+            connector=daemon.connector)
+    await daemon._main_loop()  # pylint: disable=W0212
+    await daemon._loop_stopped()  # pylint: disable=W0212
+
+
+async def bench_hourly_range(portal, days=60):
+    """Download the hourly data of a long period."""
+    client = FakePortalClient(portal)
+    await client.login()
+    end_date = datetime.now(get_hq_timezone()).date() - timedelta(days=1)
+    async for _ in client.customers[0].iter_hourly_data(end_date - timedelta(days=days - 1),
+                                                        end_date):
+        pass
+    await client.close_session()
+
+
+SCENARIOS = (('login', bench_login, {'customers': 5}),
+             ('fetch_data', bench_fetch_data, {}),
+             ('daemon_cycle', bench_daemon_cycle, {'accounts': 4, 'customers': 3}),
+             ('hourly_range', bench_hourly_range, {}))
+
+
+async def run_scenario(scenario, portal_kwargs, latency):
+    """Run one scenario and return its measures."""
+    async with FakePortal(latency=latency, **portal_kwargs) as portal:
+        tracemalloc.start()
+        start = time.perf_counter()
+        await scenario(portal)
+        duration = time.perf_counter() - start
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return {'wall_time': duration,
+                'requests': portal.request_count,
+                'connections': len(portal.connections),
+                'peak_memory': peak_memory}
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--latency', type=float, default=0.01,
+                        help='Latency of the fake portal in seconds')
+    parser.add_argument('--json', action='store_true', default=False,
+                        help='Json output')
+    parser.add_argument('--baseline', default=None,
+                        help='JSON file of the maximum number of requests of each scenario')
+    args = parser.parse_args()
+
+    results = {}
+    for name, scenario, portal_kwargs in SCENARIOS:
+        results[name] = asyncio.run(run_scenario(scenario, portal_kwargs, args.latency))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print("Latency: {} ms".format(args.latency * 1000))
+        print("{:15s} {:>10s} {:>10s} {:>12s} {:>12s}".format(
+            "scenario", "wall (s)", "requests", "connections", "peak (KiB)"))
+        for name, result in results.items():
+            print("{:15s} {:10.3f} {:10d} {:12d} {:12.1f}".format(
+                name, result['wall_time'], result['requests'], result['connections'],
+                result['peak_memory'] / 1024))
+    if args.baseline:
+        return check_baseline(results, args.baseline)
+    return 0
+
+
+def check_baseline(results, path):
+    """Return 1 if a scenario sends more requests than in the baseline file, else 0."""
+    with open(path, encoding="utf-8") as fhb:
+        baseline = json.load(fhb)
+    status = 0
+    for name, max_requests in baseline.items():
+        if results[name]['requests'] > max_requests:
+            print("Request count regression, {}: {} requests, baseline {}".format(
+                name, results[name]['requests'], max_requests), file=sys.stderr)
+            status = 1
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
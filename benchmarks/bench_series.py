@@ -0,0 +1,58 @@
+"""Memory and aggregation benchmark of dict and columnar hourly data.
+
+Usage: python benchmarks/bench_series.py [YEARS]
+"""
+from datetime import date, timedelta
+import sys
+import time
+import tracemalloc
+
+from pyhydroquebec.series import HourlySeries
+
+
+def build_days(years):
+    """Yield (day, hourly data) as built by Customer.fetch_hourly_data."""
+    start = date(2020, 1, 1)
+    for offset in range(365 * years):
+        yield str(start + timedelta(days=offset)), {
+            'day_mean_temp': -3, 'day_min_temp': -5, 'day_max_temp': 0,
+            'hours': {hour: {'average_temperature': -3.5 + hour,
+                             'lower_price_consumption': 1.2 + offset % 7,
+                             'higher_price_consumption': 0,
+                             'total_consumption': 1.2 + offset % 7}
+                      for hour in range(24)}}
+
+
+def monthly_totals(hourly_data):
+    """Sum the consumption by month with loops over nested dicts."""
+    totals = {}
+    for day, data in hourly_data.items():
+        totals[day[:7]] = (totals.get(day[:7], 0) +
+                           sum(hour['total_consumption'] for hour in data['hours'].values()))
+    return totals
+
+
+def measure(name, build, aggregate):
+    """Print the memory used by the data and the time of a monthly aggregation."""
+    tracemalloc.start()
+    data = build()
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    start = time.perf_counter()
+    aggregate(data)
+    duration = time.perf_counter() - start
+    print("{:10s} {:10.1f} KiB {:10.2f} KiB/day {:10.3f} s".format(
+        name, memory / 1024, memory / 1024 / len(data), duration))
+
+
+def main():
+    """Run the benchmark."""
+    years = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    print("{} years of hourly data, memory and monthly aggregation time".format(years))
+    measure("dict", lambda: dict(build_days(years)), monthly_totals)
+    measure("columnar", lambda: HourlySeries(dict(build_days(years))),
+            lambda series: series.resample('month', ('total_consumption',)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,31 @@
+"""Micro benchmark of the account page extractors.
+
+Usage: python benchmarks/bench_summary.py [NUMBER]
+"""
+import os
+import sys
+import timeit
+
+from pyhydroquebec.parsers import parse_summary, lxml_available, SUMMARY_PARSERS
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "..", "tests", "fixtures",
+                       "gerer-mon-compte.html")
+
+
+def main():
+    """Run the benchmark."""
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    with open(FIXTURE, encoding="utf-8") as fhf:
+        content = fhf.read()
+    print("Page size: {} bytes, {} runs".format(len(content), number))
+    for parser in SUMMARY_PARSERS:
+        if parser == 'lxml' and not lxml_available():
+            # The lxml parser would measure its bs4 fallback
+            print("{:10s} unavailable, skipped".format(parser))
+            continue
+        duration = timeit.timeit(lambda p=parser: parse_summary(content, p), number=number)
+        print("{:10s} {:8.3f} ms/page".format(parser, duration * 1000 / number))
+
+
+if __name__ == '__main__':
+    main()
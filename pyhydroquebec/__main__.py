@@ -1,16 +1,19 @@
-"""PyHydroQuebec Entrypoint Module."""
+"""PyHydroQuebec Entrypoint Module.
 
+Heavy modules (aiohttp, the outputters, the store, the MQTT daemon and its
+dependencies) are imported only by the code paths using them, to keep the
+startup fast, ie for cron jobs. tests/test_startup.py checks it.
+"""
+# pylint: disable=import-outside-toplevel
 import argparse
-import asyncio
 from datetime import datetime, timedelta
 from pprint import pprint
 import sys
 import os
 
-from pyhydroquebec.client import HydroQuebecClient
-from pyhydroquebec.consts import REQUESTS_TIMEOUT, HQ_TIMEZONE
-from pyhydroquebec.outputter import output_text, output_influx, output_json
-from pyhydroquebec.mqtt_daemon import MqttHydroQuebec
+from pyhydroquebec.consts import (REQUESTS_TIMEOUT, BULK_CONCURRENCY, INFLUX_BATCH_SIZE,
+                                  get_hq_timezone)
+from pyhydroquebec.error import PyHydroQuebecError
 from pyhydroquebec.__version__ import VERSION
 
 
@@ -21,20 +24,22 @@ async def fetch_data(client, contract_id, fetch_hourly=False):
         if customer.contract_id != contract_id and contract_id is not None:
             continue
         if contract_id is None:
-            client.logger.warn("Contract id not specified, using first available.")
-
-        await customer.fetch_current_period()
-        await customer.fetch_annual_data()
-        await customer.fetch_monthly_data()
-        yesterday = datetime.now(HQ_TIMEZONE) - timedelta(days=1)
-        yesterday_str = yesterday.strftime("%Y-%m-%d")
-        await customer.fetch_daily_data(yesterday_str, yesterday_str)
-        if not customer.current_daily_data:
-            yesterday = yesterday - timedelta(days=1)
-            yesterday_str = yesterday.strftime("%Y-%m-%d")
-            await customer.fetch_daily_data(yesterday_str, yesterday_str)
+            client.logger.warning("Contract id not specified, using first available.")
+
+        datasets = ['current_period', 'annual', 'monthly', 'daily']
         if fetch_hourly:
-            await customer.fetch_hourly_data(yesterday_str)
+            datasets.append('hourly')
+        result = await customer.fetch(datasets)
+        errors = result.errors
+        if not customer.current_daily_data:
+            # Yesterday is not available yet, use the day before
+            day_datasets = [name for name in datasets if name in ('daily', 'hourly')]
+            day = datetime.strptime(result.day, "%Y-%m-%d") - timedelta(days=1)
+            errors = {name: error for name, error in errors.items()
+                      if name not in day_datasets}
+            errors.update((await customer.fetch(day_datasets, day)).errors)
+        for error in errors.values():
+            raise error
         return customer
 
 
@@ -55,10 +60,58 @@ async def list_contracts(client):
             for c in client.customers]
 
 
-async def fetch_data_detailled_energy_use(client, start_date, end_date):
-    """Fetch hourly data for a given period."""
-    # TODO
-    raise Exception("FIXME")
+async def fetch_data_detailled_energy_use(client, contract_id, start_date, end_date,
+                                          concurrency=BULK_CONCURRENCY, daily=False,
+                                          exporter=None):
+    """Fetch hourly or daily data for a given period.
+
+    Data is written with `exporter` (NDJSON on stdout by default) as soon as
+    each day is downloaded.
+    """
+    if exporter is None:
+        from pyhydroquebec.outputter import NdjsonExporter
+        exporter = NdjsonExporter()
+    await client.login()
+    for customer in client.customers:
+        if customer.contract_id != contract_id and contract_id is not None:
+            continue
+        if contract_id is None:
+            client.logger.warning("Contract id not specified, using first available.")
+
+        with exporter:
+            if daily:
+                async for day, daily_data in customer.iter_daily_data(start_date, end_date):
+                    exporter.write_daily(customer.contract_id, day, daily_data)
+            else:
+                async for day, hourly_data in customer.iter_hourly_data(start_date, end_date,
+                                                                        concurrency):
+                    exporter.write_hourly_day(customer.contract_id, day, hourly_data)
+        return customer
+    raise PyHydroQuebecError("Contract {} not found".format(contract_id))
+
+
+async def sync_history(client, contract_id, store_path, start_date=None, end_date=None):
+    """Sync the missing daily and hourly data in the local history store.
+
+    Without `start_date`, the sync starts where the last one stopped.
+    """
+    await client.login()
+    for customer in client.customers:
+        if customer.contract_id != contract_id and contract_id is not None:
+            continue
+        if contract_id is None:
+            client.logger.warning("Contract id not specified, using first available.")
+
+        from pyhydroquebec.store import HistoryStore
+        store = HistoryStore(store_path)
+        try:
+            synced_daily, synced_hourly = await store.sync(customer, start_date, end_date)
+        finally:
+            store.close()
+        return {"contract_id": customer.contract_id,
+                "daily": synced_daily,
+                "hourly": synced_hourly}
+    raise PyHydroQuebecError("Contract {} not found".format(contract_id))
 
 
 def main():
@@ -72,6 +125,12 @@ def main():
                         default=False, help='Json output')
     parser.add_argument('-i', '--influxdb', action='store_true',
                         default=False, help='InfluxDb output')
+    parser.add_argument('--influxdb-url',
+                        default=None,
+                        help='InfluxDb write url, ie: http://localhost:8086/write?db=hydroquebec. '
+                             'Print on stdout if not set')
+    parser.add_argument('--influxdb-batch-size', type=int,
+                        default=INFLUX_BATCH_SIZE, help='Number of lines by InfluxDb write')
     parser.add_argument('-c', '--contract',
                         default=None, help='Contract number')
     parser.add_argument('-l', '--list-contracts', action='store_true',
@@ -80,23 +139,39 @@ def main():
                         default=False, help='Show yesterday hourly consumption')
     parser.add_argument('-D', '--dump-data', action='store_true',
                         default=False, help='Show contract python object as dict')
-    parser.add_argument('-t', '--timeout',
-                        default=REQUESTS_TIMEOUT, help='Request timeout')
+    parser.add_argument('-t', '--timeout', type=int,
+                        default=REQUESTS_TIMEOUT, help='Request timeout in seconds')
     parser.add_argument('-L', '--log-level',
                         choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
                         default='WARNING', help='Log level')
+    parser.add_argument('--metrics', action='store_true',
+                        default=False,
+                        help='Print request and phase metrics (Prometheus format) on stderr')
     parser.add_argument('-V', '--version', action='store_true',
                         default=False, help='Show version')
     raw_group = parser.add_argument_group('Detailled-energy raw download option')
     raw_group.add_argument('--detailled-energy', action='store_true',
-                           default=False, help='Get raw json output download')
+                           default=False, help='Get raw NDJSON output download')
+    raw_group.add_argument('--daily', action='store_true',
+                           default=False, help='Download daily instead of hourly data')
+    raw_group.add_argument('-o', '--output',
+                           default=None, help='NDJSON output file, default to stdout')
     raw_group.add_argument('--start-date',
-                           default=(datetime.now(HQ_TIMEZONE) -
-                                    timedelta(days=1)).strftime("%Y-%m-%d"),
-                           help='Start date for detailled-output')
+                           default=None,
+                           help='Start date for detailled-output, default to yesterday')
     raw_group.add_argument('--end-date',
-                           default=datetime.now(HQ_TIMEZONE).strftime("%Y-%m-%d"),
-                           help="End date for detailled-output")
+                           default=None,
+                           help="End date for detailled-output, default to today")
+    raw_group.add_argument('--concurrency', type=int,
+                           default=BULK_CONCURRENCY,
+                           help="Number of days downloaded at the same time")
+    store_group = parser.add_argument_group('History store option')
+    store_group.add_argument('--store',
+                             default=None, help='SQLite history store path')
+    store_group.add_argument('--sync', action='store_true',
+                             default=False,
+                             help='Store missing daily and hourly data between '
+                                  '--start-date (default to the last sync) and --end-date')
 
     args = parser.parse_args()
 
@@ -125,6 +200,20 @@ def main():
               "-u/--username, -p/--password")
         return 3
 
+    if args.sync and not args.store:
+        parser.print_usage()
+        print("pyhydroquebec: error: --sync requires --store")
+        return 3
+
+    if args.detailled_energy:
+        if args.start_date is None:
+            args.start_date = (datetime.now(get_hq_timezone()) -
+                               timedelta(days=1)).strftime("%Y-%m-%d")
+        if args.end_date is None:
+            args.end_date = datetime.now(get_hq_timezone()).strftime("%Y-%m-%d")
+
+    import asyncio
+    from pyhydroquebec.client import HydroQuebecClient
     client = HydroQuebecClient(hydro_user, hydro_pass,
                                args.timeout, log_level=args.log_level)
     loop = asyncio.get_event_loop()
@@ -134,12 +223,23 @@ def main():
         async_func = list_contracts(client)
     elif args.dump_data:
         async_func = dump_data(client, hydro_contract)
+    elif args.sync:
+        async_func = sync_history(client, hydro_contract, args.store,
+                                  args.start_date, args.end_date)
     elif args.detailled_energy is False:
         async_func = fetch_data(client, hydro_contract, args.hourly)
     else:
+        from pyhydroquebec.outputter import NdjsonExporter, InfluxWriter
         start_date = datetime.strptime(args.start_date, '%Y-%m-%d')
         end_date = datetime.strptime(args.end_date, '%Y-%m-%d')
-        async_func = fetch_data_detailled_energy_use(client, start_date, end_date)
+        if args.influxdb:
+            exporter = InfluxWriter(args.influxdb_url, args.influxdb_batch_size)
+        else:
+            exporter = NdjsonExporter(args.output)
+        async_func = fetch_data_detailled_energy_use(client, hydro_contract,
+                                                     start_date, end_date,
+                                                     args.concurrency, args.daily,
+                                                     exporter)
 
     # Fetch data
     try:
@@ -151,6 +251,8 @@ def main():
         close_fut = asyncio.wait([client.close_session()])
         loop.run_until_complete(close_fut)
         loop.close()
+        if args.metrics:
+            print(client.metrics.to_prometheus(), file=sys.stderr)
 
     # Output data
     if args.list_contracts:
@@ -160,17 +262,28 @@ def main():
                   "Customer: {customer_id}".format(**customer))
     elif args.dump_data:
         pprint(results[0].__dict__)
+    elif args.sync:
+        print("Contract {contract_id}: {daily} days of daily data and "
+              "{hourly} days of hourly data synced".format(**results[0]))
+    elif args.detailled_energy:
+        # Already printed while downloading
+        pass
     elif args.influxdb:
-        output_influx(results[0])
-    elif args.json or args.detailled_energy:
+        from pyhydroquebec.outputter import output_influx
+        output_influx(results[0], args.hourly, args.influxdb_url, args.influxdb_batch_size)
+    elif args.json:
+        from pyhydroquebec.outputter import output_json
         output_json(results[0], args.hourly)
     else:
+        from pyhydroquebec.outputter import output_text
         output_text(results[0], args.hourly)
     return 0
 
 
 def mqtt_daemon():
     """Entrypoint function."""
+    import asyncio
+    from pyhydroquebec.mqtt_daemon import MqttHydroQuebec
     dev = MqttHydroQuebec()
     asyncio.run(dev.async_run())
 
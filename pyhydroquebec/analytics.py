@@ -0,0 +1,116 @@
+"""PyHydroQuebec Analytics Module.
+
+Aggregations over the daily and hourly history of a contract.
+Every function takes a series (see pyhydroquebec.series), or a dict
+keyed by date string as returned by Customer or HistoryStore, and works
+on whole columns at once.
+"""
+from bisect import bisect_left
+import heapq
+from itertools import accumulate
+import math
+
+from pyhydroquebec.consts import HDD_BASE_TEMPERATURE
+from pyhydroquebec.series import DailySeries, HourlySeries, HOURS
+
+
+def _daily(data):
+    """Return daily data as a DailySeries."""
+    return data if isinstance(data, DailySeries) else DailySeries(data)
+
+
+def _hourly(data):
+    """Return hourly data as a HourlySeries."""
+    return data if isinstance(data, HourlySeries) else HourlySeries(data)
+
+
+def _prefix_sums(values):
+    """Return the prefix sums of the values and of the number of values, NaN excluded."""
+    sums = [0.0] + list(accumulate(0.0 if math.isnan(value) else value for value in values))
+    counts = [0] + list(accumulate(0 if math.isnan(value) else 1 for value in values))
+    return sums, counts
+
+
+def period_totals(daily_data, period='month'):
+    """Return the consumptions summed and the temperatures averaged by period.
+
+    `period` is day, week, month or year.
+    """
+    return _daily(daily_data).resample(period)
+
+
+def moving_average(daily_data, field='total_consumption', window=7):
+    """Return the mean of a field over the `window` calendar days ending at each day.
+
+    Missing days are ignored.
+    """
+    series = _daily(daily_data)
+    ordinals = series.ordinals()
+    sums, counts = _prefix_sums(series.column(field))
+    averages = {}
+    for index, (day, ordinal) in enumerate(zip(series, ordinals)):
+        first = bisect_left(ordinals, ordinal - window + 1)
+        count = counts[index + 1] - counts[first]
+        averages[day] = (sums[index + 1] - sums[first]) / count if count else None
+    return averages
+
+
+def peak_hours(hourly_data, field='total_consumption', top=10):
+    """Return the `top` highest hours as (day, hour, value), highest first."""
+    series = _hourly(hourly_data)
+    days = list(series)
+    column = series.column(field)
+    peaks = heapq.nlargest(top, (index for index in range(len(column))
+                                 if not math.isnan(column[index])),
+                           key=column.__getitem__)
+    return [(days[index // HOURS], index % HOURS, column[index]) for index in peaks]
+
+
+def tier_breakdown(daily_data, period='month'):
+    """Return the lower and higher price consumptions by period.
+
+    `higher_price_share` is the part of the consumption billed at the higher
+    price (consoHaut), from 0 to 1.
+    """
+    fields = ('lower_price_consumption', 'higher_price_consumption', 'total_consumption')
+    breakdown = _daily(daily_data).resample(period, fields)
+    for values in breakdown.values():
+        total = (values['lower_price_consumption'] or 0) + (values['higher_price_consumption'] or 0)
+        values['higher_price_share'] = ((values['higher_price_consumption'] or 0) / total
+                                        if total else None)
+    return breakdown
+
+
+def heating_degree_days(daily_data, base=HDD_BASE_TEMPERATURE):
+    """Return the heating degree-days of each day, None without temperature."""
+    series = _daily(daily_data)
+    return {day: None if math.isnan(temperature) else max(0.0, base - temperature)
+            for day, temperature in zip(series, series.column('average_temperature'))}
+
+
+def temperature_correlation(daily_data, field='total_consumption', base=HDD_BASE_TEMPERATURE):
+    """Relate the consumption to the heating degree-days with a linear regression.
+
+    Return a dict with the Pearson `correlation`, the `slope` (consumption
+    by degree-day), the `base_load` (consumption without heating) and the
+    number of `days` used. Values are None with less than 2 days.
+    """
+    series = _daily(daily_data)
+    points = [(max(0.0, base - temperature), value)
+              for temperature, value in zip(series.column('average_temperature'),
+                                            series.column(field))
+              if not math.isnan(temperature) and not math.isnan(value)]
+    result = {'correlation': None, 'slope': None, 'base_load': None, 'days': len(points)}
+    if len(points) < 2:
+        return result
+    mean_x = math.fsum(point[0] for point in points) / len(points)
+    mean_y = math.fsum(point[1] for point in points) / len(points)
+    var_x = math.fsum((x - mean_x) ** 2 for x, _ in points)
+    var_y = math.fsum((y - mean_y) ** 2 for _, y in points)
+    covariance = math.fsum((x - mean_x) * (y - mean_y) for x, y in points)
+    if var_x:
+        result['slope'] = covariance / var_x
+        result['base_load'] = mean_y - result['slope'] * mean_x
+    if var_x and var_y:
+        result['correlation'] = covariance / math.sqrt(var_x * var_y)
+    return result
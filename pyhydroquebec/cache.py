@@ -0,0 +1,120 @@
+"""PyHydroQuebec Cache Module.
+
+Async memoization layer used by the Customer fetch methods.
+Parsed results are stored (never coroutines), keyed on
+(customer_id, endpoint, params).
+"""
+import asyncio
+from collections import OrderedDict
+import time
+
+from pyhydroquebec.consts import REQUESTS_TTL, CACHE_MAXSIZE
+
+
+def freeze_params(params):
+    """Return a hashable version of request parameters."""
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return tuple(sorted((key, freeze_params(value)) for key, value in params.items()))
+    if isinstance(params, (list, tuple)):
+        return tuple(freeze_params(value) for value in params)
+    return params
+
+
+def _retrieve_exception(future):
+    """Retrieve the exception of a shared fetch, even if all its callers were cancelled."""
+    if not future.cancelled():
+        future.exception()
+
+
+class ResponseCache():
+    """TTL and LRU cache for parsed portal responses.
+
+    Concurrent callers asking for the same key share one in-flight request,
+    cancelled when all its callers are. Failed requests are never cached.
+    """
+
+    def __init__(self, maxsize=CACHE_MAXSIZE, ttl=60 * REQUESTS_TTL, endpoint_ttls=None):
+        """Create new ResponseCache object.
+
+        `ttl` is the default time to live in seconds.
+        `endpoint_ttls` overrides it per endpoint name, a TTL of 0 disables caching.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.endpoint_ttls = dict(endpoint_ttls or {})
+        self._data = OrderedDict()
+        self._inflight = {}
+
+    def ttl_for(self, endpoint):
+        """Return the TTL of the given endpoint."""
+        return self.endpoint_ttls.get(endpoint, self.ttl)
+
+    def get(self, key):
+        """Return a cached value or raise KeyError if missing or expired."""
+        expiration, value = self._data[key]
+        if expiration < time.monotonic():
+            del self._data[key]
+            raise KeyError(key)
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        """Store a value, evicting the least recently used entries if needed."""
+        ttl = self.ttl_for(key[1])
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    async def get_or_fetch(self, key, fetcher):
+        """Return the cached value for `key` or run `fetcher()` to build it.
+
+        `key` must be a (customer_id, endpoint, params) tuple.
+        """
+        try:
+            return self.get(key)
+        except KeyError:
+            pass
+
+        inflight = self._inflight.get(key)
+        if inflight is None:
+            future = asyncio.ensure_future(fetcher())
+            future.add_done_callback(_retrieve_exception)
+            # Shared future and number of waiting callers
+            inflight = self._inflight[key] = [future, 0]
+        future = inflight[0]
+        inflight[1] += 1
+        try:
+            value = await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # A cancelled caller leaves the fetch to the others, the last one cancels it
+            if inflight[1] == 1:
+                future.cancel()
+            raise
+        finally:
+            inflight[1] -= 1
+            if not inflight[1] and self._inflight.get(key) is inflight:
+                del self._inflight[key]
+        self.set(key, value)
+        return value
+
+    def invalidate(self, customer_id=None, endpoint=None):
+        """Drop cached entries matching the given customer and/or endpoint."""
+        for key in list(self._data):
+            if customer_id is not None and key[0] != customer_id:
+                continue
+            if endpoint is not None and key[1] != endpoint:
+                continue
+            del self._data[key]
+
+    def clear(self):
+        """Drop all cached entries."""
+        self._data.clear()
+
+    def __len__(self):
+        """Return the number of cached entries."""
+        return len(self._data)
@@ -1,19 +1,36 @@
 """PyHydroQuebec Client Module."""
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
 import uuid
 from datetime import datetime
 import random
 import string
 from json import dumps as json_dumps
 import logging
+import time
 
 import aiohttp
 
+from pyhydroquebec.cache import ResponseCache
 from pyhydroquebec.customer import Customer
-from pyhydroquebec.error import PyHydroQuebecHTTPError, PyHydroQuebecError
-from pyhydroquebec.consts import (REQUESTS_TIMEOUT, CONTRACT_URL_1, CONTRACT_URL_2,
+from pyhydroquebec.metrics import Metrics, RequestEvent, endpoint_name
+from pyhydroquebec.retry import RetryPolicy, shared_rate_limiter
+from pyhydroquebec.session import PortalSession, PortalSessionPool
+from pyhydroquebec.error import (PyHydroQuebecHTTPError, PyHydroQuebecError,
+                                 PyHydroQuebecSessionExpiredError, PyHydroQuebecTimeoutError)
+from pyhydroquebec.consts import (REQUESTS_TIMEOUT, REQUESTS_CONNECT_TIMEOUT, PHASE_TIMEOUT,
+                                  CONTRACT_URL_1, CONTRACT_URL_2,
                                   CONTRACT_URL_3, CONTRACT_CURRENT_URL_1, LOGIN_URL_3,
                                   LOGIN_URL_4, LOGIN_URL_5, LOGIN_URL_6, LOGIN_URL_7,
-                                  LOGGING_LEVELS)
+                                  LOGGING_LEVELS, HOST_LOGIN, HOST_SESSION,
+                                  TOKEN_EXPIRATION_MARGIN, SUMMARY_CONCURRENCY,
+                                  PORTAL_SESSION_POOL_SIZE, SUMMARY_PARSER,
+                                  THROTTLE_STATUSES, COLUMNAR_SERIES, OFFLOAD_THRESHOLD,
+                                  PARSE_WORKERS)
+
+PARSE_EXECUTORS = {'thread': ThreadPoolExecutor,
+                   'process': ProcessPoolExecutor}
 
 
 def _get_logger(log_level):
@@ -35,12 +52,62 @@ class HydroQuebecClient():
     """PyHydroQuebec HTTP Client."""
 
     def __init__(self, username, password, timeout=REQUESTS_TIMEOUT,
-                 session=None, log_level='INFO'):
-        """Initialize the client object."""
+                 session=None, log_level='INFO', cache=None,
+                 summary_concurrency=SUMMARY_CONCURRENCY,
+                 portal_session_pool_size=PORTAL_SESSION_POOL_SIZE,
+                 summary_parser=SUMMARY_PARSER, metrics=None, retry_policy=None,
+                 rate_limiter=None, connector=None, columnar=COLUMNAR_SERIES,
+                 parse_executor=None, offload_threshold=OFFLOAD_THRESHOLD,
+                 connect_timeout=REQUESTS_CONNECT_TIMEOUT, phase_timeout=PHASE_TIMEOUT):
+        """Initialize the client object.
+
+        `timeout` is the maximum duration in seconds of each request try,
+        `connect_timeout` of its connection. `phase_timeout` is the maximum
+        duration of a login, customer selection or fetch, retries included.
+        None disables a timeout.
+        `cache` is a ResponseCache which can be shared between clients.
+        `summary_concurrency` is the number of customer summaries fetched
+        at the same time during the login.
+        `portal_session_pool_size` is the number of customer portal sessions kept.
+        `summary_parser` is the account page extractor: targeted, lxml or bs4.
+        `metrics` is a Metrics collecting request and phase timings, it can be
+        shared between clients.
+        `retry_policy` is a RetryPolicy, the default one retries GET requests.
+        `rate_limiter` is an AdaptiveRateLimiter, by default the one shared by
+        all the clients of the process.
+        `connector` is an aiohttp connector shared with other clients (see
+        pyhydroquebec.session.build_connector), it is not closed by the client.
+        Each client keeps its own cookies.
+        If `columnar` is True, customers keep daily and hourly data in compact
+        array series (see pyhydroquebec.series) instead of dicts.
+        `parse_executor` is 'thread', 'process' or a concurrent.futures
+        Executor. Responses of at least `offload_threshold` bytes are then
+        parsed in it, so the event loop keeps serving the other requests.
+        """
         self.username = username
         self.password = password
         self._timeout = timeout
+        self._request_timeout = aiohttp.ClientTimeout(total=timeout,
+                                                      connect=connect_timeout)
+        self.phase_timeout = phase_timeout
         self._session = session
+        self._connector = connector
+        self.cache = cache if cache is not None else ResponseCache()
+        self.summary_concurrency = summary_concurrency
+        self.summary_parser = summary_parser
+        self.columnar = columnar
+        if (parse_executor is not None and not isinstance(parse_executor, Executor) and
+                parse_executor not in PARSE_EXECUTORS):
+            raise PyHydroQuebecError("Bad parse executor. "
+                                     "Should be in {}".format(", ".join(PARSE_EXECUTORS)))
+        self.parse_executor = parse_executor
+        self.offload_threshold = offload_threshold
+        # Executor built from the parse_executor name, owned by the client
+        self._parse_executor = None
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        self.rate_limiter = rate_limiter if rate_limiter is not None else shared_rate_limiter()
+        self._portal_sessions = PortalSessionPool(portal_session_pool_size)
         self.guid = str(uuid.uuid1())
         self.logger = _get_logger(log_level)
         self.logger.debug("PyHydroQuebec initialized")
@@ -49,62 +116,183 @@ class HydroQuebecClient():
     def reset(self):
         """Reset collected data and temporary variable."""
         self._customers = []
+        self._pending_customers = []
+        self._all_customers = []
         self.access_token = None
+        self._token_expiration = None
         self.cookies = {}
         self._selected_customer = None
 
     async def http_request(self, url, method, params=None, data=None,
-                           headers=None, ssl=True, cookies=None, status=200):
-        """Prepare and run HTTP/S request."""
+                           headers=None, ssl=True, cookies=None, status=200,
+                           customer_id=None, retry=None):
+        """Prepare and run HTTP/S request.
+
+        If `customer_id` is set, the request uses the portal session of this customer.
+        Failed requests are tried again following the retry policy, `retry`
+        forces (True) or prevents (False) the retries whatever the method.
+        """
         site = url.split("/")[2]
+        if customer_id is None:
+            http_session = self._session
+            site_cookies = self.cookies
+        else:
+            portal_session = self._get_portal_session(customer_id)
+            http_session = portal_session.http_session
+            site_cookies = portal_session.cookies
         if params is None:
             params = {}
         if data is None:
             data = {}
         if headers is None:
             headers = {}
+        if site not in site_cookies:
+            site_cookies[site] = {}
         if cookies is None:
-            if site not in self.cookies:
-                self.cookies[site] = {}
-            cookies = self.cookies[site]
-
-        self.logger.debug("HTTP query %s to %s", url, method)
-        raw_res = await getattr(self._session, method)(url,
-                                                       params=params,
-                                                       data=data,
-                                                       allow_redirects=False,
-                                                       ssl=ssl,
-                                                       cookies=cookies,
-                                                       headers=headers)
+            cookies = site_cookies[site]
+
+        endpoint = endpoint_name(url)
+        attempt = 0
+        while True:
+            self.logger.debug("HTTP query %s to %s", url, method)
+            await self.rate_limiter.acquire()
+            start = time.monotonic()
+            try:
+                raw_res = await getattr(http_session, method)(url,
+                                                              params=params,
+                                                              data=data,
+                                                              allow_redirects=False,
+                                                              ssl=ssl,
+                                                              cookies=cookies,
+                                                              headers=headers,
+                                                              timeout=self._request_timeout)
+                # Read the body now so the latency and the size include it, and a
+                # stalled body is retried like the other errors
+                size = len(await raw_res.read())
+            except (aiohttp.ClientError, asyncio.TimeoutError) as exp:
+                self.metrics.record_request(RequestEvent(endpoint, method, None,
+                                                         time.monotonic() - start, 0,
+                                                         customer_id))
+                if not self.retry_policy.should_retry(method, attempt, force=retry):
+                    if isinstance(exp, asyncio.TimeoutError):
+                        raise PyHydroQuebecTimeoutError("Timeout fetching {} after {}s".format(
+                            url, self._timeout), endpoint) from exp
+                    raise PyHydroQuebecHTTPError("Error Fetching {} ({})".format(
+                        url, exp)) from exp
+                delay = self.retry_policy.delay(attempt)
+                self.logger.warning("Error fetching %s (%s), retrying in %.1fs",
+                                    endpoint, exp, delay)
+            else:
+                self.metrics.record_request(RequestEvent(endpoint, method, raw_res.status,
+                                                         time.monotonic() - start, size,
+                                                         customer_id))
+                if raw_res.status in THROTTLE_STATUSES:
+                    self.rate_limiter.throttled()
+                else:
+                    self.rate_limiter.succeeded()
+                if raw_res.status == status or not self.retry_policy.should_retry(
+                        method, attempt, raw_res.status, force=retry):
+                    break
+                delay = self.retry_policy.delay(attempt, raw_res.headers.get('Retry-After'))
+                self.logger.warning("Status %d fetching %s, retrying in %.1fs",
+                                    raw_res.status, endpoint, delay)
+                raw_res.release()
+            await asyncio.sleep(delay)
+            attempt += 1
+
+        if raw_res.status != status and self._is_session_expired(raw_res):
+            self.logger.info("Session expired while fetching %s", url)
+            self.access_token = None
+            raise PyHydroQuebecSessionExpiredError("Session expired fetching {}".format(url),
+                                                   raw_res.status)
         if raw_res.status != status:
-            self.logger.exception("Exception in http_request")
+            self.logger.error("Error fetching %s: status %d", url, raw_res.status)
             self.logger.debug(raw_res)
-            raise PyHydroQuebecHTTPError("Error Fetching {}".format(url))
+            raise PyHydroQuebecHTTPError("Error Fetching {} (status {}, expected {})".format(
+                url, raw_res.status, status), raw_res.status)
 
         for cookie, cookie_content in raw_res.cookies.items():
             if hasattr(cookie_content, 'value'):
-                self.cookies[site][cookie] = cookie_content.value
+                site_cookies[site][cookie] = cookie_content.value
             else:
-                self.cookies[site][cookie] = cookie_content
+                site_cookies[site][cookie] = cookie_content
 
         return raw_res
 
-    async def select_customer(self, account_id, customer_id, force=False):
-        """Select a customer on the Home page.
+    @staticmethod
+    def _is_session_expired(raw_res):
+        """Return True if the response sends us back to the login page."""
+        if raw_res.status == 401:
+            return True
+        location = raw_res.headers.get('Location', '')
+        return raw_res.status == 302 and location.startswith((HOST_LOGIN, HOST_SESSION))
 
-        Equivalent to click on the customer box on the Home page.
+    @property
+    def is_logged_in(self):
+        """Return True if we have an access token which is not expired."""
+        if self.access_token is None:
+            return False
+        return self._token_expiration is None or time.monotonic() < self._token_expiration
+
+    async def ensure_login(self, lazy=False):
+        """Log in only if we are not logged in or if the access token expired.
+
+        The http session, the cookies and the customers are kept otherwise.
         """
-        if self._selected_customer == customer_id and not force:
+        if self.is_logged_in:
+            self.logger.debug("Reusing session of %s", self.username)
             return
+        await self.login(lazy)
+
+    def _get_portal_session(self, customer_id):
+        """Return the portal session of a customer, create it if needed."""
+        portal_session = self._portal_sessions.get(customer_id)
+        if portal_session is None:
+            portal_session = PortalSession.from_client_session(customer_id, self._session,
+                                                               self.cookies)
+            self._portal_sessions.add(portal_session)
+        return portal_session
+
+    @asynccontextmanager
+    async def use_portal_session(self, customer_id):
+        """Keep the portal session of a customer in the pool while it is used."""
+        portal_session = self._get_portal_session(customer_id)
+        portal_session.in_use += 1
+        try:
+            yield portal_session
+        finally:
+            portal_session.in_use -= 1
+            await self._portal_sessions.evict()
+
+    async def _close_portal_sessions(self):
+        """Close all the portal sessions."""
+        await self._portal_sessions.close()
 
-        self.logger.info("Selecting customer %s", customer_id)
-        if force and "cl-ec-spring.hydroquebec.com" in self.cookies:
-            del self.cookies["cl-ec-spring.hydroquebec.com"]
+    async def select_customer(self, account_id, customer_id, force=False):
+        """Select a customer on the Home page.
 
-        customers = [c for c in self._customers if c.customer_id == customer_id]
+        Equivalent to click on the customer box on the Home page.
+        Each customer has its own portal session so the selection is done
+        only once per customer.
+        """
+        customers = [c for c in self._all_customers if c.customer_id == customer_id]
         if not customers:
             raise PyHydroQuebecError("Customer ID {} not found.".format(customer_id))
 
+        portal_session = self._get_portal_session(customer_id)
+        async with portal_session.lock:
+            if portal_session.selected and not force:
+                return
+            await self.run_phase('select_customer',
+                                 self._select_customer(portal_session, account_id,
+                                                       customer_id, force))
+
+    async def _select_customer(self, portal_session, account_id, customer_id, force):
+        """Select a customer in its portal session."""
+        self.logger.info("Selecting customer %s", customer_id)
+        if force and "cl-ec-spring.hydroquebec.com" in portal_session.cookies:
+            del portal_session.cookies["cl-ec-spring.hydroquebec.com"]
+
         headers = {
             "Content-Type": "application/json",
             "Authorization": "Bearer " + self.access_token,
@@ -114,37 +302,68 @@ class HydroQuebecClient():
             "GUID_SESSION": self.guid
             }
 
-        await self.http_request(CONTRACT_URL_1, "get", headers=headers)
+        await self.http_request(CONTRACT_URL_1, "get", headers=headers,
+                                customer_id=customer_id)
 
         params = {"mode": "web"}
         await self.http_request(CONTRACT_URL_2, "get",
                                 params=params,
-                                headers=headers)
+                                headers=headers,
+                                customer_id=customer_id)
 
         # load overview page
-        await self.http_request(CONTRACT_URL_3, "get")
+        await self.http_request(CONTRACT_URL_3, "get", customer_id=customer_id)
         # load consumption profile page
-        await self.http_request(CONTRACT_CURRENT_URL_1, "get")
+        await self.http_request(CONTRACT_CURRENT_URL_1, "get", customer_id=customer_id)
 
+        portal_session.selected = True
         self._selected_customer = customer_id
         self.logger.info("Customer %s selected", customer_id)
 
     @property
     def selected_customer(self):
-        """Return the current selected customer."""
+        """Return the last selected customer."""
         return self._selected_customer
 
+    async def run_phase(self, name, coro):
+        """Run a coroutine as the phase `name` and return its result.
+
+        The phase is timed in the metrics and cancelled after `phase_timeout`
+        seconds with a PyHydroQuebecTimeoutError.
+        """
+        with self.metrics.phase(name):
+            try:
+                return await asyncio.wait_for(coro, self.phase_timeout)
+            except asyncio.TimeoutError as exp:
+                self.logger.error("Phase %s timed out after %ss", name, self.phase_timeout)
+                raise PyHydroQuebecTimeoutError("Phase {} timed out after {}s".format(
+                    name, self.phase_timeout), name) from exp
+
     def _get_httpsession(self):
         """Set http session."""
         if self._session is None:
-            self._session = aiohttp.ClientSession(requote_redirect_url=False,)
+            if self._connector is not None:
+                self._session = aiohttp.ClientSession(connector=self._connector,
+                                                      connector_owner=False,
+                                                      requote_redirect_url=False,)
+            else:
+                self._session = aiohttp.ClientSession(requote_redirect_url=False,)
 
-    async def login(self):
+    async def login(self, lazy=False):
         """Log in HydroQuebec website.
 
         Hydroquebec is using ForgeRock solution for authentication.
+        If `lazy` is True, customer summaries are not fetched, use
+        `get_customer` to fetch only the needed ones.
         """
+        await self.run_phase('login', self._login())
+        if not lazy:
+            await self.fetch_customers()
+
+    async def _login(self):
+        """Authenticate and get the customer list."""
         # Reset cache
+        await self._close_portal_sessions()
         self.reset()
 
         # Get http session
@@ -157,7 +376,8 @@ class HydroQuebecClient():
                    "X-Password": "anonymous",
                    "X-Requested-With": "XMLHttpRequest",
                    "X-Username": "anonymous"}
-        res = await self.http_request(LOGIN_URL_3, "post", headers=headers)
+        # The authentication requests can be sent again safely
+        res = await self.http_request(LOGIN_URL_3, "post", headers=headers, retry=True)
         data = await res.json()
 
         # Check if we are already logged in
@@ -168,10 +388,13 @@ class HydroQuebecClient():
 
             data = json_dumps(data)
 
-            # TODO catch error
             try:
-                res = await self.http_request(LOGIN_URL_3, "post", data=data, headers=headers)
-            except PyHydroQuebecHTTPError:
+                res = await self.http_request(LOGIN_URL_3, "post", data=data, headers=headers,
+                                              retry=True)
+            except PyHydroQuebecHTTPError as exp:
+                if exp.status not in (401, 403):
+                    # Portal or network failure, not worth hiding
+                    raise
                 self.logger.critical('Unable to connect. Check your credentials')
                 return
             json_res = await res.json()
@@ -221,6 +444,9 @@ class HydroQuebecClient():
             return
 
         self.access_token = callback_params['access_token']
+        if callback_params.get('expires_in', '').isdigit():
+            self._token_expiration = (time.monotonic() + int(callback_params['expires_in']) -
+                                      TOKEN_EXPIRATION_MARGIN)
 
         headers = {"Content-Type": "application/json",
                    "Authorization": "Bearer " + self.access_token}
@@ -233,23 +459,76 @@ class HydroQuebecClient():
         res = await self.http_request(LOGIN_URL_7, "get", headers=headers)
         json_res = await res.json()
 
+        customer_logger = self.logger.getChild('customer')
         for account in json_res:
             account_id = account['noPartenaireDemandeur']
             customer_id = account['noPartenaireTitulaire']
-
-            customer_logger = self.logger.getChild('customer')
             customer = Customer(self, account_id, customer_id, self._timeout, customer_logger)
-            self._customers.append(customer)
-            await customer.fetch_summary()
-            if customer.contract_id is None:
-                del self._customers[-1]
+            self._all_customers.append(customer)
+
+        self._pending_customers = list(self._all_customers)
+
+    async def _fetch_summaries(self, customers):
+        """Fetch the summaries of the given customers concurrently."""
+        semaphore = asyncio.Semaphore(self.summary_concurrency)
+
+        async def fetch_summary(customer):
+            async with semaphore:
+                await customer.fetch_summary()
+
+        await asyncio.gather(*[fetch_summary(customer) for customer in customers])
+        for customer in customers:
+            if customer in self._pending_customers:
+                self._pending_customers.remove(customer)
+        # Keep the order of the portal
+        self._customers = [customer for customer in self._all_customers
+                           if customer.contract_id is not None and
+                           customer not in self._pending_customers]
+
+    async def fetch_customers(self):
+        """Fetch the summaries of all the customers not fetched yet."""
+        await self._fetch_summaries(list(self._pending_customers))
+
+    async def get_customer(self, contract_id):
+        """Return the customer of a contract, or None if not found.
+
+        Only the summaries needed to find the contract are fetched.
+        """
+        for customer in self._customers:
+            if str(customer.contract_id) == str(contract_id):
+                return customer
+        while self._pending_customers:
+            customer = self._pending_customers[0]
+            await self._fetch_summaries([customer])
+            if str(customer.contract_id) == str(contract_id):
+                return customer
+        return None
 
     @property
     def customers(self):
         """Return Contract list."""
         return self._customers
 
+    async def parse(self, func, *args, size=0):
+        """Return func(*args), run in the parse executor if `size` is large enough.
+
+        `func` and `args` must be picklable with a process executor.
+        """
+        if self.parse_executor is None or size < self.offload_threshold:
+            return func(*args)
+        executor = self.parse_executor
+        if not isinstance(executor, Executor):
+            if self._parse_executor is None:
+                self._parse_executor = PARSE_EXECUTORS[executor](max_workers=PARSE_WORKERS)
+            executor = self._parse_executor
+        return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+
     async def close_session(self):
         """Close current session."""
+        if self._parse_executor is not None:
+            self._parse_executor.shutdown(wait=False)
+            self._parse_executor = None
+        await self._close_portal_sessions()
         if self._session is not None:
             await self._session.close()
+            self._session = None
@@ -1,12 +1,104 @@
 """PyHydroQuebec Consts."""
-from dateutil import tz
+from functools import lru_cache
 
 
-# Always get the time using HydroQuebec Local Time
-HQ_TIMEZONE = tz.gettz('America/Montreal')
+@lru_cache(maxsize=None)
+def get_hq_timezone():
+    """Return the HydroQuebec local timezone, loaded on first use.
 
+    dateutil is slow to import.
+    """
+    from dateutil import tz  # pylint: disable=import-outside-toplevel
+    # Always get the time using HydroQuebec Local Time
+    return tz.gettz('America/Montreal')
+
+
+def __getattr__(name):
+    """Keep HQ_TIMEZONE public, loaded on first use by get_hq_timezone()."""
+    if name == 'HQ_TIMEZONE':
+        return get_hq_timezone()
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+# Seconds before a request (connection included) is abandoned
 REQUESTS_TIMEOUT = 30
+REQUESTS_CONNECT_TIMEOUT = 10
+# Seconds before a login, customer selection or fetch phase is abandoned
+PHASE_TIMEOUT = 120
+# Seconds before the MQTT daemon stops polling an account, and stops a cycle
+ACCOUNT_TIMEOUT = 600
+CYCLE_TIMEOUT = 3600
 REQUESTS_TTL = 1
+CACHE_MAXSIZE = 128
+# Number of days fetched at the same time by the bulk downloads
+BULK_CONCURRENCY = 4
+# Number of days requested at once by the bulk daily downloads
+DAILY_CHUNK_DAYS = 31
+# Days after which a day without data in the portal is not requested again by a sync
+STORE_EMPTY_DAY_DELAY = 3
+# Datasets of Customer.fetch
+FETCH_DATASETS = ('current_period', 'annual', 'monthly', 'daily', 'hourly')
+# Number of datasets fetched at the same time by Customer.fetch
+FETCH_CONCURRENCY = 4
+# Number of customer summaries fetched at the same time during the login
+SUMMARY_CONCURRENCY = 1
+# Maximum number of customer portal sessions kept by a client
+PORTAL_SESSION_POOL_SIZE = 16
+# Shared connector settings, see pyhydroquebec.session.build_connector
+CONNECTOR_LIMIT = 100
+CONNECTOR_LIMIT_PER_HOST = 8
+# Seconds an idle connection is kept open
+CONNECTOR_KEEPALIVE_TIMEOUT = 60
+# Seconds a DNS resolution is cached
+CONNECTOR_DNS_CACHE_TTL = 300
+# Store daily and hourly data in arrays, see pyhydroquebec.series
+COLUMNAR_SERIES = False
+# Base temperature in °C of the heating degree-days, see pyhydroquebec.analytics
+HDD_BASE_TEMPERATURE = 18
+# Account page extractor, see pyhydroquebec.parsers
+SUMMARY_PARSER = 'targeted'
+# Responses of at least this many bytes are parsed in the parse executor, if any
+OFFLOAD_THRESHOLD = 256 * 1024
+# Number of workers of the parse executors built by the client
+PARSE_WORKERS = 2
+# Event loop stalls of at least this many seconds are reported, see pyhydroquebec.monitor
+LOOP_LAG_THRESHOLD = 0.1
+# Seconds between two checks of the event loop
+LOOP_LAG_INTERVAL = 0.1
+# Number of accounts polled at the same time by the MQTT daemon
+MAX_CONCURRENT_ACCOUNTS = 4
+
+# Seconds between two publications of the unchanged MQTT sensor configs and states
+MQTT_REFRESH_INTERVAL = 24 * 3600
+
+# Log in again this many seconds before the access token expires
+TOKEN_EXPIRATION_MARGIN = 60
+
+INFLUX_MEASUREMENT = "pyhydroquebec"
+# Number of lines sent in one InfluxDB write
+INFLUX_BATCH_SIZE = 5000
+
+# Number of tries of a request, 1 disables the retries
+RETRY_ATTEMPTS = 3
+# First retry delay in seconds, doubled for each next try
+RETRY_BACKOFF = 0.5
+RETRY_MAX_BACKOFF = 10
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Only idempotent requests are retried by default
+RETRY_METHODS = ('get',)
+# Portal responses asking us to slow down
+THROTTLE_STATUSES = (429, 503)
+# Maximum number of requests per second of all the clients, None is unlimited
+RATE_LIMIT = None
+RATE_LIMIT_MIN = 0.5
+# Rate applied after the first throttling when there is no rate limit
+RATE_LIMIT_THROTTLED = 5
+# Rate increase in requests per second after each successful request
+RATE_LIMIT_RECOVERY = 0.1
+
+# Upper bounds in seconds of the request and phase duration histograms
+METRICS_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+METRICS_PREFIX = "pyhydroquebec"
 
 LOGGING_LEVELS = ("DEBUG", "INFO", 'WARNING', 'ERROR', 'CRITICAL')
 
@@ -114,6 +206,18 @@ DAILY_MAP = {'total_consumption': {'raw_name': 'consoTotalQuot',
                                      'icon': None,
                                      'device_class': 'temperature'}
              }
+HOURLY_DAY_FIELDS = ('day_mean_temp', 'day_min_temp', 'day_max_temp')
+HOURLY_FIELDS = ('average_temperature',
+                 'lower_price_consumption',
+                 'higher_price_consumption',
+                 'total_consumption')
+HOURLY_DAY_MAP = (('day_mean_temp', 'tempMoyJour'),
+                  ('day_min_temp', 'tempMinJour'),
+                  ('day_max_temp', 'tempMaxJour'))
+HOURLY_MAP = (('lower_price_consumption', 'consoReg'),
+              ('higher_price_consumption', 'consoHaut'),
+              ('total_consumption', 'consoTotal'))
+
 ANNUAL_MAP = (('annual_mean_daily_consumption', 'moyenneKwhJourAnnee'),
               ('annual_total_consumption', 'consoTotalAnnee'),
               ('annual_total_bill', 'montantFactureAnnee'),
@@ -123,6 +227,58 @@ ANNUAL_MAP = (('annual_mean_daily_consumption', 'moyenneKwhJourAnnee'),
               ('annual_date_start', 'dateDebutAnnee'),
               ('annual_date_end', 'dateFinAnnee'))
 
+# Metadata of the numeric monthly and annual values published as MQTT sensors
+MONTHLY_SENSORS = {'nb_day': {'unit': 'days', 'icon': 'mdi:calendar-range',
+                              'device_class': None},
+                   'temperature_mean': {'unit': '°C', 'icon': None,
+                                        'device_class': 'temperature'},
+                   'mean_consumption_per_day': {'unit': 'Kwh', 'icon': 'mdi:flash',
+                                                'device_class': None},
+                   'lower_price_consumption': {'unit': 'Kwh', 'icon': 'mdi:flash',
+                                               'device_class': None},
+                   'higher_price_consumption': {'unit': 'Kwh', 'icon': 'mdi:flash',
+                                                'device_class': None},
+                   'total_consumption': {'unit': 'Kwh', 'icon': 'mdi:flash',
+                                         'device_class': None},
+                   }
+
+ANNUAL_SENSORS = {'annual_mean_daily_consumption': {'unit': 'Kwh', 'icon': 'mdi:flash',
+                                                    'device_class': None},
+                  'annual_total_consumption': {'unit': 'Kwh', 'icon': 'mdi:flash',
+                                               'device_class': None},
+                  'annual_total_bill': {'unit': '$', 'icon': 'mdi:currency-usd',
+                                        'device_class': None},
+                  'annual_mean_daily_bill': {'unit': '$', 'icon': 'mdi:currency-usd',
+                                             'device_class': None},
+                  'annual_length': {'unit': 'days', 'icon': 'mdi:calendar-range',
+                                    'device_class': None},
+                  'annual_kwh_price_cent': {'unit': '¢', 'icon': 'mdi:currency-usd',
+                                            'device_class': None},
+                  }
+
+# MQTT daemon sensor groups published by default
+SENSOR_GROUPS = {'current_period': True,
+                 'yesterday': True,
+                 'hourly': False,
+                 'monthly': False,
+                 'annual': False}
+
+# Backfill of the historical hourly data by the MQTT daemon
+BACKFILL_DAYS = 30
+# Maximum number of days fetched by cycle, to spare the portal
+BACKFILL_MAX_DAYS = 7
+# Number of hourly points by MQTT message
+BACKFILL_BATCH_SIZE = 168
+BACKFILL_CONCURRENCY = 2
+
+# MQTT daemon scheduler, in seconds
+# Checks of yesterday's data until the portal publishes it
+SCHEDULE_FINAL_INTERVAL = 3600
+# Maximum delay added to the polls of each contract, to spread the load
+SCHEDULE_JITTER = 300
+# Seconds between two checks of the MQTT daemon config file
+CONFIG_WATCH_INTERVAL = 30
+
 OVERVIEW_TPL = ("""
 ##################################
 # Hydro Quebec data for contract #
@@ -1,17 +1,26 @@
 """PyHydroQuebec Client Module."""
+import asyncio
+from collections import namedtuple
 from datetime import datetime, timedelta
-import json
-
-from bs4 import BeautifulSoup
-import cachetools
+from functools import partial
 
+from pyhydroquebec.cache import freeze_params
 from pyhydroquebec.consts import (ANNUAL_DATA_URL, CONTRACT_CURRENT_URL_1,
                                   CONTRACT_CURRENT_URL_2, CONTRACT_URL_3,
                                   DAILY_DATA_URL, HOURLY_DATA_URL_1,
                                   HOURLY_DATA_URL_2, MONTHLY_DATA_URL,
-                                  REQUESTS_TTL, DAILY_MAP, MONTHLY_MAP,
-                                  ANNUAL_MAP, CURRENT_MAP,
-                                  )
+                                  BULK_CONCURRENCY,
+                                  DAILY_CHUNK_DAYS, FETCH_DATASETS, FETCH_CONCURRENCY,
+                                  get_hq_timezone)
+from pyhydroquebec.decoders import (decode_json, extract_current, extract_annual, extract_monthly,
+                                    extract_daily, extract_hourly_day, extract_hourly)
+from pyhydroquebec.error import PyHydroQuebecError
+from pyhydroquebec.parsers import parse_summary
+from pyhydroquebec.series import DailySeries, HourlySeries
+
+# Result of Customer.fetch. `data` maps each fetched dataset to its data,
+# `errors` maps each failed dataset to its exception.
+FetchResult = namedtuple('FetchResult', ('day', 'data', 'errors'))
 
 
 class Customer():
@@ -36,93 +45,167 @@ class Customer():
         self._compare_annual_data = {}
         self._current_monthly_data = {}
         self._compare_monthly_data = {}
-        self._current_daily_data = {}
-        self._compare_daily_data = {}
-        self._hourly_data = {}
+        if client.columnar:
+            self._current_daily_data = DailySeries()
+            self._compare_daily_data = DailySeries()
+            self._hourly_data = HourlySeries()
+        else:
+            self._current_daily_data = {}
+            self._compare_daily_data = {}
+            self._hourly_data = {}
+
+    async def _http_request(self, url, method, **kwargs):
+        """Run HTTP/S request using the portal session of this customer."""
+        return await self._client.http_request(url, method, customer_id=self.customer_id,
+                                               **kwargs)
+
+    async def _read_json(self, res):
+        """Decode the JSON body of a response, in the parse executor if it is large."""
+        raw = await res.read()
+        return await self._client.parse(decode_json, raw, size=len(raw))
+
+    async def _cached(self, endpoint, fetcher, params=None):
+        """Return parsed data for an endpoint using the client response cache."""
+        key = (self.customer_id, endpoint, freeze_params(params))
+
+        async def pinned_fetcher():
+            async with self._client.use_portal_session(self.customer_id):
+                return await fetcher()
+
+        return await self._client.run_phase('fetch_' + endpoint,
+                                            self._client.cache.get_or_fetch(key, pinned_fetcher))
 
-    @cachetools.cached(cachetools.TTLCache(maxsize=128, ttl=60*REQUESTS_TTL))
     async def fetch_summary(self):
         """Fetch data from overview page.
 
         UI URL: https://session.hydroquebec.com/portail/en/group/clientele/gerer-mon-compte
         """
+        self._balance, self.contract_id = await self._cached('summary', self._fetch_summary)
+
+    async def _fetch_summary(self):
+        """Fetch and parse the overview page."""
         self._logger.info("Fetching summary page")
         await self._client.select_customer(self.account_id, self.customer_id)
 
-        res = await self._client.http_request(CONTRACT_URL_3, "get")
+        res = await self._http_request(CONTRACT_URL_3, "get")
         content = await res.text()
-        soup = BeautifulSoup(content, 'html.parser')
-        try:
-            raw_balance = soup.find('p', {'class': 'solde'}).text
-            self._balance = float(raw_balance[:-2].replace(",", ".").
-                                  replace("\xa0", ""))
-
-            raw_contract_id = soup.find('div', {'class': 'contrat'}).text
-            self.contract_id = (raw_contract_id
-                                .split("Contrat", 1)[-1]
-                                .replace("\t", "")
-                                .replace("\n", ""))
-
-        except AttributeError:
+        raw_balance, raw_contract_id = await self._client.parse(
+            parse_summary, content, self._client.summary_parser, size=len(content))
+        balance = None
+        contract_id = None
+        if raw_balance is None or raw_contract_id is None:
             self._logger.info("Customer has no contract")
+        if raw_balance is not None:
+            balance = float(raw_balance[:-2].replace(",", ".").
+                            replace("\xa0", ""))
+            if raw_contract_id is not None:
+                contract_id = (raw_contract_id
+                               .split("Contrat", 1)[-1]
+                               .replace("\t", "")
+                               .replace("\n", ""))
 
         # Needs to load the consumption profile page to not break
         # the next loading of the other pages
-        await self._client.http_request(CONTRACT_CURRENT_URL_1, "get")
+        await self._http_request(CONTRACT_CURRENT_URL_1, "get")
+        return balance, contract_id
 
     @property
     def balance(self):
         """Return the collected balance."""
         return self._balance
 
-    @cachetools.cached(cachetools.TTLCache(maxsize=128, ttl=60*REQUESTS_TTL))
     async def fetch_current_period(self):
         """Fetch data of the current period.
 
         UI URL: https://session.hydroquebec.com/portail/en/group/clientele/portrait-de-consommation
         """
+        self._current_period = await self._cached('current_period',
+                                                  self._fetch_current_period)
+
+    async def _fetch_current_period(self):
+        """Fetch and parse the current period data."""
         self._logger.info("Fetching current period data")
         await self._client.select_customer(self.account_id, self.customer_id)
 
-        await self._client.http_request(CONTRACT_CURRENT_URL_1, "get")
+        await self._http_request(CONTRACT_CURRENT_URL_1, "get")
 
         headers = {"Content-Type": "application/json"}
-        res = await self._client.http_request(CONTRACT_CURRENT_URL_2, "get", headers=headers)
-        text_res = await res.text()
+        res = await self._http_request(CONTRACT_CURRENT_URL_2, "get", headers=headers)
         # We can not use res.json() because the response header are not application/json
-        json_res = json.loads(text_res)['results'][0]
+        json_res = await self._read_json(res)
+        return extract_current(json_res['results'][0])
 
-        self._current_period = {}
-        for key, data in CURRENT_MAP.items():
-            self._current_period[key] = json_res[data['raw_name']]
+    async def fetch(self, datasets=FETCH_DATASETS, day=None, concurrency=FETCH_CONCURRENCY):
+        """Fetch several datasets concurrently and return a FetchResult.
+
+        `datasets` are in FETCH_DATASETS, the daily and hourly data are those
+        of `day` (yesterday by default). The customer is selected once, then
+        at most `concurrency` datasets are fetched at the same time. A failed
+        dataset does not stop the others.
+        """
+        unknown = set(datasets) - set(FETCH_DATASETS)
+        if unknown:
+            raise PyHydroQuebecError("Unknown datasets: {}".format(", ".join(sorted(unknown))))
+        if day is None:
+            day = datetime.now(get_hq_timezone()) - timedelta(days=1)
+        if hasattr(day, "strftime"):
+            day = day.strftime("%Y-%m-%d")
+        fetchers = {'current_period': self.fetch_current_period,
+                    'annual': self.fetch_annual_data,
+                    'monthly': self.fetch_monthly_data,
+                    'daily': partial(self.fetch_daily_data, day, day),
+                    'hourly': partial(self.fetch_hourly_data, day)}
+        names = [name for name in FETCH_DATASETS if name in datasets]
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fetch_dataset(name):
+            async with semaphore:
+                await fetchers[name]()
+
+        with self._client.metrics.phase('fetch_plan'):
+            async with self._client.use_portal_session(self.customer_id):
+                await self._client.select_customer(self.account_id, self.customer_id)
+                results = await asyncio.gather(*[fetch_dataset(name) for name in names],
+                                               return_exceptions=True)
+        errors = {name: result for name, result in zip(names, results)
+                  if isinstance(result, Exception)}
+        data = {'current_period': self.current_period,
+                'annual': self.current_annual_data,
+                'monthly': self.current_monthly_data,
+                'daily': self.current_daily_data.get(day),
+                'hourly': self.hourly_data.get(day)}
+        return FetchResult(day, {name: data[name] for name in names if name not in errors},
+                           errors)
 
     @property
     def current_period(self):
         """Return collected current period data."""
         return self._current_period
 
-    @cachetools.cached(cachetools.TTLCache(maxsize=128, ttl=60*REQUESTS_TTL))
     async def fetch_annual_data(self):
         """Fetch data of the current and last year.
 
         API URL: https://cl-ec-spring.hydroquebec.com/portail/fr/group/clientele/
         portrait-de-consommation/resourceObtenirDonneesConsommationAnnuelles
         """
+        current, compare = await self._cached('annual', self._fetch_annual_data)
+        self._current_annual_data.update(current)
+        self._compare_annual_data.update(compare)
+
+    async def _fetch_annual_data(self):
+        """Fetch and parse the annual data."""
         self._logger.info("Fetching annual data")
         await self._client.select_customer(self.account_id, self.customer_id)
         headers = {"Content-Type": "application/json"}
-        res = await self._client.http_request(ANNUAL_DATA_URL, "get", headers=headers)
+        res = await self._http_request(ANNUAL_DATA_URL, "get", headers=headers)
         # We can not use res.json() because the response header are not application/json
-        json_res = json.loads(await res.text())
+        json_res = await self._read_json(res)
         if not json_res.get('results'):
-            return
+            return {}, {}
         json_res = json_res['results'][0]
-
-        for key, raw_key in ANNUAL_MAP:
-            self._current_annual_data[key] = json_res['courant'][raw_key]
-
-            if 'compare' in json_res:
-                self._compare_annual_data[key] = json_res['compare'][raw_key]
+        current = extract_annual(json_res['courant'])
+        compare = extract_annual(json_res['compare']) if 'compare' in json_res else {}
+        return current, compare
 
     @property
     def current_annual_data(self):
@@ -134,33 +217,33 @@ class Customer():
         """Return collected previous year data."""
         return self._compare_annual_data
 
-    @cachetools.cached(cachetools.TTLCache(maxsize=128, ttl=60*REQUESTS_TTL))
     async def fetch_monthly_data(self):
         """Fetch data of the current and last year.
 
         API URL: https://cl-ec-spring.hydroquebec.com/portail/fr/group/clientele/
         portrait-de-consommation/resourceObtenirDonneesConsommationMensuelles
         """
+        current, compare = await self._cached('monthly', self._fetch_monthly_data)
+        self._current_monthly_data.update(current)
+        self._compare_monthly_data.update(compare)
+
+    async def _fetch_monthly_data(self):
+        """Fetch and parse the monthly data."""
         self._logger.info("Fetching monthly data")
         await self._client.select_customer(self.account_id, self.customer_id)
         headers = {"Content-Type": "application/json"}
-        res = await self._client.http_request(MONTHLY_DATA_URL, "get", headers=headers)
-        text_res = await res.text()
+        res = await self._http_request(MONTHLY_DATA_URL, "get", headers=headers)
         # We can not use res.json() because the response header are not application/json
-        json_res = json.loads(text_res)
-        if not json_res.get('results'):
-            return
+        json_res = await self._read_json(res)
+        current = {}
+        compare = {}
 
         for month_data in json_res.get('results', []):
             month = month_data['courant']['dateDebutMois'][:-3]
-            self._current_monthly_data[month] = {}
+            current[month] = extract_monthly(month_data['courant'])
             if 'compare' in month_data:
-                self._compare_monthly_data[month] = {}
-
-            for key, raw_key in MONTHLY_MAP:
-                self._current_monthly_data[month][key] = month_data['courant'][raw_key]
-                if 'compare' in month_data:
-                    self._compare_monthly_data[month][key] = month_data['compare'][raw_key]
+                compare[month] = extract_monthly(month_data['compare'])
+        return current, compare
 
     @property
     def current_monthly_data(self):
@@ -172,7 +255,6 @@ class Customer():
         """Return collected monthly data of the previous year."""
         return self._compare_monthly_data
 
-    @cachetools.cached(cachetools.TTLCache(maxsize=128, ttl=60*REQUESTS_TTL))
     async def fetch_daily_data(self, start_date=None, end_date=None):
         """Fetch data of the current and last year.
 
@@ -180,7 +262,6 @@ class Customer():
         portrait-de-consommation/resourceObtenirDonneesQuotidiennesConsommation
         """
         self._logger.info("Fetching daily data between %s and %s", start_date, end_date)
-        await self._client.select_customer(self.account_id, self.customer_id)
         if start_date is None:
             # Get yesterday
             yesterday = datetime.now() - timedelta(days=1)
@@ -208,28 +289,55 @@ class Customer():
                 return
             end_date_str = end_date
 
-        headers = {"Content-Type": "application/json"}
         params = {"dateDebut": start_date_str}
         if end_date_str:
             params.update({"dateFin": end_date_str})
-        res = await self._client.http_request(DAILY_DATA_URL, "get",
-                                              params=params, headers=headers)
-        text_res = await res.text()
+        current, compare = await self._cached('daily',
+                                              partial(self._fetch_daily_data, params),
+                                              params)
+        self._current_daily_data.update(current)
+        self._compare_daily_data.update(compare)
+
+    async def _fetch_daily_data(self, params):
+        """Fetch and parse the daily data."""
+        await self._client.select_customer(self.account_id, self.customer_id)
+        headers = {"Content-Type": "application/json"}
+        res = await self._http_request(DAILY_DATA_URL, "get",
+                                       params=params, headers=headers)
         # We can not use res.json() because the response header are not application/json
-        json_res = json.loads(text_res)
-        if not json_res.get('results'):
-            return
+        json_res = await self._read_json(res)
+        current = {}
+        compare = {}
 
         for day_data in json_res.get('results', []):
             day = day_data['courant']['dateJourConso']
-            self._current_daily_data[day] = {}
+            current[day] = extract_daily(day_data['courant'])
             if 'compare' in day_data:
-                self._compare_daily_data[day] = {}
+                compare[day] = extract_daily(day_data['compare'])
+        return current, compare
+
+    async def iter_daily_data(self, start_date, end_date, chunk_days=DAILY_CHUNK_DAYS):
+        """Fetch daily data of a date range and yield (day, data) chunk by chunk.
+
+        Days are not kept in `current_daily_data`.
+        """
+        if not hasattr(start_date, "strftime"):
+            start_date = datetime.strptime(start_date, "%Y-%m-%d")
+        if not hasattr(end_date, "strftime"):
+            end_date = datetime.strptime(end_date, "%Y-%m-%d")
+        self._logger.info("Fetching daily data between %s and %s", start_date, end_date)
 
-            for key, data in DAILY_MAP.items():
-                self._current_daily_data[day][key] = day_data['courant'][data['raw_name']]
-                if 'compare' in day_data:
-                    self._compare_daily_data[day][key] = day_data['compare'][data['raw_name']]
+        chunk_start = start_date
+        while chunk_start <= end_date:
+            chunk_end = min(chunk_start + timedelta(days=chunk_days - 1), end_date)
+            params = {"dateDebut": chunk_start.strftime("%Y-%m-%d"),
+                      "dateFin": chunk_end.strftime("%Y-%m-%d")}
+            current, _ = await self._cached('daily',
+                                            partial(self._fetch_daily_data, params),
+                                            params)
+            for day in sorted(current):
+                yield day, current[day]
+            chunk_start = chunk_end + timedelta(days=1)
 
     @property
     def current_daily_data(self):
@@ -241,7 +349,6 @@ class Customer():
         """Return collected daily data of the previous year."""
         return self._compare_daily_data
 
-    @cachetools.cached(cachetools.TTLCache(maxsize=128, ttl=60*REQUESTS_TTL))
     async def fetch_hourly_data(self, day=None):
         """Fetch data of the current and last year.
 
@@ -249,9 +356,6 @@ class Customer():
         portrait-de-consommation/resourceObtenirDonneesConsommationHoraires
         """
         self._logger.info("Fetching hourly data for %s", day)
-        await self._client.select_customer(self.account_id, self.customer_id)
-        await self._client.select_customer(self.account_id, self.customer_id)
-
         if day is None:
             # Get yesterday
             yesterday = datetime.now() - timedelta(days=1)
@@ -266,31 +370,71 @@ class Customer():
                 return
             day_str = day
 
-        params = {"dateDebut": day_str, "dateFin": day_str}
-        res = await self._client.http_request(HOURLY_DATA_URL_2, "get",
-                                              params=params, )
+        self._hourly_data[day_str] = await self._cached(
+            'hourly', partial(self._fetch_hourly_data, day_str), day_str)
+
+    async def _fetch_hourly_data(self, day_str):
+        """Fetch and parse the hourly data of one day.
+
+        Weather and consumption are requested concurrently.
+        """
+        await self._client.select_customer(self.account_id, self.customer_id)
+
+        weather_res, consumption_res = await asyncio.gather(
+            self._http_request(HOURLY_DATA_URL_2, "get",
+                               params={"dateDebut": day_str, "dateFin": day_str}),
+            self._http_request(HOURLY_DATA_URL_1, "get", params={"date": day_str}))
+
         # We can not use res.json() because the response header are not application/json
-        json_res = json.loads(await res.text())
-
-        self._hourly_data[day_str] = {
-                'day_mean_temp': json_res['results'][0]['tempMoyJour'],
-                'day_min_temp': json_res['results'][0]['tempMinJour'],
-                'day_max_temp': json_res['results'][0]['tempMaxJour'],
-                'hours': {},
-                }
+        weather = (await self._read_json(weather_res))['results'][0]
+        hourly_data = extract_hourly_day(weather)
         tmp_hour_dict = dict((h, {}) for h in range(24))
-        for hour, temp in enumerate(json_res['results'][0]['listeTemperaturesHeure']):
+        for hour, temp in enumerate(weather['listeTemperaturesHeure']):
             tmp_hour_dict[hour]['average_temperature'] = temp
 
-        params = {"date": day_str}
-        res = await self._client.http_request(HOURLY_DATA_URL_1, "get", params=params)
-        # We can not use res.json() because the response header are not application/json
-        json_res = json.loads(await res.text())
-        for hour, data in enumerate(json_res['results']['listeDonneesConsoEnergieHoraire']):
-            tmp_hour_dict[hour]['lower_price_consumption'] = data['consoReg']
-            tmp_hour_dict[hour]['higher_price_consumption'] = data['consoHaut']
-            tmp_hour_dict[hour]['total_consumption'] = data['consoTotal']
-        self._hourly_data[day_str]['hours'] = tmp_hour_dict.copy()
+        consumption = (await self._read_json(consumption_res))['results']
+        for hour, data in enumerate(consumption['listeDonneesConsoEnergieHoraire']):
+            tmp_hour_dict[hour].update(extract_hourly(data))
+        hourly_data['hours'] = tmp_hour_dict
+        return hourly_data
+
+    async def iter_hourly_data(self, start_date, end_date, concurrency=BULK_CONCURRENCY):
+        """Fetch hourly data of a date range and yield (day, data) as days arrive.
+
+        At most `concurrency` days are fetched at the same time. Days are yielded
+        in completion order and are not kept in `hourly_data`.
+        Days without data are skipped.
+        """
+        if not hasattr(start_date, "strftime"):
+            start_date = datetime.strptime(start_date, "%Y-%m-%d")
+        if not hasattr(end_date, "strftime"):
+            end_date = datetime.strptime(end_date, "%Y-%m-%d")
+        self._logger.info("Fetching hourly data between %s and %s", start_date, end_date)
+        await self._client.select_customer(self.account_id, self.customer_id)
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fetch_day(day_str):
+            async with semaphore:
+                try:
+                    return day_str, await self._cached(
+                        'hourly', partial(self._fetch_hourly_data, day_str), day_str)
+                except (KeyError, IndexError, TypeError):
+                    return day_str, None
+
+        days = [(start_date + timedelta(days=offset)).strftime("%Y-%m-%d")
+                for offset in range((end_date - start_date).days + 1)]
+        tasks = [asyncio.ensure_future(fetch_day(day_str)) for day_str in days]
+        try:
+            for task in asyncio.as_completed(tasks):
+                day_str, hourly_data = await task
+                if hourly_data is None:
+                    self._logger.warning("No hourly data available for %s", day_str)
+                    continue
+                yield day_str, hourly_data
+        finally:
+            for task in tasks:
+                task.cancel()
 
     @property
     def hourly_data(self):
@@ -0,0 +1,73 @@
+"""PyHydroQuebec Decoders Module.
+
+Decode the JSON responses of the portal and remap their records.
+The portal sends JSON with a text/html content type, so the raw body is
+decoded here, with the fastest installed backend:
+* orjson
+* ujson
+* json (standard library)
+Record extractors are built once from the *_MAP tables of consts.
+"""
+import importlib
+import json
+from operator import itemgetter
+
+from pyhydroquebec.consts import (ANNUAL_MAP, CURRENT_MAP, DAILY_MAP, HOURLY_DAY_MAP,
+                                  HOURLY_MAP, MONTHLY_MAP)
+
+JSON_BACKENDS = ('orjson', 'ujson')
+
+_LOADS = None
+
+
+def _get_loads():
+    """Return the loads function of the fastest installed backend."""
+    global _LOADS  # pylint: disable=global-statement
+    if _LOADS is None:
+        _LOADS = json.loads
+        for name in JSON_BACKENDS:
+            try:
+                _LOADS = importlib.import_module(name).loads
+                break
+            except ImportError:
+                continue
+    return _LOADS
+
+
+def json_backend():
+    """Return the name of the JSON backend used."""
+    return _get_loads().__module__
+
+
+def decode_json(raw):
+    """Decode a JSON body, `raw` is bytes or str."""
+    return _get_loads()(raw)
+
+
+def _pairs(field_map):
+    """Return the (key, raw key) pairs of a *_MAP table."""
+    if isinstance(field_map, dict):
+        return tuple((key, data['raw_name']) for key, data in field_map.items())
+    return tuple(field_map)
+
+
+def record_extractor(field_map):
+    """Build a function returning the fields of a raw record renamed by `field_map`.
+
+    `field_map` is a *_MAP table: (key, raw key) pairs or a dict of dicts
+    with a `raw_name`.
+    """
+    pairs = _pairs(field_map)
+    keys = tuple(key for key, _ in pairs)
+    getter = itemgetter(*(raw_key for _, raw_key in pairs))
+    if len(pairs) == 1:
+        return lambda record: {keys[0]: getter(record)}
+    return lambda record: dict(zip(keys, getter(record)))
+
+
+extract_current = record_extractor(CURRENT_MAP)
+extract_annual = record_extractor(ANNUAL_MAP)
+extract_monthly = record_extractor(MONTHLY_MAP)
+extract_daily = record_extractor(DAILY_MAP)
+extract_hourly_day = record_extractor(HOURLY_DAY_MAP)
+extract_hourly = record_extractor(HOURLY_MAP)
@@ -8,6 +8,24 @@ class PyHydroQuebecError(Exception):
 class PyHydroQuebecHTTPError(PyHydroQuebecError):
     """HTTP PyHydroQuebec Error."""
 
+    def __init__(self, message, status=None):
+        """Create new PyHydroQuebecHTTPError, `status` is None for connection errors."""
+        PyHydroQuebecError.__init__(self, message)
+        self.status = status
+
+
+class PyHydroQuebecSessionExpiredError(PyHydroQuebecHTTPError):
+    """Session expired PyHydroQuebec Error."""
+
+
+class PyHydroQuebecTimeoutError(PyHydroQuebecHTTPError):
+    """Timeout PyHydroQuebec Error."""
+
+    def __init__(self, message, phase=None):
+        """Create new PyHydroQuebecTimeoutError, `phase` is the phase or request which expired."""
+        PyHydroQuebecHTTPError.__init__(self, message)
+        self.phase = phase
+
 
 class PyHydroQuebecAnnualError(PyHydroQuebecError):
     """Annual PyHydroQuebec Error."""
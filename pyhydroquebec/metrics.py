@@ -0,0 +1,194 @@
+"""PyHydroQuebec Metrics Module.
+
+Instrumentation of the portal requests and of the client phases
+(login, select_customer and each fetch_*).
+Listeners get every RequestEvent and PhaseEvent as they happen, and
+aggregated histograms can be exported as Prometheus text or as a dict.
+"""
+from collections import namedtuple
+from contextlib import contextmanager
+import time
+
+from pyhydroquebec.consts import (METRICS_BUCKETS, METRICS_PREFIX,
+                                  LOGIN_URL_3, LOGIN_URL_4, LOGIN_URL_5, LOGIN_URL_6,
+                                  LOGIN_URL_7, CONTRACT_URL_1, CONTRACT_URL_2, CONTRACT_URL_3,
+                                  CONTRACT_CURRENT_URL_1, CONTRACT_CURRENT_URL_2,
+                                  ANNUAL_DATA_URL, MONTHLY_DATA_URL, DAILY_DATA_URL,
+                                  HOURLY_DATA_URL_1, HOURLY_DATA_URL_2)
+
+ENDPOINT_NAMES = {LOGIN_URL_3: 'authenticate',
+                  LOGIN_URL_4: 'security_config',
+                  LOGIN_URL_5: 'authorize',
+                  LOGIN_URL_6: 'access_code',
+                  LOGIN_URL_7: 'relations',
+                  CONTRACT_URL_1: 'contract_info',
+                  CONTRACT_URL_2: 'contract_session',
+                  CONTRACT_URL_3: 'summary',
+                  CONTRACT_CURRENT_URL_1: 'consumption_profile',
+                  CONTRACT_CURRENT_URL_2: 'current_period',
+                  ANNUAL_DATA_URL: 'annual',
+                  MONTHLY_DATA_URL: 'monthly',
+                  DAILY_DATA_URL: 'daily',
+                  HOURLY_DATA_URL_1: 'hourly_consumption',
+                  HOURLY_DATA_URL_2: 'hourly_weather'}
+
+# `status` is None if the request failed before getting a response
+RequestEvent = namedtuple('RequestEvent', ('endpoint', 'method', 'status', 'latency', 'size',
+                                           'customer_id'))
+# `error` is the name of the exception which ended the phase or None
+PhaseEvent = namedtuple('PhaseEvent', ('phase', 'duration', 'error'))
+
+
+def endpoint_name(url):
+    """Return the short name of a portal url."""
+    url = url.split("?", 1)[0].split("#", 1)[0]
+    if url in ENDPOINT_NAMES:
+        return ENDPOINT_NAMES[url]
+    # Callback url and unknown pages
+    return url.rstrip("/").rsplit("/", 1)[-1] or "other"
+
+
+class Histogram():
+    """Cumulative histogram with fixed buckets, as Prometheus does."""
+
+    def __init__(self, buckets=METRICS_BUCKETS):
+        """Create new Histogram object."""
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        """Add a value."""
+        self.count += 1
+        self.sum += value
+        for index, bucket in enumerate(self.buckets):
+            if value <= bucket:
+                self.counts[index] += 1
+
+    def to_dict(self):
+        """Return the histogram as a dict."""
+        return {'count': self.count,
+                'sum': round(self.sum, 6),
+                'buckets': dict(zip((str(bucket) for bucket in self.buckets), self.counts))}
+
+
+def _labels(**labels):
+    """Format Prometheus labels."""
+    return ",".join('{}="{}"'.format(key, str(value).replace('"', '\\"'))
+                    for key, value in labels.items())
+
+
+class Metrics():
+    """Request and phase metrics of one or several clients."""
+
+    def __init__(self, buckets=METRICS_BUCKETS):
+        """Create new Metrics object."""
+        self.buckets = buckets
+        self._listeners = []
+        self.reset()
+
+    def reset(self):
+        """Reset the collected metrics, listeners are kept."""
+        self.request_latency = {}
+        self.request_count = {}
+        self.response_bytes = {}
+        self.phase_duration = {}
+        self.phase_errors = {}
+
+    def add_listener(self, listener):
+        """Add a callback called with every RequestEvent and PhaseEvent."""
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        """Remove a callback."""
+        self._listeners.remove(listener)
+
+    def _notify(self, event):
+        """Send an event to the listeners."""
+        for listener in self._listeners:
+            listener(event)
+
+    def record_request(self, event):
+        """Record a finished portal request."""
+        if event.endpoint not in self.request_latency:
+            self.request_latency[event.endpoint] = Histogram(self.buckets)
+        self.request_latency[event.endpoint].observe(event.latency)
+        key = (event.endpoint, str(event.status))
+        self.request_count[key] = self.request_count.get(key, 0) + 1
+        self.response_bytes[event.endpoint] = (self.response_bytes.get(event.endpoint, 0) +
+                                               (event.size or 0))
+        self._notify(event)
+
+    def record_phase(self, event):
+        """Record a finished phase."""
+        if event.phase not in self.phase_duration:
+            self.phase_duration[event.phase] = Histogram(self.buckets)
+        self.phase_duration[event.phase].observe(event.duration)
+        if event.error is not None:
+            self.phase_errors[event.phase] = self.phase_errors.get(event.phase, 0) + 1
+        self._notify(event)
+
+    @contextmanager
+    def phase(self, name):
+        """Time the enclosed block as the phase `name`."""
+        start = time.monotonic()
+        error = None
+        try:
+            yield
+        except BaseException as exp:
+            error = type(exp).__name__
+            raise
+        finally:
+            self.record_phase(PhaseEvent(name, time.monotonic() - start, error))
+
+    def to_dict(self):
+        """Return the collected metrics as a dict, to be sent as JSON."""
+        requests = {}
+        for (endpoint, status), count in self.request_count.items():
+            requests.setdefault(endpoint, {'status': {}})['status'][status] = count
+        for endpoint, histogram in self.request_latency.items():
+            requests[endpoint]['latency'] = histogram.to_dict()
+            requests[endpoint]['bytes'] = self.response_bytes.get(endpoint, 0)
+        phases = {phase: dict(histogram.to_dict(), errors=self.phase_errors.get(phase, 0))
+                  for phase, histogram in self.phase_duration.items()}
+        return {'requests': requests, 'phases': phases}
+
+    def to_prometheus(self, prefix=METRICS_PREFIX):
+        """Return the collected metrics in the Prometheus text format."""
+        lines = []
+
+        def add_histogram(name, help_text, label, histograms):
+            lines.append("# HELP {}_{} {}".format(prefix, name, help_text))
+            lines.append("# TYPE {}_{} histogram".format(prefix, name))
+            for value, histogram in sorted(histograms.items()):
+                for bucket, count in zip(histogram.buckets, histogram.counts):
+                    lines.append("{}_{}_bucket{{{}}} {}".format(
+                        prefix, name, _labels(**{label: value, 'le': bucket}), count))
+                lines.append("{}_{}_bucket{{{}}} {}".format(
+                    prefix, name, _labels(**{label: value, 'le': '+Inf'}), histogram.count))
+                lines.append("{}_{}_sum{{{}}} {}".format(
+                    prefix, name, _labels(**{label: value}), histogram.sum))
+                lines.append("{}_{}_count{{{}}} {}".format(
+                    prefix, name, _labels(**{label: value}), histogram.count))
+
+        def add_counter(name, help_text, values):
+            lines.append("# HELP {}_{} {}".format(prefix, name, help_text))
+            lines.append("# TYPE {}_{} counter".format(prefix, name))
+            for labels, value in sorted(values.items()):
+                lines.append("{}_{}{{{}}} {}".format(
+                    prefix, name, _labels(**dict(labels)), value))
+
+        add_histogram("request_duration_seconds", "Portal request latency.",
+                      "endpoint", self.request_latency)
+        add_counter("requests_total", "Portal requests by endpoint and status.",
+                    {(('endpoint', endpoint), ('status', status)): count
+                     for (endpoint, status), count in self.request_count.items()})
+        add_counter("response_bytes_total", "Portal response size.",
+                    {(('endpoint', endpoint),): size
+                     for endpoint, size in self.response_bytes.items()})
+        add_histogram("phase_duration_seconds", "Duration of login, customer selection "
+                      "and fetches.", "phase", self.phase_duration)
+        add_counter("phase_errors_total", "Phases ended by an exception.",
+                    {(('phase', phase),): count for phase, count in self.phase_errors.items()})
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,120 @@
+"""PyHydroQuebec Monitor Module.
+
+Detect the stalls of the event loop, ie parsing or other CPU bound code
+blocking every in-flight request. A heartbeat task measures how late it
+wakes up and a watchdog thread samples the stack of the loop thread while
+it is late, to tell which coroutine blocked the loop.
+"""
+import asyncio
+from collections import namedtuple
+import inspect
+import logging
+import sys
+import threading
+import time
+
+from pyhydroquebec.consts import LOOP_LAG_THRESHOLD, LOOP_LAG_INTERVAL
+from pyhydroquebec.metrics import PhaseEvent
+
+# `coroutine` is the qualified name of the innermost coroutine running
+# during the stall and `location` the file:line executed, None if the
+# stall was not sampled
+LoopStall = namedtuple('LoopStall', ('duration', 'coroutine', 'location'))
+
+
+def _blocking_code(frame):
+    """Return the innermost coroutine name and the location of a frame stack."""
+    location = "{}:{}".format(frame.f_code.co_filename, frame.f_lineno)
+    while frame is not None:
+        # The CO_* flags are set at runtime from the code flags, pylint can not see them
+        if frame.f_code.co_flags & (inspect.CO_COROUTINE |  # pylint: disable=no-member
+                                    inspect.CO_ASYNC_GENERATOR):  # pylint: disable=no-member
+            return getattr(frame.f_code, 'co_qualname', frame.f_code.co_name), location
+        frame = frame.f_back
+    return None, location
+
+
+class LoopLagMonitor():
+    """Report the event loop stalls of at least `threshold` seconds.
+
+    Stalls are logged, kept in `stalls` (the last `history` ones) and
+    recorded as the 'loop_stall' phase of `metrics` if set.
+    """
+
+    def __init__(self, threshold=LOOP_LAG_THRESHOLD, interval=LOOP_LAG_INTERVAL,
+                 logger=None, metrics=None, history=100):
+        """Create new LoopLagMonitor object."""
+        self.threshold = threshold
+        self.interval = interval
+        self.metrics = metrics
+        self.history = history
+        self.stalls = []
+        self._logger = logger or logging.getLogger('pyhydroquebec').getChild('monitor')
+        self._task = None
+        self._watchdog = None
+        self._stopped = threading.Event()
+        self._thread_id = None
+        # Monotonic time of the last heartbeat and the sample taken after it
+        self._beat = None
+        self._sample = None
+
+    async def start(self):
+        """Start monitoring the running loop."""
+        if self._task is not None:
+            return
+        self._thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.ensure_future(self._heartbeat())
+        self._watchdog = threading.Thread(target=self._watch, name="pyhydroquebec-monitor",
+                                          daemon=True)
+        self._watchdog.start()
+
+    async def stop(self):
+        """Stop monitoring."""
+        if self._task is None:
+            return
+        self._stopped.set()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._watchdog.join()
+        self._watchdog = None
+
+    async def _heartbeat(self):
+        """Measure the delay of each wake up."""
+        while True:
+            start = time.monotonic()
+            self._beat = start
+            await asyncio.sleep(self.interval)
+            lag = time.monotonic() - start - self.interval
+            if lag >= self.threshold:
+                self._report(lag, start)
+
+    def _watch(self):
+        """Sample the stack of the loop thread when the heartbeat is late."""
+        while not self._stopped.wait(self.threshold / 2):
+            beat = self._beat
+            if time.monotonic() - beat < self.interval + self.threshold:
+                continue
+            if self._sample is not None and self._sample[0] == beat:
+                continue
+            frame = sys._current_frames().get(self._thread_id)  # pylint: disable=protected-access
+            if frame is not None:
+                self._sample = (beat, _blocking_code(frame))
+
+    def _report(self, lag, beat):
+        """Record a stall."""
+        coroutine, location = None, None
+        if self._sample is not None and self._sample[0] == beat:
+            coroutine, location = self._sample[1]
+        stall = LoopStall(lag, coroutine, location)
+        self.stalls.append(stall)
+        del self.stalls[:-self.history]
+        self._logger.warning("Event loop blocked for %.3f s by %s (%s)",
+                             lag, coroutine or "unknown code", location or "not sampled")
+        if self.metrics is not None:
+            self.metrics.record_phase(PhaseEvent('loop_stall', lag, None))
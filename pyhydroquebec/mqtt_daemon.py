@@ -6,9 +6,11 @@ import asyncio
 from datetime import datetime, timedelta
 import json
 import os
+import signal
+import time
 import uuid
 
-from yaml import load
+from yaml import load, YAMLError
 try:
     from yaml import CLoader as Loader
 except ImportError:
@@ -16,8 +18,29 @@ except ImportError:
 import mqtt_hass_base
 
 from pyhydroquebec.__version__ import VERSION
-from pyhydroquebec.client import HydroQuebecClient
-from pyhydroquebec.consts import DAILY_MAP, CURRENT_MAP, HQ_TIMEZONE
+from pyhydroquebec.cache import ResponseCache
+from pyhydroquebec.client import HydroQuebecClient, PARSE_EXECUTORS
+from pyhydroquebec.error import PyHydroQuebecSessionExpiredError, PyHydroQuebecTimeoutError
+from pyhydroquebec.metrics import Metrics
+from pyhydroquebec.monitor import LoopLagMonitor
+from pyhydroquebec.retry import RetryPolicy, AdaptiveRateLimiter
+from pyhydroquebec.scheduler import Scheduler, VOLATILE, FINAL, yesterday
+from pyhydroquebec.session import build_connector
+from pyhydroquebec.store import HistoryStore, group_ranges
+from pyhydroquebec.consts import (DAILY_MAP, CURRENT_MAP, get_hq_timezone,
+                                  REQUESTS_TTL, CACHE_MAXSIZE, MAX_CONCURRENT_ACCOUNTS,
+                                  SUMMARY_CONCURRENCY, PORTAL_SESSION_POOL_SIZE,
+                                  RETRY_ATTEMPTS, RETRY_BACKOFF, RETRY_MAX_BACKOFF,
+                                  RATE_LIMIT, RATE_LIMIT_MIN, CONNECTOR_LIMIT_PER_HOST,
+                                  CONNECTOR_KEEPALIVE_TIMEOUT, CONNECTOR_DNS_CACHE_TTL,
+                                  MQTT_REFRESH_INTERVAL, HOURLY_FIELDS, MONTHLY_SENSORS,
+                                  ANNUAL_SENSORS, SENSOR_GROUPS, BACKFILL_DAYS,
+                                  BACKFILL_MAX_DAYS, BACKFILL_BATCH_SIZE, BACKFILL_CONCURRENCY,
+                                  SCHEDULE_FINAL_INTERVAL, SCHEDULE_JITTER,
+                                  CONFIG_WATCH_INTERVAL, OFFLOAD_THRESHOLD, PARSE_WORKERS,
+                                  LOOP_LAG_THRESHOLD, LOOP_LAG_INTERVAL, REQUESTS_TIMEOUT,
+                                  REQUESTS_CONNECT_TIMEOUT, PHASE_TIMEOUT, ACCOUNT_TIMEOUT,
+                                  CYCLE_TIMEOUT, STORE_EMPTY_DAY_DELAY)
 
 
 def get_mac():
@@ -31,33 +54,226 @@ class MqttHydroQuebec(mqtt_hass_base.MqttDevice):
     """MQTT MqttHydroQuebec."""
 
     timeout = None
+    connect_timeout = None
+    phase_timeout = None
+    account_timeout = None
+    cycle_timeout = None
     frequency = None
+    max_concurrent_accounts = None
+    summary_concurrency = None
+    portal_session_pool_size = None
+    metrics_mqtt = False
+    metrics_file = None
+    connector = None
+    parse_executor = None
+    monitor = None
+    config_watch_interval = None
+    loop = None
+    _wakeup = None
 
     def __init__(self):
         """Create new MqttHydroQuebec Object."""
+        self._clients = {}
+        self._mac_addr = None
+        # Sensor key: state topic, for the discovery configs already published
+        self._sensor_topics = {}
+        # Sensor key: (config topic, payload), to publish the configs again
+        self._sensor_configs = {}
+        # State topic: last published payload
+        self._published_states = {}
+        self._last_refresh = time.monotonic()
+        # Contract id: days already backfilled
+        self._backfilled = {}
+        # Contract id: {day without data: date of the check}
+        self._backfill_empty = {}
+        self._store = None
+        # Modification time of the config file when read
+        self._config_mtime = None
+        self._reload_requested = False
+        # Set by the MQTT thread on (re)connection, read by the main loop
+        self._republish_requested = False
         mqtt_hass_base.MqttDevice.__init__(self, "mqtt-hydroquebec")
 
+    def _load_config(self):
+        """Load the yaml config file."""
+        self._config_mtime = self._get_config_mtime()
+        with open(os.environ['CONFIG'], encoding="utf-8") as fhc:
+            return load(fhc, Loader=Loader)
+
+    @staticmethod
+    def _get_config_mtime():
+        """Return the modification time of the config file, None if missing."""
+        try:
+            return os.stat(os.environ['CONFIG']).st_mtime
+        except OSError:
+            return None
+
     def read_config(self):
         """Read config from yaml file."""
-        with open(os.environ['CONFIG']) as fhc:
-            self.config = load(fhc, Loader=Loader)
-        self.timeout = self.config.get('timeout', 30)
+        self.config = self._load_config()
+        self._apply_config()
+
+    def _apply_config(self):
+        """Read the settings of the loaded config."""
+        # Seconds, see HydroQuebecClient
+        self.timeout = self.config.get('timeout', REQUESTS_TIMEOUT)
+        self.connect_timeout = self.config.get('connect_timeout', REQUESTS_CONNECT_TIMEOUT)
+        self.phase_timeout = self.config.get('phase_timeout', PHASE_TIMEOUT)
+        # Seconds before the poll of an account and a whole cycle are cancelled
+        self.account_timeout = self.config.get('account_timeout', ACCOUNT_TIMEOUT)
+        self.cycle_timeout = self.config.get('cycle_timeout', CYCLE_TIMEOUT)
         # 6 hours
         self.frequency = self.config.get('frequency', None)
+        self.max_concurrent_accounts = self.config.get('max_concurrent_accounts',
+                                                       MAX_CONCURRENT_ACCOUNTS)
+        self.summary_concurrency = self.config.get('summary_concurrency', SUMMARY_CONCURRENCY)
+        self.portal_session_pool_size = self.config.get('portal_session_pool_size',
+                                                        PORTAL_SESSION_POOL_SIZE)
+        cache_config = self.config.get('cache', {})
+        self.cache = ResponseCache(maxsize=cache_config.get('maxsize', CACHE_MAXSIZE),
+                                   ttl=cache_config.get('ttl', 60 * REQUESTS_TTL),
+                                   endpoint_ttls=cache_config.get('endpoints'))
+        metrics_config = self.config.get('metrics', {})
+        self.metrics_mqtt = metrics_config.get('mqtt', False)
+        self.metrics_file = metrics_config.get('prometheus_file')
+        self.metrics = Metrics()
+        retry_config = self.config.get('retry', {})
+        self.retry_policy = RetryPolicy(attempts=retry_config.get('attempts', RETRY_ATTEMPTS),
+                                        backoff=retry_config.get('backoff', RETRY_BACKOFF),
+                                        max_backoff=retry_config.get('max_backoff',
+                                                                     RETRY_MAX_BACKOFF))
+        rate_limit_config = self.config.get('rate_limit', {})
+        # Shared by all the accounts
+        self.rate_limiter = AdaptiveRateLimiter(
+            max_rate=rate_limit_config.get('max_rate', RATE_LIMIT),
+            min_rate=rate_limit_config.get('min_rate', RATE_LIMIT_MIN))
+        self.connector_config = self.config.get('connector', {})
+        self.parsing_config = self.config.get('parsing', {})
+        self.monitor_config = self.config.get('monitor', {})
+        # Seconds between two publications of all the configs and states, even unchanged
+        self.refresh_interval = self.config.get('refresh_interval', MQTT_REFRESH_INTERVAL)
+        self.sensor_groups = dict(SENSOR_GROUPS, **self.config.get('sensors', {}))
+        self.backfill_config = self.config.get('backfill', {})
+        schedule_config = self.config.get('schedule', {})
+        self.scheduler = Scheduler(self.frequency,
+                                   final_interval=schedule_config.get('final_interval',
+                                                                      SCHEDULE_FINAL_INTERVAL),
+                                   jitter=schedule_config.get('jitter', SCHEDULE_JITTER))
+        # Seconds between two checks of the config file, None to reload only on SIGHUP
+        self.config_watch_interval = self.config.get('config_watch_interval',
+                                                     CONFIG_WATCH_INTERVAL)
+
+    def _config_changed(self):
+        """Return True if the config must be read again."""
+        if self._reload_requested:
+            return True
+        if self.config_watch_interval is None:
+            return False
+        mtime = self._get_config_mtime()
+        return mtime is not None and mtime != self._config_mtime
+
+    def _request_reload(self):
+        """Read the config again before the next poll, on SIGHUP."""
+        self.logger.info("SIGHUP received, reloading the config")
+        self._reload_requested = True
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _reload_config(self):
+        """Read the config file again and apply the changes in place.
+
+        New accounts are polled from now on, the clients of the removed
+        accounts are closed and the removed contracts are unscheduled. The
+        clients of the other accounts and their sessions, the response cache,
+        the metrics, the rate limiter and the schedule are kept. Settings used
+        to build the clients (timeout, retry...) apply to new clients only.
+        """
+        self._reload_requested = False
+        try:
+            config = self._load_config()
+            if not isinstance(config.get('accounts'), list):
+                raise KeyError('accounts')
+        except (OSError, YAMLError, AttributeError, KeyError) as exp:
+            self.logger.error("Bad config, keeping the current one: %s", exp)
+            return
+        kept = (self.cache, self.metrics, self.rate_limiter, self.scheduler)
+        contract_ids = self._contract_ids()
+        self.config = config
+        self._apply_config()
+        self.cache, self.metrics, self.rate_limiter, scheduler = kept
+        scheduler.frequency = self.scheduler.frequency
+        scheduler.final_interval = self.scheduler.final_interval
+        scheduler.jitter = self.scheduler.jitter
+        self.scheduler = scheduler
+
+        usernames = set(account['username'] for account in self.config['accounts'])
+        for username in set(self._clients) - usernames:
+            self.logger.info("Account %s removed", username)
+            await self._clients.pop(username).close_session()
+        for contract_id in contract_ids - self._contract_ids():
+            self.scheduler.forget(contract_id)
+            self._backfilled.pop(contract_id, None)
+            self._backfill_empty.pop(contract_id, None)
+            self._forget_published(contract_id)
+        self.logger.info("Config reloaded, %d accounts", len(usernames))
+
+    def _contract_ids(self):
+        """Return the ids of the contracts of all the accounts."""
+        return set(contract['id'] for account in self.config['accounts']
+                   for contract in account['contracts'])
 
     async def _init_main_loop(self):
         """Init before starting main loop."""
+        self.loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        try:
+            self.loop.add_signal_handler(signal.SIGHUP, self._request_reload)
+        except (NotImplementedError, AttributeError):
+            # No SIGHUP on Windows, the config file is still watched
+            pass
+        if self.connector_config.get('shared', True):
+            # One connection pool for all the accounts
+            self.connector = build_connector(
+                limit_per_host=self.connector_config.get('limit_per_host',
+                                                         CONNECTOR_LIMIT_PER_HOST),
+                keepalive_timeout=self.connector_config.get('keepalive_timeout',
+                                                            CONNECTOR_KEEPALIVE_TIMEOUT),
+                dns_cache_ttl=self.connector_config.get('dns_cache_ttl',
+                                                        CONNECTOR_DNS_CACHE_TTL))
+        if self.parsing_config.get('executor'):
+            # One parse executor for all the accounts
+            self.parse_executor = PARSE_EXECUTORS[self.parsing_config['executor']](
+                max_workers=self.parsing_config.get('workers', PARSE_WORKERS))
+        if self.monitor_config.get('enabled', False):
+            self.monitor = LoopLagMonitor(
+                threshold=self.monitor_config.get('loop_lag_threshold', LOOP_LAG_THRESHOLD),
+                interval=self.monitor_config.get('loop_lag_interval', LOOP_LAG_INTERVAL),
+                logger=self.logger.getChild('monitor'),
+                metrics=self.metrics)
+            await self.monitor.start()
 
     def _publish_sensor(self, sensor_type, contract_id,
-                        unit=None, device_class=None, icon=None):
-        """Publish a Home-Assistant MQTT sensor."""
-        mac_addr = get_mac()
+                        unit=None, device_class=None, icon=None, attributes=False):
+        """Publish a Home-Assistant MQTT sensor.
+
+        The discovery config is published only once, then again from memory
+        on MQTT reconnection and at each refresh interval. If `attributes` is
+        True, the sensor reads its attributes on the "attributes" topic next
+        to the state topic.
+        """
+        sensor_key = (sensor_type, contract_id, unit, device_class, icon, attributes)
+        sensor_state_config = self._sensor_topics.get(sensor_key)
+        if sensor_state_config is not None:
+            return sensor_state_config
+
+        if self._mac_addr is None:
+            self._mac_addr = get_mac()
 
         base_topic = ("{}/sensor/hydroquebec_{}".format(self.mqtt_root_topic,
                                                         contract_id))
 
         sensor_config = {}
-        sensor_config["device"] = {"connections": [["mac", mac_addr]],
+        sensor_config["device"] = {"connections": [["mac", self._mac_addr]],
                                    "name": "hydroquebec_{}".format(contract_id),
                                    "identifiers": ['hydroquebec', contract_id],
                                    "manufacturer": "mqtt-hydroquebec",
@@ -78,97 +294,438 @@ class MqttHydroQuebec(mqtt_hass_base.MqttDevice):
             sensor_config["unit_of_measurement"] = unit
         if icon:
             sensor_config["icon"] = icon
+        if attributes:
+            sensor_config["json_attributes_topic"] = "{}/{}/attributes".format(
+                base_topic, sensor_type)
 
         sensor_config_topic = "{}/{}/config".format(base_topic, sensor_type)
 
+        payload = json.dumps(sensor_config)
         self.mqtt_client.publish(topic=sensor_config_topic,
                                  retain=True,
-                                 payload=json.dumps(sensor_config))
+                                 payload=payload)
+        self._sensor_topics[sensor_key] = sensor_state_config
+        self._sensor_configs[sensor_key] = (sensor_config_topic, payload)
 
         return sensor_state_config
 
+    def _publish_state(self, topic, payload):
+        """Publish a sensor state only if it changed since the last publication.
+
+        States are retained like the configs, so Home Assistant gets them
+        back from the broker after a restart.
+        """
+        if topic in self._published_states and self._published_states[topic] == payload:
+            return
+        self.mqtt_client.publish(topic=topic, retain=True, payload=payload)
+        self._published_states[topic] = payload
+
+    def _republish(self):
+        """Publish again the configs and the last states already published.
+
+        The broker may have lost the retained messages, they are sent from
+        memory without fetching anything from the portal.
+        """
+        for topic, payload in self._sensor_configs.values():
+            self.mqtt_client.publish(topic=topic, retain=True, payload=payload)
+        for topic, payload in self._published_states.items():
+            self.mqtt_client.publish(topic=topic, retain=True, payload=payload)
+        self._last_refresh = time.monotonic()
+
+    def _forget_published(self, contract_id):
+        """Forget the sensors of a removed contract, they are not published again."""
+        for sensor_key in [key for key in self._sensor_topics if key[1] == contract_id]:
+            del self._sensor_topics[sensor_key]
+            del self._sensor_configs[sensor_key]
+        base_topic = "{}/sensor/hydroquebec_{}/".format(self.mqtt_root_topic, contract_id)
+        for topic in [topic for topic in self._published_states
+                      if topic.startswith(base_topic)]:
+            del self._published_states[topic]
+
     async def _main_loop(self):
         """Run main loop."""
-        self.logger.debug("Get Data")
-        for account in self.config['accounts']:
-            client = HydroQuebecClient(account['username'],
-                                       account['password'],
-                                       self.timeout,
-                                       log_level=self._loglevel)
-            await client.login()
-            for contract_data in account['contracts']:
-                # Get contract
-                customer = None
-                for client_customer in client.customers:
-                    if str(client_customer.contract_id) == str(contract_data['id']):
-                        customer = client_customer
-
-                if customer is None:
-                    self.logger.warning('Contract %s not found', contract_data['id'])
-                    continue
-
-                await customer.fetch_current_period()
-                # await customer.fetch_annual_data()
-                # await customer.fetch_monthly_data()
-                yesterday = datetime.now(HQ_TIMEZONE) - timedelta(days=1)
-                yesterday_str = yesterday.strftime("%Y-%m-%d")
-                await customer.fetch_daily_data(yesterday_str, yesterday_str)
-                if not customer.current_daily_data:
-                    yesterday = yesterday - timedelta(days=1)
-                    yesterday_str = yesterday.strftime("%Y-%m-%d")
-                    await customer.fetch_daily_data(yesterday_str, yesterday_str)
-
-                # Balance
-                # Publish sensor
-                balance_topic = self._publish_sensor('balance', customer.account_id,
-                                                     unit="$", device_class=None,
-                                                     icon="mdi:currency-usd")
-                # Send sensor data
-                self.mqtt_client.publish(
-                        topic=balance_topic,
-                        payload=customer.balance)
-
-                # Current period
-                for data_name, data in CURRENT_MAP.items():
-                    # Publish sensor
-                    sensor_topic = self._publish_sensor(data_name,
-                                                        customer.contract_id,
-                                                        unit=data['unit'],
-                                                        icon=data['icon'],
-                                                        device_class=data['device_class'])
-                    # Send sensor data
-                    self.mqtt_client.publish(
-                            topic=sensor_topic,
-                            payload=customer.current_period[data_name])
-
-                # Yesterday data
-                for data_name, data in DAILY_MAP.items():
-                    # Publish sensor
-                    sensor_topic = self._publish_sensor('yesterday_' + data_name,
-                                                        customer.contract_id,
-                                                        unit=data['unit'],
-                                                        icon=data['icon'],
-                                                        device_class=data['device_class'])
-                    # Send sensor data
-                    self.mqtt_client.publish(
-                            topic=sensor_topic,
-                            payload=customer.current_daily_data[yesterday_str][data_name])
-
-            await client.close_session()
+        await self._poll_accounts()
 
         if self.frequency is None:
             self.logger.info("Frequency is None, so it's a one shot run")
             self.must_run = False
             return
 
-        self.logger.info("Waiting for %d seconds before the next check", self.frequency)
-        i = 0
-        while i < self.frequency and self.must_run:
-            await asyncio.sleep(1)
-            i += 1
+        delay = self.scheduler.next_poll()
+        self.logger.info("Waiting for %d seconds before the next check", delay)
+        deadline = time.monotonic() + delay
+        # Stop waiting on SIGINT, SIGHUP, MQTT reconnection or when the config file changes
+        while (self.must_run and not self._republish_requested and
+               not self._config_changed()):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                await asyncio.wait_for(self._wakeup.wait(),
+                                       min(remaining, self.config_watch_interval or remaining))
+            except asyncio.TimeoutError:
+                pass
+        self._wakeup.clear()
+
+    async def _poll_accounts(self):
+        """Poll the contracts with due data of all the accounts."""
+        self.logger.debug("Get Data")
+        if self._config_changed():
+            await self._reload_config()
+        if (self._republish_requested or
+                time.monotonic() - self._last_refresh >= self.refresh_interval):
+            self.logger.debug("Publishing all the sensors again")
+            self._republish_requested = False
+            self._republish()
+        semaphore = asyncio.Semaphore(self.max_concurrent_accounts)
+
+        async def poll_account(account):
+            async with semaphore:
+                try:
+                    await asyncio.wait_for(self._poll_account(account), self.account_timeout)
+                except asyncio.TimeoutError:
+                    self.logger.error("Polling account %s timed out after %ss",
+                                      account['username'], self.account_timeout)
+                    self._poll_later(account)
+                except PyHydroQuebecTimeoutError as exp:
+                    self.logger.error("Failed to poll account %s: %s", account['username'], exp)
+                    self._poll_later(account)
+                except Exception:  # pylint: disable=broad-except
+                    self.logger.exception("Failed to poll account %s", account['username'])
+                    self._poll_later(account)
+
+        day = yesterday()
+        tasks = {asyncio.ensure_future(poll_account(account)): account
+                 for account in self.config['accounts']
+                 if any(self._is_due(contract['id'], day) for contract in account['contracts'])}
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=self.cycle_timeout)
+            if pending:
+                # Do not wait for the stuck accounts, the others are already published
+                self.logger.error("Cycle timed out after %ss, accounts not polled: %s",
+                                  self.cycle_timeout,
+                                  ", ".join(tasks[task]['username'] for task in pending))
+                for task in pending:
+                    task.cancel()
+                    self._poll_later(tasks[task])
+                await asyncio.wait(pending)
+        self._publish_metrics()
+
+    def _poll_later(self, account):
+        """Poll the contracts of an account which failed at the next regular poll."""
+        for contract in account['contracts']:
+            self.scheduler.retry_later(contract['id'])
+
+    def _is_due(self, contract_id, day):
+        """Return True if some data of a contract must be polled."""
+        if self.scheduler.is_due(contract_id, VOLATILE):
+            return True
+        return ((self.sensor_groups['yesterday'] or self.sensor_groups['hourly']) and
+                self.scheduler.is_due(contract_id, FINAL, day))
+
+    def _publish_metrics(self):
+        """Send the request and phase metrics over MQTT and/or to a Prometheus file.
+
+        Metrics are cumulated since the start of the daemon.
+        """
+        if self.metrics_mqtt:
+            self.mqtt_client.publish(topic="{}/hydroquebec/metrics".format(self.mqtt_root_topic),
+                                     payload=json.dumps(self.metrics.to_dict()))
+        if self.metrics_file:
+            # Write then rename so the collector never reads a partial file
+            tmp_file = self.metrics_file + ".tmp"
+            with open(tmp_file, "w", encoding="utf-8") as fhm:
+                fhm.write(self.metrics.to_prometheus())
+            os.replace(tmp_file, self.metrics_file)
+
+    async def _get_client(self, account):
+        """Return the client of an account, kept between cycles."""
+        client = self._clients.get(account['username'])
+        if client is None or client.password != account['password']:
+            if client is not None:
+                await client.close_session()
+            client = HydroQuebecClient(account['username'],
+                                       account['password'],
+                                       self.timeout,
+                                       connect_timeout=self.connect_timeout,
+                                       phase_timeout=self.phase_timeout,
+                                       log_level=self._loglevel,
+                                       cache=self.cache,
+                                       summary_concurrency=self.summary_concurrency,
+                                       portal_session_pool_size=self.portal_session_pool_size,
+                                       metrics=self.metrics,
+                                       retry_policy=self.retry_policy,
+                                       rate_limiter=self.rate_limiter,
+                                       connector=self.connector,
+                                       parse_executor=self.parse_executor,
+                                       offload_threshold=self.parsing_config.get(
+                                           'offload_threshold', OFFLOAD_THRESHOLD))
+            self._clients[account['username']] = client
+        return client
+
+    async def _poll_account(self, account):
+        """Fetch and publish the data of all the contracts of one account.
+
+        The client session is reused and we log in again only when needed.
+        """
+        client = await self._get_client(account)
+        await client.ensure_login(lazy=True)
+        try:
+            await self._poll_contracts(client, account)
+        except PyHydroQuebecSessionExpiredError:
+            self.logger.info("Session of %s expired, logging in again", account['username'])
+            await client.login(lazy=True)
+            await self._poll_contracts(client, account)
+
+    async def _poll_contracts(self, client, account):
+        """Fetch and publish the data of the contracts of one account."""
+        day = yesterday()
+        for contract_data in account['contracts']:
+            if not self._is_due(contract_data['id'], day):
+                continue
+            # Get contract, only the needed customer summaries are fetched
+            customer = await client.get_customer(contract_data['id'])
+
+            if customer is None:
+                # ie bad credentials, try again at the next regular poll
+                self.logger.warning('Contract %s not found', contract_data['id'])
+                self.scheduler.retry_later(contract_data['id'])
+                continue
+
+            await self._poll_customer(customer)
+
+    async def _poll_customer(self, customer):
+        """Fetch and publish the due data of one contract.
+
+        Yesterday's data does not change once published by the portal, it is
+        fetched until it shows up (hourly data included, if enabled) and then
+        not until the next day.
+        """
+        contract_id = customer.contract_id
+        if self.scheduler.is_due(contract_id, VOLATILE):
+            await self._poll_volatile(customer)
+            self.scheduler.polled(contract_id, VOLATILE)
+        day = yesterday()
+        if ((self.sensor_groups['yesterday'] or self.sensor_groups['hourly']) and
+                self.scheduler.is_due(contract_id, FINAL, day)):
+            yesterday_str = await self._fetch_yesterday(customer, day)
+            self.scheduler.polled(contract_id, FINAL)
+            complete = yesterday_str == day
+            if self.sensor_groups['yesterday']:
+                self._publish_yesterday(customer, yesterday_str)
+            if self.sensor_groups['hourly']:
+                # The hourly data can be published later than the daily data
+                hourly_published = await self._publish_hourly(customer, yesterday_str)
+                complete = complete and hourly_published
+            if complete:
+                self.scheduler.complete(contract_id, day)
+        if self.backfill_config.get('enabled', False):
+            await self._backfill(customer)
+
+    async def _poll_volatile(self, customer):
+        """Fetch and publish the data which changes during the day."""
+        # Refresh the balance, the session can be older than this cycle
+        await customer.fetch_summary()
+        # Balance
+        # Publish sensor
+        balance_topic = self._publish_sensor('balance', customer.account_id,
+                                             unit="$", device_class=None,
+                                             icon="mdi:currency-usd")
+        # Send sensor data
+        self._publish_state(balance_topic, customer.balance)
+
+        if self.sensor_groups['current_period']:
+            await self._publish_current_period(customer)
+        if self.sensor_groups['monthly']:
+            await self._publish_monthly(customer)
+        if self.sensor_groups['annual']:
+            await self._publish_annual(customer)
+
+    async def _publish_current_period(self, customer):
+        """Publish the current period sensors."""
+        await customer.fetch_current_period()
+        for data_name, data in CURRENT_MAP.items():
+            # Publish sensor
+            sensor_topic = self._publish_sensor(data_name,
+                                                customer.contract_id,
+                                                unit=data['unit'],
+                                                icon=data['icon'],
+                                                device_class=data['device_class'])
+            # Send sensor data
+            self._publish_state(sensor_topic, customer.current_period[data_name])
+
+    @staticmethod
+    async def _fetch_yesterday(customer, day):
+        """Fetch the daily data of `day`, or of the day before if not available yet.
+
+        Return the fetched day.
+        """
+        await customer.fetch_daily_data(day, day)
+        if day not in customer.current_daily_data:
+            day = (datetime.strptime(day, "%Y-%m-%d") - timedelta(days=1)).strftime("%Y-%m-%d")
+            await customer.fetch_daily_data(day, day)
+        return day
+
+    def _publish_yesterday(self, customer, yesterday_str):
+        """Publish the yesterday sensors."""
+        for data_name, data in DAILY_MAP.items():
+            # Publish sensor
+            sensor_topic = self._publish_sensor('yesterday_' + data_name,
+                                                customer.contract_id,
+                                                unit=data['unit'],
+                                                icon=data['icon'],
+                                                device_class=data['device_class'])
+            # Send sensor data
+            self._publish_state(sensor_topic,
+                                customer.current_daily_data[yesterday_str][data_name])
+
+    async def _publish_hourly(self, customer, yesterday_str):
+        """Publish the hourly sensors of yesterday.
+
+        The state is the daily total (or mean temperature), the 24 hourly
+        values are in the attributes. Return False if no hourly data is available.
+        """
+        try:
+            await customer.fetch_hourly_data(yesterday_str)
+        except (KeyError, IndexError, TypeError):
+            self.logger.warning("No hourly data available for %s", yesterday_str)
+            return False
+        hours = customer.hourly_data[yesterday_str]['hours']
+        published = False
+        for data_name in HOURLY_FIELDS:
+            data = DAILY_MAP[data_name]
+            sensor_topic = self._publish_sensor('yesterday_hourly_' + data_name,
+                                                customer.contract_id,
+                                                unit=data['unit'],
+                                                icon=data['icon'],
+                                                device_class=data['device_class'],
+                                                attributes=True)
+            values = [hours.get(hour, {}).get(data_name) for hour in range(24)]
+            known_values = [value for value in values if value is not None]
+            if not known_values:
+                continue
+            state = sum(known_values)
+            if data['device_class'] == 'temperature':
+                state = round(state / len(known_values), 1)
+            self._publish_state(sensor_topic[:-len("state")] + "attributes",
+                                json.dumps({'date': yesterday_str, 'hours': values}))
+            self._publish_state(sensor_topic, round(state, 2))
+            published = True
+        return published
+
+    async def _publish_monthly(self, customer):
+        """Publish the sensors of the last month."""
+        await customer.fetch_monthly_data()
+        if not customer.current_monthly_data:
+            return
+        month = max(customer.current_monthly_data)
+        for data_name, data in MONTHLY_SENSORS.items():
+            sensor_topic = self._publish_sensor('monthly_' + data_name,
+                                                customer.contract_id,
+                                                unit=data['unit'],
+                                                icon=data['icon'],
+                                                device_class=data['device_class'],
+                                                attributes=True)
+            self._publish_state(sensor_topic[:-len("state")] + "attributes",
+                                json.dumps({'month': month}))
+            self._publish_state(sensor_topic,
+                                customer.current_monthly_data[month][data_name])
+
+    async def _publish_annual(self, customer):
+        """Publish the sensors of the last 12 months."""
+        await customer.fetch_annual_data()
+        if not customer.current_annual_data:
+            return
+        for data_name, data in ANNUAL_SENSORS.items():
+            sensor_topic = self._publish_sensor(data_name,
+                                                customer.contract_id,
+                                                unit=data['unit'],
+                                                icon=data['icon'],
+                                                device_class=data['device_class'])
+            self._publish_state(sensor_topic, customer.current_annual_data[data_name])
+
+    def _get_store(self):
+        """Return the history store of the backfill, or None."""
+        if self._store is None and self.backfill_config.get('store'):
+            self._store = HistoryStore(self.backfill_config['store'],
+                                       self.logger.getChild('store'))
+        return self._store
+
+    async def _backfill(self, customer):
+        """Publish the hourly history of a contract in batches of timestamped points.
+
+        At most `max_days` days are fetched by cycle. Days kept in the history
+        store (if set) are not requested again. Days without data are skipped
+        until the next day, and for good once older than STORE_EMPTY_DAY_DELAY days.
+        """
+        contract_id = customer.contract_id
+        backfilled = self._backfilled.setdefault(contract_id, set())
+        empty_days = self._backfill_empty.setdefault(contract_id, {})
+        today = datetime.now(get_hq_timezone()).date()
+        days = [today - timedelta(days=offset)
+                for offset in range(1, self.backfill_config.get('days', BACKFILL_DAYS) + 1)]
+        missing = sorted(day for day in days
+                         if str(day) not in backfilled and empty_days.get(str(day)) != today)
+        if not missing:
+            return
+        store = self._get_store()
+        # Reuse the days already fetched by the hourly sensors
+        hourly_data = {str(day): customer.hourly_data[str(day)] for day in missing
+                       if str(day) in customer.hourly_data}
+        if store is not None:
+            hourly_data.update(store.load_hourly(contract_id, missing[0], missing[-1]))
+        to_fetch = [day for day in missing if str(day) not in hourly_data]
+        # Oldest days are fetched in the next cycles
+        to_fetch = to_fetch[-self.backfill_config.get('max_days', BACKFILL_MAX_DAYS):]
+        for start_date, end_date in group_ranges(to_fetch):
+            async for day_str, day_data in customer.iter_hourly_data(
+                    start_date, end_date,
+                    self.backfill_config.get('concurrency', BACKFILL_CONCURRENCY)):
+                hourly_data[day_str] = day_data
+                if store is not None:
+                    store.save_hourly(contract_id, day_str, day_data)
+        for day in to_fetch:
+            if str(day) in hourly_data:
+                empty_days.pop(str(day), None)
+            elif (today - day).days >= STORE_EMPTY_DAY_DELAY:
+                # Not published by now (ie before the contract start), never will be
+                backfilled.add(str(day))
+            else:
+                empty_days[str(day)] = today
+
+        points = []
+        for day_str in sorted(hourly_data):
+            if day_str in backfilled:
+                continue
+            for hour, data in sorted(hourly_data[day_str]['hours'].items()):
+                start = datetime.strptime(day_str, "%Y-%m-%d").replace(
+                    hour=int(hour), tzinfo=get_hq_timezone())
+                point = {'start': start.isoformat()}
+                point.update(data)
+                points.append(point)
+            backfilled.add(day_str)
+
+        topic = self.backfill_config.get(
+            'topic', "{}/hydroquebec/{}/statistics".format(self.mqtt_root_topic, contract_id))
+        batch_size = self.backfill_config.get('batch_size', BACKFILL_BATCH_SIZE)
+        for index in range(0, len(points), batch_size):
+            self.mqtt_client.publish(topic=topic,
+                                     payload=json.dumps({'contract_id': contract_id,
+                                                         'points': points[index:index +
+                                                                          batch_size]}))
+        self.logger.info("%d hourly points backfilled for contract %s",
+                         len(points), contract_id)
 
     def _on_connect(self, client, userdata, flags, rc):
-        """On connect callback method."""
+        """On connect callback method.
+
+        The broker may have lost the retained configs and states, publish everything
+        again. Called in the MQTT thread, so the main loop does it.
+        """
+        self._republish_requested = True
+        if self.loop is not None and self._wakeup is not None:
+            # Stop waiting for the next poll
+            self.loop.call_soon_threadsafe(self._wakeup.set)
 
     def _on_publish(self, client, userdata, mid):
         """MQTT on publish callback."""
@@ -181,6 +738,24 @@ class MqttHydroQuebec(mqtt_hass_base.MqttDevice):
 
     def _signal_handler(self, signal_, frame):
         """Handle SIGKILL."""
+        if self._wakeup is not None:
+            # Stop waiting for the next poll
+            self._wakeup.set()
 
     async def _loop_stopped(self):
         """Run after the end of the main loop."""
+        for client in self._clients.values():
+            await client.close_session()
+        self._clients = {}
+        if self.connector is not None:
+            await self.connector.close()
+            self.connector = None
+        if self.parse_executor is not None:
+            self.parse_executor.shutdown()
+            self.parse_executor = None
+        if self.monitor is not None:
+            await self.monitor.stop()
+            self.monitor = None
+        if self._store is not None:
+            self._store.close()
+            self._store = None
@@ -4,12 +4,22 @@ This module defines the different output functions:
 * text
 * influxdb
 * json
+* ndjson (streaming)
+
+The influxdb and ndjson writers share the same interface
+(write_daily and write_hourly_day) so they can be used for bulk downloads.
 """
+from datetime import datetime
 import json
+import sys
+import urllib.error
+import urllib.request
 
 from pyhydroquebec.consts import (OVERVIEW_TPL,
                                   CONSUMPTION_PROFILE_TPL,
-                                  YESTERDAY_TPL, ANNUAL_TPL, HOURLY_HEADER, HOURLY_TPL)
+                                  YESTERDAY_TPL, ANNUAL_TPL, HOURLY_HEADER, HOURLY_TPL,
+                                  get_hq_timezone, INFLUX_MEASUREMENT, INFLUX_BATCH_SIZE)
+from pyhydroquebec.error import PyHydroQuebecError
 
 
 def output_text(customer, show_hourly=False):
@@ -29,42 +39,133 @@ def output_text(customer, show_hourly=False):
             print(HOURLY_TPL.format(d=data, hour=hour))
 
 
-def output_influx(contract):
-    """Print data using influxDB format."""
-    raise Exception("FIXME")
-#    # Pop yesterdays data
-#    yesterday_data = contract]['yesterday_hourly_consumption']
-#    del data[contract]['yesterday_hourly_consumption']
-#
-#    # Print general data
-#    out = "pyhydroquebec,contract=" + contract + " "
-#
-#    for index, key in enumerate(data[contract]):
-#        if index != 0:
-#            out = out + ","
-#        if key in ("annual_date_start", "annual_date_end"):
-#            out += key + "=\"" + str(data[contract][key]) + "\""
-#        else:
-#            out += key + "=" + str(data[contract][key])
-#
-#    out += " " + str(int(datetime.datetime.now(HQ_TIMEZONE).timestamp() * 1000000000))
-#    print(out)
-#
-#    # Print yesterday values
-#    yesterday = datetime.datetime.now(HQ_TIMEZONE) - datetime.timedelta(days=1)
-#    yesterday = yesterday.replace(minute=0, hour=0, second=0, microsecond=0)
-#
-#    for hour in yesterday_data:
-#        msg = "pyhydroquebec,contract={} {} {}"
-#
-#        data = ",".join(["{}={}".format(key, value) for key, value in hour.items()
-#                         if key != 'hour'])
-#
-#        datatime = datetime.datetime.strptime(hour['hour'], '%H:%M:%S')
-#        yesterday = yesterday.replace(hour=datatime.hour)
-#        yesterday_str = str(int(yesterday.timestamp() * 1000000000))
-#
-#        print(msg.format(contract, data, yesterday_str))
+def _influx_escape(value):
+    """Escape a tag value or a field key."""
+    return str(value).replace(",", "\\,").replace(" ", "\\ ").replace("=", "\\=")
+
+
+def _influx_field(value):
+    """Format a field value."""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (int, float)):
+        return repr(float(value))
+    return '"{}"'.format(str(value).replace("\\", "\\\\").replace('"', '\\"'))
+
+
+def _influx_timestamp(day, hour=0):
+    """Return the timestamp in nanoseconds of a day (and hour) in HydroQuebec local time."""
+    if isinstance(day, datetime):
+        date_time = day
+    else:
+        date_time = datetime.strptime(day, "%Y-%m-%d").replace(hour=hour, tzinfo=get_hq_timezone())
+    return int(date_time.timestamp()) * 1000000000
+
+
+def influx_line(contract_id, kind, fields, timestamp):
+    """Return one line of InfluxDB line protocol, or None if there is no field."""
+    fields = ",".join("{}={}".format(_influx_escape(key), _influx_field(value))
+                      for key, value in fields.items() if value is not None)
+    if not fields:
+        return None
+    return "{},contract={},kind={} {} {}".format(INFLUX_MEASUREMENT,
+                                                 _influx_escape(contract_id),
+                                                 kind, fields, timestamp)
+
+
+def influx_lines(customer, show_hourly=False):
+    """Yield InfluxDB lines for all the data collected by a customer."""
+    now = datetime.now(get_hq_timezone())
+    contract_id = customer.contract_id
+    lines = [influx_line(contract_id, "balance", {"balance": customer.balance},
+                         _influx_timestamp(now)),
+             influx_line(contract_id, "current_period", customer.current_period,
+                         _influx_timestamp(now))]
+    if customer.current_annual_data:
+        lines.append(influx_line(contract_id, "annual", customer.current_annual_data,
+                                 _influx_timestamp(customer.current_annual_data.get(
+                                     'annual_date_end', now))))
+    for month, data in customer.current_monthly_data.items():
+        lines.append(influx_line(contract_id, "monthly", data,
+                                 _influx_timestamp(month + "-01")))
+    for day, data in customer.current_daily_data.items():
+        lines.append(influx_line(contract_id, "daily", data, _influx_timestamp(day)))
+    if show_hourly:
+        for day, hourly_data in customer.hourly_data.items():
+            lines.extend(_influx_hourly_lines(contract_id, day, hourly_data))
+    return [line for line in lines if line is not None]
+
+
+def _influx_hourly_lines(contract_id, day, hourly_data):
+    """Return InfluxDB lines of the hourly data of one day."""
+    return [influx_line(contract_id, "hourly", data, _influx_timestamp(day, hour))
+            for hour, data in hourly_data['hours'].items()]
+
+
+class InfluxWriter():
+    """Batched InfluxDB line protocol writer.
+
+    Lines are sent by batches of `batch_size` to the InfluxDB write
+    endpoint `url` (ie: http://localhost:8086/write?db=hydroquebec),
+    or printed on stdout if `url` is None.
+    """
+
+    def __init__(self, url=None, batch_size=INFLUX_BATCH_SIZE):
+        """Create new InfluxWriter object."""
+        self.url = url
+        self.batch_size = batch_size
+        self._batch = []
+        self.count = 0
+
+    def __enter__(self):
+        """Start writing."""
+        return self
+
+    def __exit__(self, *exc_info):
+        """Send the last batch."""
+        self.flush()
+
+    def write(self, line):
+        """Add a line to the current batch and send it if it is full."""
+        if line is None:
+            return
+        self._batch.append(line)
+        self.count += 1
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Send the current batch."""
+        if not self._batch:
+            return
+        body = "\n".join(self._batch) + "\n"
+        self._batch = []
+        if self.url is None:
+            sys.stdout.write(body)
+            sys.stdout.flush()
+            return
+        request = urllib.request.Request(self.url, data=body.encode("utf-8"), method="POST")
+        try:
+            with urllib.request.urlopen(request) as res:
+                res.read()
+        except urllib.error.URLError as exp:
+            raise PyHydroQuebecError("Error writing to InfluxDB: {}".format(exp)) from exp
+
+    def write_daily(self, contract_id, day, daily_data):
+        """Write the data of one day."""
+        self.write(influx_line(contract_id, "daily", daily_data, _influx_timestamp(day)))
+
+    def write_hourly_day(self, contract_id, day, hourly_data):
+        """Write one line per hour of one day."""
+        for line in _influx_hourly_lines(contract_id, day, hourly_data):
+            self.write(line)
+
+
+def output_influx(customer, show_hourly=False, url=None, batch_size=INFLUX_BATCH_SIZE):
+    """Print or send data using influxDB format."""
+    with InfluxWriter(url, batch_size) as writer:
+        for line in influx_lines(customer, show_hourly):
+            writer.write(line)
 
 
 def output_json(customer, show_hourly=False):
@@ -91,3 +192,50 @@ def output_json(customer, show_hourly=False):
             hourly_object.update(data)
             out["hourly_data"].append(hourly_object)
     print(json.dumps(out))
+
+
+class NdjsonExporter():
+    """Streaming JSON Lines exporter.
+
+    Each record is written as soon as it is received, so memory usage
+    does not depend on the length of the exported period.
+    """
+
+    def __init__(self, path=None):
+        """Create new NdjsonExporter object writing to `path` or stdout."""
+        self.path = path
+        self._stream = None
+        self.count = 0
+
+    def __enter__(self):
+        """Open the output file."""
+        self._stream = open(self.path, "w", encoding="utf-8") if self.path else sys.stdout
+        return self
+
+    def __exit__(self, *exc_info):
+        """Close the output file."""
+        if self.path:
+            self._stream.close()
+        else:
+            self._stream.flush()
+        self._stream = None
+
+    def write(self, record):
+        """Write one record."""
+        self._stream.write(json.dumps(record))
+        self._stream.write("\n")
+        self.count += 1
+
+    def write_daily(self, contract_id, day, daily_data):
+        """Write the data of one day."""
+        record = {"contract_id": contract_id, "date": day}
+        record.update(daily_data)
+        self.write(record)
+
+    def write_hourly_day(self, contract_id, day, hourly_data):
+        """Write one record per hour of one day."""
+        for hour, data in hourly_data['hours'].items():
+            record = {"contract_id": contract_id, "date": day, "hour": hour}
+            record.update(data)
+            self.write(record)
+        self._stream.flush()
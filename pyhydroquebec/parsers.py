@@ -0,0 +1,137 @@
+"""PyHydroQuebec Parsers Module.
+
+Extract the balance and the contract from the account page.
+Three extractors are available:
+* targeted: html.parser based, stops as soon as both fields are found
+* lxml: used only if lxml is installed, bs4 is used otherwise
+* bs4: full BeautifulSoup tree
+"""
+from functools import lru_cache
+from html.parser import HTMLParser
+import importlib.util
+import logging
+
+from pyhydroquebec.error import PyHydroQuebecError
+
+SUMMARY_FIELDS = (('balance', 'p', 'solde'),
+                  ('contract', 'div', 'contrat'))
+
+
+class _SummaryFound(Exception):
+    """Raised to stop parsing when all the fields are found."""
+
+
+class _TargetedSummaryParser(HTMLParser):
+    """Collect the text of the summary fields and stop when they are all found."""
+
+    def __init__(self):
+        """Create new _TargetedSummaryParser object."""
+        HTMLParser.__init__(self)
+        self.texts = {}
+        # Field currently read: (field name, tag, depth)
+        self._current = None
+
+    def handle_starttag(self, tag, attrs):
+        """Find the start of a field."""
+        if self._current is not None:
+            name, current_tag, depth = self._current
+            if tag == current_tag:
+                self._current = (name, current_tag, depth + 1)
+            return
+        classes = dict(attrs).get('class') or ''
+        for name, field_tag, field_class in SUMMARY_FIELDS:
+            if tag == field_tag and name not in self.texts and field_class in classes.split():
+                self.texts[name] = []
+                self._current = (name, tag, 1)
+                return
+
+    def handle_endtag(self, tag):
+        """Find the end of a field."""
+        if self._current is None:
+            return
+        name, current_tag, depth = self._current
+        if tag != current_tag:
+            return
+        if depth > 1:
+            self._current = (name, current_tag, depth - 1)
+            return
+        self._current = None
+        self.texts[name] = "".join(self.texts[name])
+        if all(isinstance(self.texts.get(field[0]), str) for field in SUMMARY_FIELDS):
+            raise _SummaryFound()
+
+    def handle_data(self, data):
+        """Collect field text."""
+        if self._current is not None:
+            self.texts[self._current[0]].append(data)
+
+    def error(self, message):
+        """Raise parsing errors."""
+        raise PyHydroQuebecError(message)
+
+
+def _parse_targeted(content):
+    """Extract the summary fields with the targeted parser."""
+    parser = _TargetedSummaryParser()
+    try:
+        parser.feed(content)
+        parser.close()
+    except _SummaryFound:
+        pass
+    return tuple(parser.texts.get(name) if isinstance(parser.texts.get(name), str) else None
+                 for name, _, _ in SUMMARY_FIELDS)
+
+
+def lxml_available():
+    """Return True if lxml is installed."""
+    return importlib.util.find_spec('lxml') is not None
+
+
+@lru_cache(maxsize=None)
+def _log_lxml_fallback():
+    """Log once that the lxml extractor uses bs4."""
+    logging.getLogger('pyhydroquebec').getChild('parsers').debug(
+        "lxml is not installed, using bs4 for the lxml summary parser")
+
+
+def _parse_lxml(content):
+    """Extract the summary fields with lxml."""
+    try:
+        from lxml import html  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        _log_lxml_fallback()
+        return _parse_bs4(content)
+    tree = html.fromstring(content)
+    texts = []
+    for _, tag, css_class in SUMMARY_FIELDS:
+        elements = tree.xpath("//{}[contains(concat(' ', normalize-space(@class), ' '), "
+                              "' {} ')]".format(tag, css_class))
+        texts.append(elements[0].text_content() if elements else None)
+    return tuple(texts)
+
+
+def _parse_bs4(content):
+    """Extract the summary fields with BeautifulSoup."""
+    from bs4 import BeautifulSoup  # pylint: disable=import-outside-toplevel
+    soup = BeautifulSoup(content, 'html.parser')
+    texts = []
+    for _, tag, css_class in SUMMARY_FIELDS:
+        element = soup.find(tag, {'class': css_class})
+        texts.append(element.text if element is not None else None)
+    return tuple(texts)
+
+
+SUMMARY_PARSERS = {'targeted': _parse_targeted,
+                   'lxml': _parse_lxml,
+                   'bs4': _parse_bs4}
+
+
+def parse_summary(content, parser='targeted'):
+    """Return the raw (balance, contract) texts of the account page.
+
+    Missing fields are None.
+    """
+    if parser not in SUMMARY_PARSERS:
+        raise PyHydroQuebecError("Bad summary parser. "
+                                 "Should be in {}".format(", ".join(SUMMARY_PARSERS)))
+    return SUMMARY_PARSERS[parser](content)
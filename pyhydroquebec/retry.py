@@ -0,0 +1,131 @@
+"""PyHydroQuebec Retry Module.
+
+Retry policy of the portal requests, with exponential backoff and jitter,
+and an adaptive token bucket limiting the request rate of all the clients.
+"""
+import asyncio
+import random
+import time
+
+from pyhydroquebec.consts import (RETRY_ATTEMPTS, RETRY_BACKOFF, RETRY_MAX_BACKOFF,
+                                  RETRY_STATUSES, RETRY_METHODS, RATE_LIMIT, RATE_LIMIT_MIN,
+                                  RATE_LIMIT_THROTTLED, RATE_LIMIT_RECOVERY)
+
+
+class RetryPolicy():
+    """When and how long to wait before trying a failed request again."""
+
+    def __init__(self, attempts=RETRY_ATTEMPTS, backoff=RETRY_BACKOFF,
+                 max_backoff=RETRY_MAX_BACKOFF, statuses=RETRY_STATUSES,
+                 methods=RETRY_METHODS, jitter=True):
+        """Create new RetryPolicy object.
+
+        `attempts` is the total number of tries, `statuses` the retryable
+        HTTP statuses and `methods` the methods retried by default.
+        """
+        self.attempts = attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.statuses = frozenset(statuses)
+        self.methods = frozenset(method.lower() for method in methods)
+        self.jitter = jitter
+
+    def should_retry(self, method, attempt, status=None, force=None):
+        """Return True if a request which failed at `attempt` (0 based) can be tried again.
+
+        `status` is None for connection errors. `force` overrides the method check,
+        ie for a POST known to be idempotent.
+        """
+        if attempt + 1 >= self.attempts:
+            return False
+        if not (force if force is not None else method.lower() in self.methods):
+            return False
+        return status is None or status in self.statuses
+
+    def delay(self, attempt, retry_after=None):
+        """Return the number of seconds to wait before the next try.
+
+        A valid Retry-After header (in seconds) is used as the minimum delay.
+        """
+        delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+        if self.jitter:
+            # Full jitter, spread the retries of concurrent requests
+            delay = random.uniform(0, delay)
+        if retry_after is not None and str(retry_after).isdigit():
+            delay = max(delay, min(self.max_backoff, int(retry_after)))
+        return delay
+
+
+class AdaptiveRateLimiter():
+    """Token bucket shared by clients, slowed down when the portal throttles us.
+
+    The rate is halved after each 429/503 response and increased again
+    after each successful request. Without `max_rate`, requests are not
+    limited until the portal throttles us.
+    """
+
+    def __init__(self, max_rate=RATE_LIMIT, min_rate=RATE_LIMIT_MIN,
+                 recovery=RATE_LIMIT_RECOVERY):
+        """Create new AdaptiveRateLimiter object."""
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.recovery = recovery
+        self.rate = max_rate
+        self._tokens = max_rate or 0
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        """Add the tokens earned since the last update."""
+        now = time.monotonic()
+        if self.rate is not None:
+            # The bucket size is one second of requests
+            self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self):
+        """Take a token and return the number of seconds to wait before using it.
+
+        Tokens can be borrowed (negative bucket), so concurrent callers are
+        queued without a lock.
+        """
+        if self.rate is None:
+            return 0
+        self._refill()
+        self._tokens -= 1
+        if self._tokens >= 0:
+            return 0
+        return -self._tokens / self.rate
+
+    async def acquire(self):
+        """Wait until a request can be sent."""
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def throttled(self):
+        """Slow down after a throttling response."""
+        self._refill()
+        rate = self.rate if self.rate is not None else RATE_LIMIT_THROTTLED * 2
+        self.rate = max(self.min_rate, rate / 2)
+        self._tokens = min(self._tokens, 0)
+
+    def succeeded(self):
+        """Speed up again after a successful request."""
+        if self.rate is None or self.rate == self.max_rate:
+            return
+        self._refill()
+        self.rate += self.recovery
+        if self.max_rate is not None:
+            self.rate = min(self.rate, self.max_rate)
+        elif self.rate >= RATE_LIMIT_THROTTLED * 2:
+            # Back to unlimited
+            self.rate = None
+
+
+# Rate limiter used by default by all the clients of the process
+_SHARED_RATE_LIMITER = AdaptiveRateLimiter()
+
+
+def shared_rate_limiter():
+    """Return the rate limiter shared by default by all the clients."""
+    return _SHARED_RATE_LIMITER
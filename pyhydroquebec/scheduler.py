@@ -0,0 +1,103 @@
+"""PyHydroQuebec Scheduler Module.
+
+Tells the MQTT daemon what to poll for each contract. Volatile data
+(balance, current period) is polled every `frequency` seconds. Yesterday's
+data is final once the portal publishes it, so it is checked every
+`final_interval` seconds until it shows up, and then not until the next day.
+"""
+from datetime import datetime, timedelta
+import random
+import time
+
+from pyhydroquebec.consts import get_hq_timezone, SCHEDULE_FINAL_INTERVAL, SCHEDULE_JITTER
+
+VOLATILE = 'volatile'
+FINAL = 'final'
+
+
+def yesterday():
+    """Return yesterday's date string in the Hydro-Quebec timezone."""
+    return (datetime.now(get_hq_timezone()) - timedelta(days=1)).strftime("%Y-%m-%d")
+
+
+class Scheduler():
+    """Next poll times and completed days of each contract.
+
+    Without `frequency` (one shot run), everything is always due.
+    """
+
+    def __init__(self, frequency=None, final_interval=SCHEDULE_FINAL_INTERVAL,
+                 jitter=SCHEDULE_JITTER, clock=time.monotonic):
+        """Create new Scheduler object."""
+        self.frequency = frequency
+        self.final_interval = final_interval
+        self.jitter = jitter
+        self._clock = clock
+        # (contract id, kind): time of the next poll
+        self._due = {}
+        # Contract id: last day with final data
+        self._complete = {}
+
+    def offset(self, contract_id):
+        """Return the delay added to each poll of a contract.
+
+        The delay is stable so the polls of the contracts stay spread.
+        """
+        return random.Random(contract_id).uniform(0, self.jitter)
+
+    def is_due(self, contract_id, kind, day=None):
+        """Return True if the `kind` data of a contract must be polled.
+
+        Final data is not due when `day` is already complete.
+        """
+        if kind == FINAL and self._complete.get(contract_id) == (day or yesterday()):
+            return False
+        if self.frequency is None:
+            return True
+        return self._clock() >= self._due.get((contract_id, kind), 0)
+
+    def polled(self, contract_id, kind):
+        """Schedule the next poll of the `kind` data of a contract."""
+        interval = self.frequency if kind == VOLATILE else self.final_interval
+        if interval is not None:
+            self._due[(contract_id, kind)] = (self._clock() + interval +
+                                              self.offset(contract_id))
+
+    def retry_later(self, contract_id):
+        """Schedule the next polls of a contract which failed or was not found."""
+        self.polled(contract_id, VOLATILE)
+        self.polled(contract_id, FINAL)
+
+    def complete(self, contract_id, day):
+        """Mark the final data of a day as published.
+
+        The data of the next day is checked after midnight.
+        """
+        self._complete[contract_id] = day
+        now = datetime.now(get_hq_timezone())
+        midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time(),
+                                    tzinfo=get_hq_timezone())
+        self._due[(contract_id, FINAL)] = (self._clock() + (midnight - now).total_seconds() +
+                                           self.offset(contract_id))
+
+    def next_poll(self):
+        """Return the number of seconds before the next due poll.
+
+        None for one shot runs, `frequency` if nothing was polled yet.
+        """
+        if self.frequency is None:
+            return None
+        if not self._due:
+            return self.frequency
+        return max(0, min(self._due.values()) - self._clock())
+
+    def forget(self, contract_id):
+        """Drop the schedule of a contract which is not polled anymore."""
+        for key in [key for key in self._due if key[0] == contract_id]:
+            del self._due[key]
+        self._complete.pop(contract_id, None)
+
+    def reset(self):
+        """Make everything due again."""
+        self._due = {}
+        self._complete = {}
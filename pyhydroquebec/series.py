@@ -0,0 +1,264 @@
+"""PyHydroQuebec Series Module.
+
+Compact storage of daily and hourly data in float arrays (one column
+per field, rows sorted by day), used by Customer when the client is
+created with `columnar=True`.
+Series behave like the dicts they replace: days are keyed by date
+string and items are built on access, so existing code keeps working.
+Missing values are stored as NaN and read back as None. Numbers are
+read back as floats.
+"""
+from array import array
+from bisect import bisect_left
+from collections.abc import MutableMapping
+from datetime import date
+import math
+
+from pyhydroquebec.consts import DAILY_MAP, HOURLY_DAY_FIELDS, HOURLY_FIELDS
+from pyhydroquebec.error import PyHydroQuebecError
+
+NAN = float('nan')
+HOURS = 24
+
+PERIODS = {'day': lambda day: day.isoformat(),
+           'week': lambda day: "{}-W{:02d}".format(*day.isocalendar()[:2]),
+           'month': lambda day: "{}-{:02d}".format(day.year, day.month),
+           'year': lambda day: str(day.year)}
+
+
+def _ordinal(day):
+    """Return the ordinal of a date or a date string."""
+    if isinstance(day, str):
+        return date.fromisoformat(day).toordinal()
+    return day.toordinal()
+
+
+def _to_float(value):
+    """Convert a value to store, None becomes NaN."""
+    return NAN if value is None else float(value)
+
+
+def _from_float(value):
+    """Convert a stored value, NaN becomes None."""
+    return None if math.isnan(value) else value
+
+
+def _mean(values):
+    """Return the mean of values, or None if empty."""
+    return math.fsum(values) / len(values) if values else None
+
+
+# How each field is aggregated by `resample`, the default is the sum
+AGGREGATES = {'average_temperature': _mean,
+              'day_mean_temp': _mean,
+              'day_min_temp': min,
+              'day_max_temp': max}
+
+
+def aggregate(field, values):
+    """Aggregate the values of a field, ignoring missing ones."""
+    values = [value for value in values if not math.isnan(value)]
+    if not values:
+        return None
+    return AGGREGATES.get(field, math.fsum)(values)
+
+
+class ColumnarSeries(MutableMapping):
+    """Float columns indexed by sorted day ordinals.
+
+    `columns` maps each field to its number of values per day.
+    """
+
+    __slots__ = ('_days', '_columns')
+    columns = {}
+
+    def __init__(self, data=None):
+        """Create new series, optionally filled from a dict keyed by date string."""
+        self._days = array('l')
+        self._columns = {field: array('d') for field in self.columns}
+        if data:
+            self.update(data)
+
+    def _find(self, day):
+        """Return the row of a day or None."""
+        ordinal = _ordinal(day)
+        index = bisect_left(self._days, ordinal)
+        if index < len(self._days) and self._days[index] == ordinal:
+            return index
+        return None
+
+    def _row(self, day):
+        """Return the row of a day, added if missing."""
+        ordinal = _ordinal(day)
+        index = bisect_left(self._days, ordinal)
+        if index < len(self._days) and self._days[index] == ordinal:
+            return index
+        self._days.insert(index, ordinal)
+        for field, width in self.columns.items():
+            self._columns[field][index * width:index * width] = array('d', [NAN] * width)
+        return index
+
+    def _range(self, start_date=None, end_date=None):
+        """Return the rows (first, last + 1) between two dates included."""
+        first = 0 if start_date is None else bisect_left(self._days, _ordinal(start_date))
+        last = (len(self._days) if end_date is None
+                else bisect_left(self._days, _ordinal(end_date) + 1))
+        return first, max(first, last)
+
+    def __getitem__(self, day):
+        """Return the data of a day."""
+        index = self._find(day)
+        if index is None:
+            raise KeyError(day)
+        return self._item(index)
+
+    def _item(self, index):
+        """Build the data of the row `index`."""
+        raise NotImplementedError
+
+    def __delitem__(self, day):
+        """Remove a day."""
+        index = self._find(day)
+        if index is None:
+            raise KeyError(day)
+        del self._days[index]
+        for field, width in self.columns.items():
+            del self._columns[field][index * width:(index + 1) * width]
+
+    def __contains__(self, day):
+        """Return True if the day is in the series."""
+        try:
+            return self._find(day) is not None
+        except (TypeError, ValueError):
+            return False
+
+    def __iter__(self):
+        """Iterate over the date strings in chronological order."""
+        return (date.fromordinal(ordinal).isoformat() for ordinal in self._days)
+
+    def __len__(self):
+        """Return the number of days."""
+        return len(self._days)
+
+    def __repr__(self):
+        """Represent the series as the dict it replaces."""
+        return "{}({!r})".format(type(self).__name__, dict(self.items()))
+
+    def ordinals(self, start_date=None, end_date=None):
+        """Return a copy of the day ordinals between two dates included."""
+        first, last = self._range(start_date, end_date)
+        return self._days[first:last]
+
+    def column(self, field, start_date=None, end_date=None):
+        """Return a copy of the values of a field between two dates included.
+
+        Hourly fields have 24 values per day.
+        """
+        first, last = self._range(start_date, end_date)
+        width = self.columns[field]
+        return self._columns[field][first * width:last * width]
+
+    def slice(self, start_date=None, end_date=None):
+        """Return a new series with the days between two dates included."""
+        first, last = self._range(start_date, end_date)
+        series = type(self)()
+        series._days = self._days[first:last]
+        series._columns = {field: self._columns[field][first * width:last * width]
+                           for field, width in self.columns.items()}
+        return series
+
+    def total(self, field, start_date=None, end_date=None):
+        """Return the sum of a field between two dates included."""
+        return aggregate(None, self.column(field, start_date, end_date)) or 0
+
+    def mean(self, field, start_date=None, end_date=None):
+        """Return the mean of a field between two dates included, or None."""
+        values = self.column(field, start_date, end_date)
+        return _mean([value for value in values if not math.isnan(value)])
+
+    def resample(self, period='month', fields=None):
+        """Aggregate the fields by day, week, month or year.
+
+        Return a dict keyed by period (ie: 2020-01 for months) of field values.
+        Consumptions are summed, temperatures are averaged.
+        """
+        if period not in PERIODS:
+            raise PyHydroQuebecError("Bad period. Should be in {}".format(", ".join(PERIODS)))
+        period_key = PERIODS[period]
+        fields = fields or tuple(self.columns)
+        # Days are sorted so each period is a contiguous block of rows
+        groups = []
+        for index, ordinal in enumerate(self._days):
+            key = period_key(date.fromordinal(ordinal))
+            if groups and groups[-1][0] == key:
+                groups[-1][2] = index + 1
+            else:
+                groups.append([key, index, index + 1])
+        resampled = {}
+        for key, first, last in groups:
+            resampled[key] = {}
+            for field in fields:
+                width = self.columns[field]
+                resampled[key][field] = aggregate(field,
+                                                  self._columns[field][first * width:last * width])
+        return resampled
+
+
+class DailySeries(ColumnarSeries):
+    """Daily data keyed by date string, as in Customer.current_daily_data."""
+
+    __slots__ = ()
+    columns = {field: 1 for field in DAILY_MAP}
+
+    def _item(self, index):
+        """Build the data of the row `index`."""
+        return {field: _from_float(self._columns[field][index]) for field in self.columns}
+
+    def __setitem__(self, day, data):
+        """Set the data of a day."""
+        index = self._row(day)
+        for field in self.columns:
+            self._columns[field][index] = _to_float(data.get(field))
+
+
+class HourlySeries(ColumnarSeries):
+    """Hourly data keyed by date string, as in Customer.hourly_data."""
+
+    __slots__ = ()
+    columns = dict([(field, 1) for field in HOURLY_DAY_FIELDS] +
+                   [(field, HOURS) for field in HOURLY_FIELDS])
+
+    def _item(self, index):
+        """Build the data of the row `index`."""
+        data = {field: _from_float(self._columns[field][index]) for field in HOURLY_DAY_FIELDS}
+        data['hours'] = {hour: {field: _from_float(self._columns[field][index * HOURS + hour])
+                                for field in HOURLY_FIELDS
+                                if not math.isnan(self._columns[field][index * HOURS + hour])}
+                         for hour in range(HOURS)}
+        return data
+
+    def __setitem__(self, day, data):
+        """Set the data of a day."""
+        hours = data.get('hours', {})
+        if any(not 0 <= int(hour) < HOURS for hour in hours):
+            raise PyHydroQuebecError("Bad hours for {}: {}".format(day, sorted(hours)))
+        index = self._row(day)
+        for field in HOURLY_DAY_FIELDS:
+            self._columns[field][index] = _to_float(data.get(field))
+        for field in HOURLY_FIELDS:
+            column = self._columns[field]
+            for hour in range(HOURS):
+                column[index * HOURS + hour] = _to_float(hours.get(hour, {}).get(field))
+
+    def hour_profile(self, field, start_date=None, end_date=None):
+        """Return the mean of a field for each hour of the day."""
+        values = self.column(field, start_date, end_date)
+        return [_mean([value for value in values[hour::HOURS] if not math.isnan(value)])
+                for hour in range(HOURS)]
+
+    def daily(self):
+        """Return a DailySeries of the hourly consumptions summed by day."""
+        series = DailySeries()
+        for day, data in self.resample('day', HOURLY_FIELDS).items():
+            series[day] = data
+        return series
@@ -0,0 +1,121 @@
+"""PyHydroQuebec Session Module.
+
+The portal keeps the selected customer on the server side. Each customer
+gets its own portal session (cookie jar) so several customers can be
+used at the same time without changing each other's selection.
+All the sessions of a client share its connection pool, which can also
+be shared by several clients with build_connector.
+"""
+import asyncio
+from collections import OrderedDict
+
+import aiohttp
+from yarl import URL
+
+from pyhydroquebec.consts import (HOST_SERVICES, HOST_SPRING, PORTAL_SESSION_POOL_SIZE,
+                                  CONNECTOR_LIMIT, CONNECTOR_LIMIT_PER_HOST,
+                                  CONNECTOR_KEEPALIVE_TIMEOUT, CONNECTOR_DNS_CACHE_TTL)
+
+
+def build_connector(limit=CONNECTOR_LIMIT, limit_per_host=CONNECTOR_LIMIT_PER_HOST,
+                    keepalive_timeout=CONNECTOR_KEEPALIVE_TIMEOUT,
+                    dns_cache_ttl=CONNECTOR_DNS_CACHE_TTL):
+    """Return a TCPConnector to share between clients.
+
+    Connections to the portal hosts are kept alive between cycles and
+    accounts, so the TCP and TLS handshakes are not done again.
+    Must be called in a running event loop, the owner must close it.
+    """
+    return aiohttp.TCPConnector(limit=limit,
+                                limit_per_host=limit_per_host,
+                                keepalive_timeout=keepalive_timeout,
+                                use_dns_cache=True,
+                                ttl_dns_cache=dns_cache_ttl)
+
+
+class PortalSession():
+    """Isolated portal session of one customer."""
+
+    def __init__(self, customer_id, http_session, cookies):
+        """Create new PortalSession object."""
+        self.customer_id = customer_id
+        self.http_session = http_session
+        self.cookies = cookies
+        self.selected = False
+        self.lock = asyncio.Lock()
+        # Number of running fetches using this session, it can not be evicted if > 0
+        self.in_use = 0
+
+    @property
+    def idle(self):
+        """Return True if nobody is using the session."""
+        return self.in_use == 0 and not self.lock.locked()
+
+    @classmethod
+    def from_client_session(cls, customer_id, http_session, cookies):
+        """Build a portal session sharing the connection pool of `http_session`.
+
+        Cookies already collected by the client are copied in the new session.
+        """
+        cookie_jar = aiohttp.CookieJar()
+        for host in (HOST_SERVICES, HOST_SPRING):
+            cookie_jar.update_cookies(http_session.cookie_jar.filter_cookies(URL(host)),
+                                      URL(host))
+        # Use the same class as the client session, which can be a wrapper
+        portal_http_session = type(http_session)(connector=http_session.connector,
+                                                 connector_owner=False,
+                                                 cookie_jar=cookie_jar,
+                                                 requote_redirect_url=False)
+        portal_cookies = {site: dict(site_cookies) for site, site_cookies in cookies.items()}
+        return cls(customer_id, portal_http_session, portal_cookies)
+
+    async def close(self):
+        """Close the portal session, the shared connection pool is kept."""
+        await self.http_session.close()
+
+
+class PortalSessionPool():
+    """Pool of portal sessions, one per customer, with LRU eviction.
+
+    Sessions in use are never evicted, so the pool can be temporarily
+    bigger than `maxsize`.
+    """
+
+    def __init__(self, maxsize=PORTAL_SESSION_POOL_SIZE):
+        """Create new PortalSessionPool object."""
+        self.maxsize = maxsize
+        self._sessions = OrderedDict()
+
+    def get(self, customer_id):
+        """Return the portal session of a customer or None."""
+        portal_session = self._sessions.get(customer_id)
+        if portal_session is not None:
+            self._sessions.move_to_end(customer_id)
+        return portal_session
+
+    def add(self, portal_session):
+        """Add a portal session to the pool."""
+        self._sessions[portal_session.customer_id] = portal_session
+        self._sessions.move_to_end(portal_session.customer_id)
+
+    async def evict(self):
+        """Close the least recently used idle sessions above the pool size."""
+        while len(self._sessions) > self.maxsize:
+            customer_id = next((customer_id for customer_id, portal_session
+                                in self._sessions.items() if portal_session.idle), None)
+            if customer_id is None:
+                return
+            await self._sessions.pop(customer_id).close()
+
+    async def close(self):
+        """Close all the sessions."""
+        while self._sessions:
+            await self._sessions.popitem()[1].close()
+
+    def __contains__(self, customer_id):
+        """Return True if the customer has a portal session."""
+        return customer_id in self._sessions
+
+    def __len__(self):
+        """Return the number of portal sessions."""
+        return len(self._sessions)
@@ -0,0 +1,263 @@
+"""PyHydroQuebec Store Module.
+
+Persistent SQLite store of historical daily and hourly consumption.
+Only final data (before today) is stored, so a sync only requests
+the days missing since the last successful run. Days without data in the
+portal are recorded, and not requested again once they are old enough to
+be final (ie before the contract start).
+"""
+from datetime import date, datetime, timedelta
+import logging
+import sqlite3
+
+from pyhydroquebec.consts import (DAILY_MAP, HOURLY_DAY_FIELDS, HOURLY_FIELDS,
+                                  DAILY_CHUNK_DAYS, STORE_EMPTY_DAY_DELAY, BULK_CONCURRENCY,
+                                  get_hq_timezone)
+from pyhydroquebec.error import PyHydroQuebecError
+
+SCHEMA = ("""
+CREATE TABLE IF NOT EXISTS daily (
+    contract_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    {daily_columns},
+    PRIMARY KEY (contract_id, date)
+);
+CREATE TABLE IF NOT EXISTS hourly_day (
+    contract_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    {hourly_day_columns},
+    PRIMARY KEY (contract_id, date)
+);
+CREATE TABLE IF NOT EXISTS hourly (
+    contract_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    hour INTEGER NOT NULL,
+    {hourly_columns},
+    PRIMARY KEY (contract_id, date, hour)
+);
+CREATE TABLE IF NOT EXISTS sync_state (
+    contract_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    last_sync TEXT NOT NULL,
+    PRIMARY KEY (contract_id, kind)
+);
+CREATE TABLE IF NOT EXISTS empty_days (
+    contract_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    date TEXT NOT NULL,
+    retry_after TEXT,
+    PRIMARY KEY (contract_id, kind, date)
+);
+""".format(daily_columns=",\n    ".join("{} REAL".format(key) for key in DAILY_MAP),
+           hourly_day_columns=",\n    ".join("{} REAL".format(key) for key in HOURLY_DAY_FIELDS),
+           hourly_columns=",\n    ".join("{} REAL".format(key) for key in HOURLY_FIELDS)))
+
+
+def _to_date(value):
+    """Convert a string, date or datetime to a date."""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except ValueError as exc:
+        raise PyHydroQuebecError("Bad date format {}. "
+                                 "It must match %Y-%m-%d".format(value)) from exc
+
+
+def _date_range(start_date, end_date):
+    """Yield all the days between start_date and end_date included."""
+    day = start_date
+    while day <= end_date:
+        yield day
+        day += timedelta(days=1)
+
+
+def group_ranges(days):
+    """Group sorted days in contiguous (start, end) ranges."""
+    ranges = []
+    for day in days:
+        if ranges and ranges[-1][1] + timedelta(days=1) == day:
+            ranges[-1][1] = day
+        else:
+            ranges.append([day, day])
+    return [tuple(day_range) for day_range in ranges]
+
+
+class HistoryStore():
+    """SQLite store of daily and hourly consumption keyed by contract and date."""
+
+    def __init__(self, path, logger=None):
+        """Create new HistoryStore object."""
+        self.path = path
+        self._logger = logger or logging.getLogger('pyhydroquebec').getChild('store')
+        self._conn = sqlite3.connect(path)
+        self._conn.executescript(SCHEMA)
+
+    def close(self):
+        """Close the database."""
+        self._conn.close()
+
+    def save_daily(self, contract_id, daily_data):
+        """Save daily data, a dict of day dicts keyed by date string."""
+        columns = ", ".join(DAILY_MAP)
+        placeholders = ", ".join("?" * (len(DAILY_MAP) + 2))
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO daily (contract_id, date, {}) "
+                "VALUES ({})".format(columns, placeholders),
+                [(contract_id, day) + tuple(data.get(key) for key in DAILY_MAP)
+                 for day, data in daily_data.items()])
+
+    def save_hourly(self, contract_id, day, hourly_data):
+        """Save the hourly data of one day, as built by Customer.fetch_hourly_data."""
+        columns = ", ".join(HOURLY_FIELDS)
+        placeholders = ", ".join("?" * (len(HOURLY_FIELDS) + 3))
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO hourly (contract_id, date, hour, {}) "
+                "VALUES ({})".format(columns, placeholders),
+                [(contract_id, day, hour) + tuple(data.get(key) for key in HOURLY_FIELDS)
+                 for hour, data in hourly_data['hours'].items()])
+            self._conn.execute(
+                "INSERT OR REPLACE INTO hourly_day (contract_id, date, {}) "
+                "VALUES (?, ?, ?, ?, ?)".format(", ".join(HOURLY_DAY_FIELDS)),
+                (contract_id, day) + tuple(hourly_data.get(key) for key in HOURLY_DAY_FIELDS))
+
+    def load_daily(self, contract_id, start_date, end_date):
+        """Return stored daily data between two dates, keyed by date string."""
+        cursor = self._conn.execute(
+            "SELECT date, {} FROM daily WHERE contract_id = ? AND date BETWEEN ? AND ? "
+            "ORDER BY date".format(", ".join(DAILY_MAP)),
+            (contract_id, str(_to_date(start_date)), str(_to_date(end_date))))
+        return {row[0]: dict(zip(DAILY_MAP, row[1:])) for row in cursor}
+
+    def load_hourly(self, contract_id, start_date, end_date):
+        """Return stored hourly data between two dates, keyed by date string."""
+        params = (contract_id, str(_to_date(start_date)), str(_to_date(end_date)))
+        hourly_data = {}
+        cursor = self._conn.execute(
+            "SELECT date, {} FROM hourly_day WHERE contract_id = ? AND date BETWEEN ? AND ? "
+            "ORDER BY date".format(", ".join(HOURLY_DAY_FIELDS)), params)
+        for row in cursor:
+            hourly_data[row[0]] = dict(zip(HOURLY_DAY_FIELDS, row[1:]))
+            hourly_data[row[0]]['hours'] = {}
+        cursor = self._conn.execute(
+            "SELECT date, hour, {} FROM hourly WHERE contract_id = ? AND date BETWEEN ? AND ? "
+            "ORDER BY date, hour".format(", ".join(HOURLY_FIELDS)), params)
+        for row in cursor:
+            hourly_data[row[0]]['hours'][row[1]] = dict(zip(HOURLY_FIELDS, row[2:]))
+        return hourly_data
+
+    def missing_days(self, contract_id, kind, start_date, end_date):
+        """Return the days without stored data for `kind` ('daily' or 'hourly').
+
+        Days recorded as empty are skipped until they can be requested again.
+        """
+        table = {'daily': 'daily', 'hourly': 'hourly_day'}[kind]
+        start_date = _to_date(start_date)
+        end_date = _to_date(end_date)
+        params = (contract_id, str(start_date), str(end_date))
+        cursor = self._conn.execute(
+            "SELECT date FROM {} WHERE contract_id = ? AND date BETWEEN ? AND ?".format(table),
+            params)
+        stored = {row[0] for row in cursor}
+        cursor = self._conn.execute(
+            "SELECT date FROM empty_days WHERE contract_id = ? AND kind = ? "
+            "AND date BETWEEN ? AND ? AND (retry_after IS NULL OR retry_after > ?)",
+            (contract_id, kind) + params[1:] + (str(datetime.now(get_hq_timezone()).date()),))
+        stored.update(row[0] for row in cursor)
+        return [day for day in _date_range(start_date, end_date) if str(day) not in stored]
+
+    def save_empty_days(self, contract_id, kind, days):
+        """Record days without data in the portal for `kind`.
+
+        Recent days are requested again the next day, the portal may publish
+        them later. Older days are never requested again.
+        """
+        today = datetime.now(get_hq_timezone()).date()
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO empty_days (contract_id, kind, date, retry_after) "
+                "VALUES (?, ?, ?, ?)",
+                [(contract_id, kind, str(day),
+                  None if (today - day).days >= STORE_EMPTY_DAY_DELAY
+                  else str(today + timedelta(days=1)))
+                 for day in map(_to_date, days)])
+
+    def last_sync(self, contract_id, kind):
+        """Return the datetime of the last successful sync or None."""
+        row = self._conn.execute(
+            "SELECT last_sync FROM sync_state WHERE contract_id = ? AND kind = ?",
+            (contract_id, kind)).fetchone()
+        if row is None:
+            return None
+        return datetime.fromisoformat(row[0])
+
+    def _set_last_sync(self, contract_id, kind):
+        """Record a successful sync."""
+        with self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sync_state (contract_id, kind, last_sync) "
+                "VALUES (?, ?, ?)",
+                (contract_id, kind, datetime.now(get_hq_timezone()).isoformat()))
+
+    def _sync_start(self, contract_id, kind, start_date):
+        """Return the first day to sync, from the last successful sync by default."""
+        if start_date is not None:
+            return _to_date(start_date)
+        last_sync = self.last_sync(contract_id, kind)
+        if last_sync is None:
+            return datetime.now(get_hq_timezone()).date() - timedelta(days=1)
+        # Include the recent days which had no data yet at the last sync
+        return last_sync.date() - timedelta(days=STORE_EMPTY_DAY_DELAY)
+
+    async def sync(self, customer, start_date=None, end_date=None, hourly=True,
+                   chunk_days=DAILY_CHUNK_DAYS, concurrency=BULK_CONCURRENCY):
+        """Fetch and store the days missing between start_date and end_date.
+
+        Without `start_date`, the sync starts where the last one stopped
+        (yesterday for the first one). Today is never synced because its data
+        is not final yet. Daily data is requested by contiguous ranges of at
+        most `chunk_days` days, hourly data `concurrency` days at a time.
+        Days are saved as they arrive and not kept in memory.
+        Return the number of synced days for daily and hourly data.
+        """
+        yesterday = datetime.now(get_hq_timezone()).date() - timedelta(days=1)
+        end_date = min(_to_date(end_date), yesterday) if end_date else yesterday
+        contract_id = customer.contract_id
+
+        synced_daily = 0
+        start = self._sync_start(contract_id, 'daily', start_date)
+        for range_start, range_end in group_ranges(
+                self.missing_days(contract_id, 'daily', start, end_date)):
+            empty_days = set(_date_range(range_start, range_end))
+            async for day, data in customer.iter_daily_data(range_start, range_end,
+                                                            chunk_days):
+                # Saved day by day to keep the progress of an interrupted sync
+                self.save_daily(contract_id, {day: data})
+                empty_days.discard(_to_date(day))
+                synced_daily += 1
+            self.save_empty_days(contract_id, 'daily', sorted(empty_days))
+        self._set_last_sync(contract_id, 'daily')
+        self._logger.info("%d days of daily data synced for contract %s",
+                          synced_daily, contract_id)
+
+        synced_hourly = 0
+        if hourly:
+            start = self._sync_start(contract_id, 'hourly', start_date)
+            for range_start, range_end in group_ranges(
+                    self.missing_days(contract_id, 'hourly', start, end_date)):
+                empty_days = set(_date_range(range_start, range_end))
+                async for day, data in customer.iter_hourly_data(range_start, range_end,
+                                                                 concurrency):
+                    self.save_hourly(contract_id, day, data)
+                    empty_days.discard(_to_date(day))
+                    synced_hourly += 1
+                self.save_empty_days(contract_id, 'hourly', sorted(empty_days))
+            self._set_last_sync(contract_id, 'hourly')
+            self._logger.info("%d days of hourly data synced for contract %s",
+                              synced_hourly, contract_id)
+
+        return synced_daily, synced_hourly
@@ -26,6 +26,7 @@ setup(name='pyhydroquebec',
       },
       license='Apache 2.0',
       install_requires=install_requires,
+      extras_require={'lxml': ['lxml'], 'orjson': ['orjson']},
       tests_require=tests_require,
       classifiers=[
         'Programming Language :: Python :: 3.4',
@@ -0,0 +1,296 @@
+"""Local HydroQuebec portal stand-in.
+
+An aiohttp server replays the recorded responses of
+fixtures/portal_responses.json with a configurable latency.
+FakePortalClient is a HydroQuebecClient sending all the portal requests
+(https://<host>/<path>) to this server (http://127.0.0.1:<port>/<host>/<path>).
+"""
+import asyncio
+import copy
+from datetime import datetime, timedelta
+import json
+import os
+import uuid
+
+import aiohttp
+from aiohttp import web
+
+from pyhydroquebec.client import HydroQuebecClient
+from pyhydroquebec.consts import (LOGIN_URL_3, LOGIN_URL_4, LOGIN_URL_5, LOGIN_URL_6,
+                                  LOGIN_URL_7, CONTRACT_URL_1, CONTRACT_URL_2, CONTRACT_URL_3,
+                                  CONTRACT_CURRENT_URL_1, CONTRACT_CURRENT_URL_2,
+                                  ANNUAL_DATA_URL, MONTHLY_DATA_URL, DAILY_DATA_URL,
+                                  HOURLY_DATA_URL_1, HOURLY_DATA_URL_2)
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+ACCESS_TOKEN = "fake-access-token-{}"
+SESSION_COOKIE = "JSESSIONID"
+
+
+def _strip_scheme(url):
+    """Return <host>/<path> of an url."""
+    return url.split("://", 1)[-1].split("?", 1)[0].split("#", 1)[0]
+
+
+class FakePortal():
+    """Fake HydroQuebec portal."""
+
+    def __init__(self, accounts=1, customers=1, latency=0, failures=None, first_day=None):
+        """Create new FakePortal object.
+
+        `accounts` is the number of usernames (user0, user1...) accepted,
+        `customers` the number of customers of each account.
+        `failures` is a dict of url: (number of failures, status), the first
+        requests to these urls fail with this status.
+        The hourly data of the days before `first_day` (a date string) is empty.
+        """
+        with open(os.path.join(FIXTURES, "portal_responses.json"), encoding="utf-8") as fhf:
+            self.responses = json.load(fhf)
+        with open(os.path.join(FIXTURES, "gerer-mon-compte.html"), encoding="utf-8") as fhf:
+            self.account_page = fhf.read()
+        self.accounts = accounts
+        self.customers = customers
+        self.latency = latency
+        self.first_day = first_day
+        self.failures = {_strip_scheme(url): list(failure)
+                         for url, failure in (failures or {}).items()}
+        self.request_count = 0
+        self.requests = {}
+        # Client (host, port) of each TCP connection opened to the portal
+        self.connections = set()
+        # Portal session id: selected customer id
+        self.selected = {}
+        self.port = None
+        self._runner = None
+        self._routes = {
+            _strip_scheme(LOGIN_URL_3): self._authenticate,
+            _strip_scheme(LOGIN_URL_4): self._security,
+            _strip_scheme(LOGIN_URL_5): self._authorize,
+            _strip_scheme(self.responses['security']['oauth2'][0]['redirectUri']):
+                self._empty_handler,
+            _strip_scheme(LOGIN_URL_6): self._empty_handler,
+            _strip_scheme(LOGIN_URL_7): self._relations,
+            _strip_scheme(CONTRACT_URL_1): self._empty_handler,
+            _strip_scheme(CONTRACT_URL_2): self._select_customer,
+            _strip_scheme(CONTRACT_URL_3): self._account_page,
+            _strip_scheme(CONTRACT_CURRENT_URL_1): self._selected_handler(self._empty_handler),
+            _strip_scheme(CONTRACT_CURRENT_URL_2):
+                self._selected_handler(self._json_handler('current_period')),
+            _strip_scheme(ANNUAL_DATA_URL): self._selected_handler(self._json_handler('annual')),
+            _strip_scheme(MONTHLY_DATA_URL): self._selected_handler(self._monthly),
+            _strip_scheme(DAILY_DATA_URL): self._selected_handler(self._daily),
+            _strip_scheme(HOURLY_DATA_URL_1):
+                self._selected_handler(self._json_handler('hourly_consumption')),
+            _strip_scheme(HOURLY_DATA_URL_2):
+                self._selected_handler(self._hourly_weather),
+        }
+
+    @staticmethod
+    def contract_id(username, customer_index):
+        """Return the contract id of a customer."""
+        return "3{:04d}{:04d}".format(int(username.split("user", 1)[-1] or 0), customer_index)
+
+    async def start(self):
+        """Start the server on a random port."""
+        app = web.Application()
+        app.router.add_route("*", "/{tail:.*}", self._dispatch)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        """Stop the server."""
+        await self._runner.cleanup()
+
+    async def __aenter__(self):
+        """Start the server."""
+        return await self.start()
+
+    async def __aexit__(self, *exc_info):
+        """Stop the server."""
+        await self.stop()
+
+    async def _dispatch(self, request):
+        """Route a request to its handler."""
+        self.request_count += 1
+        self.connections.add(request.transport.get_extra_info('peername'))
+        route = request.path.lstrip("/")
+        self.requests[route] = self.requests.get(route, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        failure = self.failures.get(route)
+        if failure is not None and failure[0] > 0:
+            failure[0] -= 1
+            return web.Response(status=failure[1])
+        handler = self._routes.get(route)
+        if handler is None:
+            return web.Response(status=404)
+        return await handler(request)
+
+    def _json_handler(self, name):
+        """Build a handler returning a recorded response."""
+        async def handler(_):
+            # The portal does not send application/json
+            return web.Response(text=json.dumps(self.responses[name]), content_type="text/html")
+        return handler
+
+    async def _security(self, _):
+        """Return the OAuth2 settings."""
+        return web.json_response(self.responses['security'])
+
+    def _selected_handler(self, handler):
+        """Build a handler checking that a customer is selected."""
+        async def selected_handler(request):
+            if request.cookies.get(SESSION_COOKIE) not in self.selected:
+                return web.Response(status=500, text="No customer selected")
+            return await handler(request)
+        return selected_handler
+
+    @staticmethod
+    async def _empty_handler(_):
+        """Return an empty page."""
+        return web.Response(text="")
+
+    async def _authenticate(self, request):
+        """Return the callback template or the token."""
+        body = await request.text()
+        if not body:
+            return web.json_response(self.responses['authenticate_template'])
+        callbacks = json.loads(body)['callbacks']
+        username = callbacks[0]['input'][0]['value']
+        if username not in ["user{}".format(i) for i in range(self.accounts)]:
+            return web.Response(status=401)
+        response = web.json_response(self.responses['authenticate'])
+        response.set_cookie("iPlanetDirectoryPro", self.responses['authenticate']['tokenId'])
+        response.set_cookie("username", username)
+        return response
+
+    async def _authorize(self, request):
+        """Redirect to the callback url with the access token."""
+        username = request.cookies.get("username")
+        if username is None:
+            return web.Response(status=401)
+        location = "{}#access_token={}&expires_in=3600&state={}".format(
+            request.query['redirect_uri'], ACCESS_TOKEN.format(username), request.query['state'])
+        return web.Response(status=302, headers={"Location": location})
+
+    async def _relations(self, request):
+        """Return the customers of the account."""
+        prefix = "Bearer " + ACCESS_TOKEN.format("")
+        authorization = request.headers.get("Authorization", "")
+        if not authorization.startswith(prefix):
+            return web.Response(status=401)
+        username = authorization[len(prefix):]
+        return web.json_response([{"noPartenaireDemandeur": "{}-account".format(username),
+                                   "noPartenaireTitulaire": self.contract_id(username, i)[1:]}
+                                  for i in range(self.customers)])
+
+    async def _select_customer(self, request):
+        """Select a customer in a new portal session."""
+        session_id = str(uuid.uuid4())
+        self.selected[session_id] = request.headers["NO_PARTENAIRE_TITULAIRE"]
+        response = web.Response(text="")
+        response.set_cookie(SESSION_COOKIE, session_id)
+        return response
+
+    async def _account_page(self, request):
+        """Return the account page of the selected customer."""
+        customer_id = self.selected.get(request.cookies.get(SESSION_COOKIE))
+        if customer_id is None:
+            return web.Response(status=500, text="No customer selected")
+        return web.Response(text=self.account_page.replace("310277835", "3" + customer_id),
+                            content_type="text/html")
+
+    async def _monthly(self, _):
+        """Return 12 months of data."""
+        records = []
+        for month in range(1, 13):
+            record = copy.deepcopy(self.responses['monthly_record'])
+            record['courant']['dateDebutMois'] = "2018-{:02d}-01".format(month)
+            records.append(record)
+        return web.Response(text=json.dumps({"success": True, "results": records}),
+                            content_type="text/html")
+
+    async def _hourly_weather(self, request):
+        """Return the hourly weather, without results before the first day."""
+        if self.first_day is not None and request.query['dateDebut'] < self.first_day:
+            return web.Response(text=json.dumps({"success": True, "results": []}),
+                                content_type="text/html")
+        return await self._json_handler('hourly_weather')(request)
+
+    async def _daily(self, request):
+        """Return one record per day of the requested range."""
+        start_date = datetime.strptime(request.query['dateDebut'], "%Y-%m-%d")
+        end_date = datetime.strptime(request.query.get('dateFin', request.query['dateDebut']),
+                                     "%Y-%m-%d")
+        records = []
+        day = start_date
+        while day <= end_date:
+            record = copy.deepcopy(self.responses['daily_record'])
+            record['courant']['dateJourConso'] = day.strftime("%Y-%m-%d")
+            records.append(record)
+            day += timedelta(days=1)
+        return web.Response(text=json.dumps({"success": True, "results": records}),
+                            content_type="text/html")
+
+
+class RewriteSession():
+    """aiohttp.ClientSession wrapper sending all the requests to the fake portal."""
+
+    port = None
+
+    def __init__(self, **kwargs):
+        """Create the wrapped session."""
+        self._session = aiohttp.ClientSession(**kwargs)
+
+    def _rewrite(self, url):
+        """Rewrite https://<host>/<path> to http://127.0.0.1:<port>/<host>/<path>."""
+        return "http://127.0.0.1:{}/{}".format(self.port, url.split("://", 1)[-1])
+
+    def get(self, url, **kwargs):
+        """Run a GET request."""
+        kwargs.pop("ssl", None)
+        return self._session.get(self._rewrite(url), **kwargs)
+
+    def post(self, url, **kwargs):
+        """Run a POST request."""
+        kwargs.pop("ssl", None)
+        return self._session.post(self._rewrite(url), **kwargs)
+
+    @property
+    def connector(self):
+        """Return the connector of the wrapped session."""
+        return self._session.connector
+
+    @property
+    def cookie_jar(self):
+        """Return the cookie jar of the wrapped session."""
+        return self._session.cookie_jar
+
+    async def close(self):
+        """Close the wrapped session."""
+        await self._session.close()
+
+
+class FakePortalClient(HydroQuebecClient):
+    """HydroQuebecClient using the fake portal."""
+
+    def __init__(self, portal, username="user0", password="password", **kwargs):
+        """Create new FakePortalClient object."""
+        kwargs.setdefault("log_level", "WARNING")
+        HydroQuebecClient.__init__(self, username, password, **kwargs)
+        self._session_class = type("PortalRewriteSession", (RewriteSession,),
+                                   {"port": portal.port})
+
+    def _get_httpsession(self):
+        """Set http session."""
+        if self._session is None:
+            if self._connector is not None:
+                self._session = self._session_class(connector=self._connector,
+                                                    connector_owner=False,
+                                                    requote_redirect_url=False)
+            else:
+                self._session = self._session_class(requote_redirect_url=False)
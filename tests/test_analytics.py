@@ -0,0 +1,55 @@
+"""Tests for analytics module."""
+import pytest
+
+from pyhydroquebec import analytics
+
+
+def _daily(days):
+    """Build daily data from (day, consumption, higher price consumption, temperature)."""
+    return {day: {'total_consumption': total,
+                  'lower_price_consumption': total - higher,
+                  'higher_price_consumption': higher,
+                  'average_temperature': temperature}
+            for day, total, higher, temperature in days}
+
+
+DAILY = _daily([("2020-01-01", 40, 10, -2),
+                ("2020-01-02", 50, 0, -7),
+                ("2020-01-04", 60, 0, -12),
+                ("2020-02-01", 10, 0, 13)])
+
+
+def test_moving_average():
+    """Test calendar moving average with a missing day."""
+    averages = analytics.moving_average(DAILY, window=3)
+    assert averages["2020-01-02"] == 45
+    # 2020-01-03 is missing
+    assert averages["2020-01-04"] == 55
+    assert averages["2020-02-01"] == 10
+
+
+def test_tier_breakdown():
+    """Test lower and higher price consumption by month."""
+    breakdown = analytics.tier_breakdown(DAILY)
+    assert breakdown["2020-01"]['higher_price_consumption'] == 10
+    assert breakdown["2020-01"]['higher_price_share'] == pytest.approx(10 / 150)
+
+
+def test_temperature_correlation():
+    """Test consumption regression on heating degree-days."""
+    assert analytics.heating_degree_days(DAILY)["2020-01-01"] == 20
+    result = analytics.temperature_correlation(DAILY)
+    assert result['days'] == 4
+    assert result['slope'] == pytest.approx(2)
+    assert result['base_load'] == pytest.approx(0)
+    assert result['correlation'] == pytest.approx(1)
+
+
+def test_peak_hours():
+    """Test peak hour detection."""
+    hours = {hour: {'total_consumption': hour} for hour in range(24)}
+    peak_day = dict(hours)
+    peak_day[3] = {'total_consumption': 50}
+    hourly = {"2020-01-01": {'hours': hours}, "2020-01-02": {'hours': peak_day}}
+    assert analytics.peak_hours(hourly, top=2) == [("2020-01-02", 3, 50),
+                                                   ("2020-01-01", 23, 23)]
@@ -0,0 +1,105 @@
+"""Tests for cache module."""
+import asyncio
+
+from pyhydroquebec.cache import ResponseCache, freeze_params
+
+
+def test_cache_stores_results():
+    """Test that the parsed result is cached and not the coroutine."""
+    cache = ResponseCache()
+    calls = []
+
+    async def fetcher():
+        calls.append(1)
+        return {"foo": "bar"}
+
+    async def run():
+        first = await cache.get_or_fetch(("customer", "daily", None), fetcher)
+        second = await cache.get_or_fetch(("customer", "daily", None), fetcher)
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first == second == {"foo": "bar"}
+    assert len(calls) == 1
+
+
+def test_cache_shares_inflight_requests():
+    """Test that concurrent callers share one request."""
+    cache = ResponseCache()
+    calls = []
+
+    async def fetcher():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return 42
+
+    async def run():
+        key = ("customer", "current_period", None)
+        return await asyncio.gather(*[cache.get_or_fetch(key, fetcher) for _ in range(5)])
+
+    assert asyncio.run(run()) == [42] * 5
+    assert len(calls) == 1
+
+
+def test_cache_keys_and_eviction():
+    """Test per customer keys, endpoint TTL and LRU eviction."""
+    cache = ResponseCache(maxsize=2, endpoint_ttls={'hourly': 0})
+    cache.set(("c1", "daily", None), 1)
+    cache.set(("c2", "daily", None), 2)
+    cache.get(("c1", "daily", None))
+    cache.set(("c3", "daily", None), 3)
+    cache.set(("c1", "hourly", None), 4)
+    assert len(cache) == 2
+    assert cache.get(("c1", "daily", None)) == 1
+    assert cache.get(("c3", "daily", None)) == 3
+    assert freeze_params({"b": 1, "a": 2}) == freeze_params({"a": 2, "b": 1})
+
+
+def test_cache_does_not_store_errors():
+    """Test that failed requests are not cached."""
+    cache = ResponseCache()
+
+    async def fetcher():
+        raise ValueError("boom")
+
+    async def run():
+        try:
+            await cache.get_or_fetch(("customer", "daily", None), fetcher)
+        except ValueError:
+            return True
+        return False
+
+    assert asyncio.run(run())
+    assert len(cache) == 0
+
+
+def test_cache_cancels_abandoned_requests():
+    """Test that a shared request is cancelled only with its last caller."""
+    cache = ResponseCache()
+    started = []
+
+    async def fetcher():
+        started.append(1)
+        await asyncio.sleep(0.1)
+        return 42
+
+    async def run():
+        key = ("customer", "daily", None)
+        first = asyncio.ensure_future(cache.get_or_fetch(key, fetcher))
+        second = asyncio.ensure_future(cache.get_or_fetch(key, fetcher))
+        await asyncio.sleep(0)
+        first.cancel()
+        shared = await second
+        cache.clear()
+        third = asyncio.ensure_future(cache.get_or_fetch(key, fetcher))
+        await asyncio.sleep(0.01)
+        third.cancel()
+        await asyncio.wait([third])
+        await asyncio.sleep(0)
+        return shared, third.cancelled(), asyncio.all_tasks() - {asyncio.current_task()}
+
+    shared, cancelled, pending = asyncio.run(run())
+    assert shared == 42
+    assert cancelled
+    assert not pending
+    assert len(started) == 2
@@ -0,0 +1,30 @@
+"""Tests for decoders module."""
+import json
+import os
+
+from pyhydroquebec import decoders
+from pyhydroquebec.consts import DAILY_MAP, MONTHLY_MAP
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def test_extractors():
+    """Test that extractors remap records as the *_MAP tables."""
+    with open(os.path.join(FIXTURES, "portal_responses.json"), encoding="utf-8") as fhf:
+        responses = json.load(fhf)
+    record = responses['daily_record']['courant']
+    assert decoders.extract_daily(record) == {key: record[data['raw_name']]
+                                              for key, data in DAILY_MAP.items()}
+    record = responses['monthly_record']['courant']
+    assert decoders.extract_monthly(record) == {key: record[raw_key]
+                                                for key, raw_key in MONTHLY_MAP}
+    assert decoders.record_extractor((('total', 'consoTotal'),))({'consoTotal': 3}) == {
+        'total': 3}
+
+
+def test_decode_json_fallback(monkeypatch):
+    """Test that the standard library is used without orjson and ujson."""
+    monkeypatch.setattr(decoders, "JSON_BACKENDS", ("missing_json_backend",))
+    monkeypatch.setattr(decoders, "_LOADS", None)
+    assert decoders.json_backend() == "json"
+    assert decoders.decode_json(b'{"results": [1.5]}') == {"results": [1.5]}
@@ -0,0 +1,92 @@
+"""Tests of the client against the local fake portal."""
+import asyncio
+
+import pytest
+
+from fake_portal import FakePortal, FakePortalClient, _strip_scheme
+from pyhydroquebec.__main__ import fetch_data, fetch_data_detailled_energy_use, sync_history
+from pyhydroquebec.consts import ANNUAL_DATA_URL
+from pyhydroquebec.error import PyHydroQuebecError, PyHydroQuebecHTTPError
+
+
+def test_fetch_data_offline():
+    """Test login and basic report without network."""
+    async def run():
+        async with FakePortal(customers=2) as portal:
+            client = FakePortalClient(portal)
+            contract_id = portal.contract_id("user0", 1)
+            customer = await fetch_data(client, contract_id, fetch_hourly=True)
+            await client.close_session()
+            return customer, portal.request_count
+
+    customer, request_count = asyncio.run(run())
+    assert customer.contract_id == "300000001"
+    assert customer.balance == 1320.59
+    assert customer.current_period['period_total_bill'] == 10.65
+    assert len(customer.current_daily_data) == 1
+    assert len(list(customer.hourly_data.values())[0]['hours']) == 24
+    assert request_count > 0
+
+
+def test_sync_unknown_contract(tmp_path):
+    """Test that syncing an unknown contract fails clearly."""
+    async def run():
+        async with FakePortal() as portal:
+            client = FakePortalClient(portal)
+            try:
+                await sync_history(client, "unknown", str(tmp_path / "history.db"))
+            finally:
+                await client.close_session()
+
+    with pytest.raises(PyHydroQuebecError, match="Contract unknown not found"):
+        asyncio.run(run())
+
+
+def test_export_unknown_contract():
+    """Test that exporting an unknown contract fails like the sync."""
+    async def run():
+        async with FakePortal() as portal:
+            client = FakePortalClient(portal)
+            try:
+                await fetch_data_detailled_energy_use(client, "unknown",
+                                                      "2018-11-01", "2018-11-02")
+            finally:
+                await client.close_session()
+
+    with pytest.raises(PyHydroQuebecError, match="Contract unknown not found"):
+        asyncio.run(run())
+
+
+def test_iter_hourly_data_offline():
+    """Test bulk hourly download without network."""
+    async def run():
+        async with FakePortal() as portal:
+            client = FakePortalClient(portal)
+            await client.login()
+            days = [day async for day, _ in
+                    client.customers[0].iter_hourly_data("2018-11-01", "2018-11-05")]
+            await client.close_session()
+            return days
+
+    assert sorted(asyncio.run(run())) == ["2018-11-0{}".format(day) for day in range(1, 6)]
+
+
+def test_fetch_plan_offline():
+    """Test concurrent datasets with one failure."""
+    async def run():
+        failures = {_strip_scheme(ANNUAL_DATA_URL): (1, 404)}
+        async with FakePortal(failures=failures) as portal:
+            client = FakePortalClient(portal)
+            await client.login()
+            customer = client.customers[0]
+            with pytest.raises(PyHydroQuebecError):
+                await customer.fetch(['daily', 'weekly'])
+            result = await customer.fetch(day="2020-01-01")
+            await client.close_session()
+            return result
+
+    result = asyncio.run(run())
+    assert result.day == "2020-01-01"
+    assert set(result.data) == {'current_period', 'monthly', 'daily', 'hourly'}
+    assert isinstance(result.errors['annual'], PyHydroQuebecHTTPError)
+    assert len(result.data['hourly']['hours']) == 24
@@ -0,0 +1,53 @@
+"""Tests for metrics module."""
+import asyncio
+
+from fake_portal import FakePortal, FakePortalClient
+from pyhydroquebec.metrics import Metrics, RequestEvent, endpoint_name
+from pyhydroquebec.consts import DAILY_DATA_URL
+
+
+def test_endpoint_name():
+    """Test url to endpoint name."""
+    assert endpoint_name(DAILY_DATA_URL + "?dateDebut=2020-01-01") == "daily"
+    assert endpoint_name("https://session.hydroquebec.com/portail/callback#token=1") == "callback"
+
+
+def test_prometheus_output():
+    """Test histogram aggregation and Prometheus text."""
+    metrics = Metrics(buckets=(0.1, 1))
+    events = []
+    metrics.add_listener(events.append)
+    metrics.record_request(RequestEvent("daily", "get", 200, 0.05, 100, "123"))
+    metrics.record_request(RequestEvent("daily", "get", 500, 0.5, 10, "123"))
+    try:
+        with metrics.phase("login"):
+            raise ValueError()
+    except ValueError:
+        pass
+
+    assert len(events) == 3
+    text = metrics.to_prometheus()
+    assert 'pyhydroquebec_request_duration_seconds_bucket{endpoint="daily",le="0.1"} 1' in text
+    assert 'pyhydroquebec_request_duration_seconds_bucket{endpoint="daily",le="+Inf"} 2' in text
+    assert 'pyhydroquebec_requests_total{endpoint="daily",status="500"} 1' in text
+    assert 'pyhydroquebec_response_bytes_total{endpoint="daily"} 110' in text
+    assert 'pyhydroquebec_phase_errors_total{phase="login"} 1' in text
+
+
+def test_client_metrics():
+    """Test that the client records requests and phases."""
+    async def run():
+        async with FakePortal() as portal:
+            client = FakePortalClient(portal)
+            await client.login()
+            await client.customers[0].fetch_current_period()
+            await client.close_session()
+            return client.metrics.to_dict(), portal.request_count
+
+    metrics, request_count = asyncio.run(run())
+    assert sum(sum(endpoint['status'].values())
+               for endpoint in metrics['requests'].values()) == request_count
+    assert metrics['requests']['current_period']['status'] == {'200': 1}
+    assert metrics['requests']['current_period']['bytes'] > 0
+    assert set(metrics['phases']) == {'login', 'select_customer', 'fetch_summary',
+                                      'fetch_current_period'}
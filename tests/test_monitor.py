@@ -0,0 +1,51 @@
+"""Tests for monitor module."""
+import asyncio
+import time
+
+from fake_portal import FakePortal, FakePortalClient
+from pyhydroquebec.metrics import Metrics
+from pyhydroquebec.monitor import LoopLagMonitor
+
+
+async def blocking_parser():
+    """Block the event loop."""
+    await asyncio.sleep(0.05)
+    time.sleep(0.3)
+
+
+def test_loop_lag_monitor():
+    """Test that a stall and its coroutine are reported."""
+    async def run():
+        metrics = Metrics()
+        monitor = LoopLagMonitor(threshold=0.1, interval=0.02, metrics=metrics)
+        await monitor.start()
+        await blocking_parser()
+        await asyncio.sleep(0.1)
+        await monitor.stop()
+        return monitor, metrics
+
+    monitor, metrics = asyncio.run(run())
+    assert len(monitor.stalls) == 1
+    assert monitor.stalls[0].duration >= 0.2
+    assert monitor.stalls[0].coroutine == "blocking_parser"
+    assert "test_monitor.py:" in monitor.stalls[0].location
+    assert metrics.phase_duration['loop_stall'].count == 1
+
+
+def test_parse_executor():
+    """Test that large responses are parsed in the parse executor."""
+    async def run():
+        async with FakePortal() as portal:
+            client = FakePortalClient(portal, parse_executor='thread', offload_threshold=0)
+            await client.login()
+            customer = client.customers[0]
+            await customer.fetch_daily_data("2020-01-01", "2020-01-31")
+            # pylint: disable=protected-access
+            executor = client._parse_executor
+            await client.close_session()
+            return customer, executor
+
+    customer, executor = asyncio.run(run())
+    assert executor is not None
+    assert len(customer.current_daily_data) == 31
+    assert customer.balance == 1320.59
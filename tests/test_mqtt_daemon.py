@@ -0,0 +1,224 @@
+"""Tests for mqtt_daemon module."""
+import asyncio
+from datetime import datetime
+import json
+import os
+
+from fake_portal import FakePortal, FakePortalClient, _strip_scheme
+from pyhydroquebec.consts import LOGIN_URL_3, HOURLY_DATA_URL_2, get_hq_timezone
+from pyhydroquebec.mqtt_daemon import MqttHydroQuebec
+
+
+class MockMqttClient:  # pylint: disable=too-few-public-methods
+    """Mock class for paho mqtt Client."""
+
+    def __init__(self):
+        """Create new MockMqttClient object."""
+        self.messages = []
+
+    def publish(self, topic, payload=None, retain=False):
+        """Record a message."""
+        self.messages.append((topic, payload, retain))
+
+
+def build_daemon(portal, tmp_path, monkeypatch, config=None):
+    """Return a daemon polling all the contracts of the fake portal."""
+    accounts = [{"username": "user{}".format(index), "password": "password",
+                 "contracts": [{"id": portal.contract_id("user{}".format(index), customer)}
+                               for customer in range(portal.customers)]}
+                for index in range(portal.accounts)]
+    config_path = tmp_path / "config.yaml"
+    config_path.write_text(json.dumps(dict(config or {}, accounts=accounts)))
+    for name in ("MQTT_USERNAME", "MQTT_PASSWORD", "MQTT_HOST"):
+        monkeypatch.setenv(name, "test")
+    monkeypatch.setenv("MQTT_PORT", "1883")
+    monkeypatch.setenv("LOG_LEVEL", "WARNING")
+    monkeypatch.setenv("CONFIG", str(config_path))
+    daemon = MqttHydroQuebec()
+    daemon.mqtt_client = MockMqttClient()
+    # pylint: disable=protected-access
+    for account in accounts:
+        daemon._clients[account['username']] = FakePortalClient(
+            portal, account['username'], account['password'], cache=daemon.cache)
+    return daemon
+
+
+def test_incremental_publishing(tmp_path, monkeypatch):
+    """Test that unchanged configs and states are not published again."""
+    async def run():
+        async with FakePortal(customers=2) as portal:
+            daemon = build_daemon(portal, tmp_path, monkeypatch)
+            messages = daemon.mqtt_client.messages
+            # pylint: disable=protected-access
+            await daemon._main_loop()
+            first_cycle = len(messages)
+            await daemon._main_loop()
+            second_cycle = len(messages) - first_cycle
+            daemon._last_refresh -= daemon.refresh_interval
+            await daemon._main_loop()
+            refresh_cycle = len(messages) - first_cycle - second_cycle
+            await daemon._loop_stopped()
+            return messages, first_cycle, second_cycle, refresh_cycle
+
+    messages, first_cycle, second_cycle, refresh_cycle = asyncio.run(run())
+    assert first_cycle > 0
+    assert all(retain for _, _, retain in messages[:first_cycle])
+    assert second_cycle == 0
+    assert refresh_cycle == first_cycle
+
+
+def test_reconnect_wakes_main_loop(tmp_path, monkeypatch):
+    """Test that an MQTT reconnection stops waiting for the next poll."""
+    config = {"frequency": 600, "config_watch_interval": None}
+
+    async def run():
+        async with FakePortal() as portal:
+            daemon = build_daemon(portal, tmp_path, monkeypatch, config)
+            # pylint: disable=protected-access
+            await daemon._init_main_loop()
+            main_loop = asyncio.ensure_future(daemon._main_loop())
+            await asyncio.sleep(0.2)
+            # paho calls it in its own thread
+            await daemon.loop.run_in_executor(None, daemon._on_connect, None, None, None, 0)
+            await asyncio.wait_for(main_loop, 5)
+            await daemon._loop_stopped()
+            return daemon._republish_requested
+
+    assert asyncio.run(run())
+
+
+def test_reconnect_republishes_from_memory(tmp_path, monkeypatch):
+    """Test that a reconnection publishes everything again without polling the portal."""
+    # No response cache to hide the portal requests
+    config = {"frequency": 600, "cache": {"ttl": 0}}
+
+    async def run():
+        async with FakePortal(customers=2) as portal:
+            daemon = build_daemon(portal, tmp_path, monkeypatch, config)
+            messages = daemon.mqtt_client.messages
+            # pylint: disable=protected-access
+            await daemon._poll_accounts()
+            first_cycle = list(messages)
+            request_count = portal.request_count
+            daemon._on_connect(None, None, None, 0)
+            await daemon._poll_accounts()
+            await daemon._loop_stopped()
+            return (first_cycle, messages[len(first_cycle):],
+                    portal.request_count - request_count)
+
+    first_cycle, republished, requests = asyncio.run(run())
+    assert sorted(republished) == sorted(first_cycle)
+    assert requests == 0
+
+
+def test_sensor_groups_and_backfill(tmp_path, monkeypatch):
+    """Test the optional sensor groups and the batched backfill."""
+    config = {"sensors": {"hourly": True, "monthly": True, "annual": True},
+              "backfill": {"enabled": True, "days": 4, "max_days": 2, "batch_size": 30}}
+
+    async def run():
+        async with FakePortal() as portal:
+            daemon = build_daemon(portal, tmp_path, monkeypatch, config)
+            # pylint: disable=protected-access
+            await daemon._main_loop()
+            first_cycle = list(daemon.mqtt_client.messages)
+            await daemon._main_loop()
+            second_cycle = daemon.mqtt_client.messages[len(first_cycle):]
+            await daemon._loop_stopped()
+            return first_cycle, second_cycle
+
+    first_cycle, second_cycle = asyncio.run(run())
+    topics = [topic for topic, _, _ in first_cycle]
+    assert any(topic.endswith("/yesterday_hourly_total_consumption/attributes")
+               for topic in topics)
+    assert any(topic.endswith("/monthly_total_consumption/state") for topic in topics)
+    assert any(topic.endswith("/annual_total_consumption/state") for topic in topics)
+
+    def statistics(messages):
+        return [json.loads(payload)['points'] for topic, payload, retain in messages
+                if topic.endswith("/statistics") and not retain]
+
+    # Yesterday is reused from the hourly sensors, 2 more days are fetched
+    first_batches = statistics(first_cycle)
+    assert [len(batch) for batch in first_batches] == [30, 30, 12]
+    assert all('start' in point for batch in first_batches for point in batch)
+    # The last day is backfilled in the next cycle
+    assert sum(len(batch) for batch in statistics(second_cycle)) == 24
+
+
+def test_backfill_skips_empty_days(tmp_path, monkeypatch):
+    """Test that the days without data are not requested at each cycle."""
+    config = {"backfill": {"enabled": True, "days": 5, "max_days": 10}}
+    today = datetime.now(get_hq_timezone()).strftime("%Y-%m-%d")
+
+    async def run():
+        async with FakePortal(first_day=today) as portal:
+            daemon = build_daemon(portal, tmp_path, monkeypatch, config)
+            route = _strip_scheme(HOURLY_DATA_URL_2)
+            # pylint: disable=protected-access
+            await daemon._main_loop()
+            first_cycle = portal.requests.get(route, 0)
+            daemon.scheduler.reset()
+            await daemon._main_loop()
+            second_cycle = portal.requests.get(route, 0) - first_cycle
+            await daemon._loop_stopped()
+            return first_cycle, second_cycle
+
+    assert asyncio.run(run()) == (5, 0)
+
+
+def test_config_reload(tmp_path, monkeypatch):
+    """Test that accounts are added and removed without touching the others."""
+    async def run():
+        async with FakePortal(accounts=2) as portal:
+            daemon = build_daemon(portal, tmp_path, monkeypatch)
+            config_path = tmp_path / "config.yaml"
+            config = json.loads(config_path.read_text())
+            accounts = config['accounts']
+            # pylint: disable=protected-access
+            await daemon._poll_accounts()
+            client = daemon._clients['user0']
+            removed_client = daemon._clients['user1']
+            config_path.write_text(json.dumps(dict(config, accounts=accounts[:1])))
+            daemon._request_reload()
+            await daemon._poll_accounts()
+            assert list(daemon._clients) == ['user0']
+            assert removed_client._session is None
+            # Requests of one login
+            logins = portal.requests[_strip_scheme(LOGIN_URL_3)] // 2
+
+            # The config file changed
+            daemon._clients['user1'] = FakePortalClient(portal, 'user1', cache=daemon.cache)
+            config_path.write_text(json.dumps(dict(config, accounts=accounts)))
+            os.utime(config_path, (0, 0))
+            assert daemon._config_changed()
+            await daemon._poll_accounts()
+            assert daemon._clients['user0'] is client
+            assert len(daemon.config['accounts']) == 2
+            # Only the added account logged in
+            assert portal.requests[_strip_scheme(LOGIN_URL_3)] == 3 * logins
+            await daemon._loop_stopped()
+
+    asyncio.run(run())
+
+
+def test_account_timeout(tmp_path, monkeypatch):
+    """Test that a stuck account does not block the other ones."""
+    config = {"account_timeout": 0.5}
+
+    async def run():
+        async with FakePortal(accounts=2) as portal:
+            daemon = build_daemon(portal, tmp_path, monkeypatch, config)
+
+            async def hang(*_):
+                await asyncio.sleep(60)
+            # pylint: disable=protected-access
+            daemon._clients["user1"].login = hang
+            await asyncio.wait_for(daemon._main_loop(), 5)
+            await daemon._loop_stopped()
+            return portal, daemon.mqtt_client.messages
+
+    portal, messages = asyncio.run(run())
+    topics = " ".join(topic for topic, _, _ in messages if topic.endswith("/state"))
+    assert portal.contract_id("user0", 0) in topics
+    assert portal.contract_id("user1", 0) not in topics
@@ -1,74 +1,41 @@
 """Tests for output module."""
 import json
 import re
-import unittest
 
-from pyhydroquebec.outputter import output_influx, output_json
+from pyhydroquebec.outputter import output_influx, output_json, NdjsonExporter
 
 
-@unittest.skip('Influx output broken.')
 def test_influx_output(capsys):
     """Test influx output function."""
 
-    data = {'310277835': {
-               'annual_date_end': '2018-11-28',
-               'annual_date_start': '2017-11-25',
-               'annual_kwh_price_cent': 8.94,
-               'annual_length': 369,
-               'annual_mean_daily_bill': 5.05,
-               'annual_mean_daily_consumption': 56.5,
-               'annual_total_bill': 1863.19,
-               'annual_total_consumption': 20835,
-               'balance': 320.59,
-               'period_average_temperature': 0,
-               'period_higher_price_consumption': 0,
-               'period_length': 2,
-               'period_lower_price_consumption': 118,
-               'period_mean_daily_bill': 5.33,
-               'period_mean_daily_consumption': 59.0,
-               'period_projection': 537.21,
-               'period_total_bill': 10.65,
-               'period_total_consumption': 118,
-               'period_total_days': 65,
-               'yesterday_average_temperature': -1,
-               'yesterday_higher_price_consumption': 0,
-               'yesterday_hourly_consumption': [{'high': 0,
-                                                 'hour': '00:00:00',
-                                                 'lower': 0.97,
-                                                 'temp': 0,
-                                                 'total': 0.97},
-                                                {'high': 0,
-                                                 'hour': '01:00:00',
-                                                 'lower': 1.2,
-                                                 'temp': 0,
-                                                 'total': 1.2},
-                                                {'high': 0,
-                                                 'hour': '02:00:00',
-                                                 'lower': 1.62,
-                                                 'temp': 0,
-                                                 'total': 1.62}],
-               'yesterday_lower_price_consumption': 55.23,
-               'yesterday_total_consumption': 55.23}}
-
-    expected = (r'''pyhydroquebec,contract=310277835 annual_date_end="2018-11-28",'''
-                r'''annual_date_start="2017-11-25",annual_kwh_price_cent=8.94,'''
-                r'''annual_length=369,annual_mean_daily_bill=5.05,'''
-                r'''annual_mean_daily_consumption=56.5,annual_total_bill=1863.19,'''
-                r'''annual_total_consumption=20835,balance=320.59,period_average_temperature=0'''
-                r''',period_higher_price_consumption=0,period_length=2,'''
-                r'''period_lower_price_consumption=118,period_mean_daily_bill=5.33,'''
-                r'''period_mean_daily_consumption=59.0,period_projection=537.21,'''
-                r'''period_total_bill=10.65,period_total_consumption=118,period_total_days=65,'''
-                r'''yesterday_average_temperature=-1,yesterday_higher_price_consumption=0,'''
-                r'''yesterday_lower_price_consumption=55.23,yesterday_total_consumption=55.23'''
-                r''' \d*\n'''
-                r'''pyhydroquebec,contract=310277835 high=0,lower=0.97,temp=0,total=0.97'''
-                r''' \d*\n'''
-                r'''pyhydroquebec,contract=310277835 high=0,lower=1.2,temp=0,total=1.2'''
-                r''' \d*\n'''
-                r'''pyhydroquebec,contract=310277835 high=0,lower=1.62,temp=0,total=1.62'''
-                r''' \d*\n''')
-    output_influx(data)
+    class MockCustomer:  # pylint: disable=too-few-public-methods
+        """Mock class for Customer."""
+        contract_id = "310277835"
+        balance = 320.59
+        current_period = {'period_total_bill': 10.65, 'period_length': 2}
+        current_annual_data = {'annual_date_end': '2018-11-28',
+                               'annual_total_consumption': 20835}
+        current_monthly_data = {'2018-11': {'total_consumption': 1800}}
+        current_daily_data = {'2018-11-27': {'total_consumption': 55.23,
+                                             'average_temperature': -1}}
+        hourly_data = {'2018-11-27': {'hours': {0: {'total_consumption': 0.97},
+                                                1: {'total_consumption': 1.2}}}}
+
+    expected = (r'''pyhydroquebec,contract=310277835,kind=balance balance=320.59 \d+\n'''
+                r'''pyhydroquebec,contract=310277835,kind=current_period '''
+                r'''period_total_bill=10.65,period_length=2.0 \d+\n'''
+                r'''pyhydroquebec,contract=310277835,kind=annual '''
+                r'''annual_date_end="2018-11-28",annual_total_consumption=20835.0 '''
+                r'''1543381200000000000\n'''
+                r'''pyhydroquebec,contract=310277835,kind=monthly total_consumption=1800.0 '''
+                r'''1541044800000000000\n'''
+                r'''pyhydroquebec,contract=310277835,kind=daily '''
+                r'''total_consumption=55.23,average_temperature=-1.0 1543294800000000000\n'''
+                r'''pyhydroquebec,contract=310277835,kind=hourly total_consumption=0.97 '''
+                r'''1543294800000000000\n'''
+                r'''pyhydroquebec,contract=310277835,kind=hourly total_consumption=1.2 '''
+                r'''1543298400000000000\n$''')
+    output_influx(MockCustomer(), show_hourly=True, batch_size=2)
     captured = capsys.readouterr()
     assert re.match(expected, captured.out)
 
@@ -117,3 +84,21 @@ def test_json_output(capsys):
     captured = capsys.readouterr()
 
     assert captured.out == expected
+
+
+def test_ndjson_output(capsys):
+    """Test ndjson streaming output."""
+    hourly_data = {'day_mean_temp': -3,
+                   'hours': {0: {'total_consumption': 0.97}, 1: {'total_consumption': 1.2}}}
+
+    with NdjsonExporter() as exporter:
+        exporter.write_daily("foo_contract", "2020-01-01", {"total_consumption": 55.23})
+        exporter.write_hourly_day("foo_contract", "2020-01-01", hourly_data)
+
+    captured = capsys.readouterr()
+    records = [json.loads(line) for line in captured.out.splitlines()]
+    assert exporter.count == 3
+    assert records[0] == {"contract_id": "foo_contract", "date": "2020-01-01",
+                          "total_consumption": 55.23}
+    assert records[2] == {"contract_id": "foo_contract", "date": "2020-01-01",
+                          "hour": 1, "total_consumption": 1.2}
@@ -0,0 +1,36 @@
+"""Tests for parsers module."""
+import logging
+import os
+
+import pytest
+
+from pyhydroquebec import parsers
+from pyhydroquebec.parsers import parse_summary, lxml_available, SUMMARY_PARSERS
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "gerer-mon-compte.html")
+
+
+@pytest.mark.parametrize("parser", SUMMARY_PARSERS)
+def test_parse_summary(parser):
+    """Test that all the parsers extract the same fields."""
+    with open(FIXTURE, encoding="utf-8") as fhf:
+        content = fhf.read()
+    raw_balance, raw_contract_id = parse_summary(content, parser)
+    assert raw_balance == "1\xa0320,59\xa0$"
+    assert raw_contract_id.split("Contrat", 1)[-1].split() == ["310277835"]
+
+
+@pytest.mark.parametrize("parser", SUMMARY_PARSERS)
+def test_parse_summary_no_contract(parser):
+    """Test a page without contract."""
+    assert parse_summary("<html><body><p>Nothing</p></body></html>", parser) == (None, None)
+
+
+@pytest.mark.skipif(lxml_available(), reason="lxml is installed")
+def test_lxml_fallback_logged_once(caplog):
+    """Test that the bs4 fallback of the lxml parser is logged once."""
+    parsers._log_lxml_fallback.cache_clear()  # pylint: disable=protected-access
+    with caplog.at_level(logging.DEBUG, logger="pyhydroquebec.parsers"):
+        for _ in range(3):
+            parse_summary("<html></html>", "lxml")
+    assert len([record for record in caplog.records if "lxml" in record.getMessage()]) == 1
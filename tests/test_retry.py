@@ -0,0 +1,132 @@
+"""Tests for retry module."""
+import asyncio
+
+import pytest
+from aiohttp import web
+
+from fake_portal import FakePortal, FakePortalClient
+from pyhydroquebec.consts import DAILY_DATA_URL, ANNUAL_DATA_URL
+from pyhydroquebec.error import PyHydroQuebecHTTPError, PyHydroQuebecTimeoutError
+from pyhydroquebec.retry import RetryPolicy, AdaptiveRateLimiter
+
+
+def test_retry_policy():
+    """Test retryable requests and backoff."""
+    policy = RetryPolicy(attempts=3, backoff=1, max_backoff=3, jitter=False)
+    assert policy.should_retry("get", 0, 503)
+    assert not policy.should_retry("get", 0, 404)
+    assert not policy.should_retry("post", 0, 503)
+    assert policy.should_retry("post", 0, 503, force=True)
+    assert not policy.should_retry("get", 2, 503)
+    assert [policy.delay(attempt) for attempt in range(3)] == [1, 2, 3]
+    assert policy.delay(0, retry_after="2") == 2
+
+
+def test_rate_limiter_adapts():
+    """Test that the limiter slows down on throttling and recovers."""
+    limiter = AdaptiveRateLimiter(max_rate=None, min_rate=1, recovery=5)
+    assert limiter.reserve() == 0
+    limiter.throttled()
+    assert limiter.rate == 5
+    assert limiter.reserve() > 0
+    limiter.succeeded()
+    assert limiter.rate is None
+
+
+def test_retry_transient_errors():
+    """Test that transient portal errors are retried per request."""
+    async def run(failures):
+        async with FakePortal(failures=failures) as portal:
+            limiter = AdaptiveRateLimiter()
+            client = FakePortalClient(portal, retry_policy=RetryPolicy(backoff=0),
+                                      rate_limiter=limiter)
+            try:
+                await client.login()
+                customer = client.customers[0]
+                await customer.fetch_daily_data("2020-01-01", "2020-01-02")
+                await customer.fetch_annual_data()
+            finally:
+                await client.close_session()
+            return customer, limiter
+
+    customer, limiter = asyncio.run(run({DAILY_DATA_URL: (2, 503)}))
+    assert len(customer.current_daily_data) == 2
+    assert limiter.rate is not None
+
+    with pytest.raises(PyHydroQuebecHTTPError) as excinfo:
+        asyncio.run(run({ANNUAL_DATA_URL: (3, 500)}))
+    assert excinfo.value.status == 500
+
+
+def test_timeouts():
+    """Test that expired requests and phases report what timed out."""
+    async def run(**kwargs):
+        async with FakePortal(latency=0.5) as portal:
+            client = FakePortalClient(portal, retry_policy=RetryPolicy(attempts=1), **kwargs)
+            try:
+                await client.login()
+            finally:
+                await client.close_session()
+
+    with pytest.raises(PyHydroQuebecTimeoutError) as excinfo:
+        asyncio.run(run(timeout=0.1))
+    assert excinfo.value.phase == "authenticate"
+
+    with pytest.raises(PyHydroQuebecTimeoutError) as excinfo:
+        asyncio.run(run(timeout=10, phase_timeout=0.2))
+    assert excinfo.value.phase == "login"
+
+
+def test_phase_timeout_cancels_requests():
+    """Test that an expired phase leaves no request running."""
+    async def run():
+        async with FakePortal() as portal:
+            client = FakePortalClient(portal, phase_timeout=0.2)
+            try:
+                await client.login()
+                portal.latency = 1
+                with pytest.raises(PyHydroQuebecTimeoutError) as excinfo:
+                    await client.customers[0].fetch_daily_data("2020-01-01", "2020-01-02")
+                await asyncio.sleep(0.01)
+                # The fake portal server tasks are ignored
+                pending = [task for task in asyncio.all_tasks()
+                           if "pyhydroquebec" in task.get_coro().cr_code.co_filename]
+            finally:
+                await client.close_session()
+            return excinfo.value.phase, pending
+
+    phase, pending = asyncio.run(run())
+    assert phase == "fetch_daily"
+    assert not pending
+
+
+def test_stalled_body_is_retried():
+    """Test that a response body stalled after the headers is retried."""
+    calls = []
+
+    async def stalled_handler(request):
+        calls.append(1)
+        response = web.StreamResponse()
+        response.content_length = 10
+        await response.prepare(request)
+        await response.write(b"01234")
+        if len(calls) == 1:
+            await asyncio.sleep(1)
+        await response.write(b"56789")
+        return response
+
+    async def run():
+        async with FakePortal() as portal:
+            # pylint: disable=protected-access
+            portal._routes["example.com/stalled"] = stalled_handler
+            client = FakePortalClient(portal, timeout=0.3,
+                                      retry_policy=RetryPolicy(attempts=2, backoff=0))
+            client._get_httpsession()
+            try:
+                res = await client.http_request("https://example.com/stalled", "get")
+                return await res.text()
+            finally:
+                await client.close_session()
+
+    assert asyncio.run(run()) == "0123456789"
+    assert len(calls) == 2
@@ -0,0 +1,158 @@
+"""Tests for scheduler module."""
+import asyncio
+from datetime import datetime
+import json
+
+from fake_portal import FakePortal, FakePortalClient, _strip_scheme
+from test_mqtt_daemon import build_daemon
+from pyhydroquebec.consts import DAILY_DATA_URL, get_hq_timezone
+from pyhydroquebec.scheduler import Scheduler, VOLATILE, FINAL, yesterday
+
+
+class FakeClock():  # pylint: disable=too-few-public-methods
+    """Clock moved forward by the tests."""
+
+    def __init__(self):
+        """Create new FakeClock object."""
+        self.now = 1000
+
+    def __call__(self):
+        """Return the current time."""
+        return self.now
+
+
+def test_scheduler():
+    """Test volatile polls, final data checks and jitter."""
+    clock = FakeClock()
+    scheduler = Scheduler(600, final_interval=60, jitter=10, clock=clock)
+    assert scheduler.is_due("contract", VOLATILE)
+    assert scheduler.next_poll() == 600
+    scheduler.polled("contract", VOLATILE)
+    assert not scheduler.is_due("contract", VOLATILE)
+    assert 600 <= scheduler.next_poll() <= 610
+    assert scheduler.offset("contract") == scheduler.offset("contract")
+
+    # Final data is checked until it shows up
+    scheduler.polled("contract", FINAL)
+    clock.now += 70
+    assert scheduler.is_due("contract", FINAL, "2020-01-01")
+    scheduler.complete("contract", "2020-01-01")
+    clock.now += 3600 * 24
+    assert not scheduler.is_due("contract", FINAL, "2020-01-01")
+    assert scheduler.is_due("contract", FINAL, "2020-01-02")
+
+    scheduler.reset()
+    assert scheduler.is_due("contract", FINAL, "2020-01-01")
+    # One shot runs poll everything
+    assert Scheduler().is_due("contract", VOLATILE)
+    assert Scheduler().next_poll() is None
+
+
+def test_daemon_schedule(tmp_path, monkeypatch):
+    """Test that the daemon fetches yesterday's data only once."""
+    async def run():
+        async with FakePortal(customers=2) as portal:
+            daemon = build_daemon(portal, tmp_path, monkeypatch, {"frequency": 600})
+            clock = FakeClock()
+            daemon.scheduler = Scheduler(600, clock=clock)
+            # pylint: disable=protected-access
+            await daemon._poll_accounts()
+            daily_requests = portal.requests[_strip_scheme(DAILY_DATA_URL)]
+            request_count = portal.request_count
+            # Nothing is due
+            await daemon._poll_accounts()
+            assert portal.request_count == request_count
+            clock.now += 3600
+            # The responses are expired too
+            daemon.cache.clear()
+            await daemon._poll_accounts()
+            await daemon._loop_stopped()
+            # Only the volatile data is fetched again
+            assert portal.request_count > request_count
+            assert portal.requests[_strip_scheme(DAILY_DATA_URL)] == daily_requests
+            return daemon.scheduler
+
+    scheduler = asyncio.run(run())
+    assert not scheduler.is_due(FakePortal.contract_id("user0", 0), FINAL, yesterday())
+
+
+def test_daemon_waits_after_failures(tmp_path, monkeypatch):
+    """Test that bad credentials and unknown contracts do not make the daemon spin."""
+    async def run():
+        async with FakePortal() as portal:
+            daemon = build_daemon(portal, tmp_path, monkeypatch, {"frequency": 600})
+            clock = FakeClock()
+            daemon.scheduler = Scheduler(600, clock=clock)
+            # pylint: disable=protected-access
+            daemon.config['accounts'][0]['contracts'] = [{"id": "unknown"}]
+            daemon.config['accounts'].append({"username": "baduser", "password": "password",
+                                              "contracts": [{"id": "300000000"}]})
+            daemon._clients["baduser"] = FakePortalClient(portal, "baduser", "password",
+                                                          cache=daemon.cache)
+            await daemon._poll_accounts()
+            request_count = portal.request_count
+            next_poll = daemon.scheduler.next_poll()
+            await daemon._poll_accounts()
+            await daemon._loop_stopped()
+            return next_poll, portal.request_count - request_count
+
+    next_poll, requests = asyncio.run(run())
+    assert next_poll >= 600
+    assert requests == 0
+
+
+def test_daemon_final_data(tmp_path, monkeypatch):
+    """Test that yesterday is checked until its hourly data shows up."""
+    today = datetime.now(get_hq_timezone()).strftime("%Y-%m-%d")
+    config = {"frequency": 600, "sensors": {"hourly": True}}
+
+    async def run():
+        async with FakePortal(first_day=today) as portal:
+            daemon = build_daemon(portal, tmp_path, monkeypatch, config)
+            clock = FakeClock()
+            daemon.scheduler = Scheduler(600, final_interval=60, jitter=0, clock=clock)
+            # pylint: disable=protected-access
+            await daemon._poll_accounts()
+            contract_id = portal.contract_id("user0", 0)
+            clock.now += 70
+            due = daemon.scheduler.is_due(contract_id, FINAL, yesterday())
+            # A reconnection is handled by the main loop, not the MQTT thread
+            messages = len(daemon.mqtt_client.messages)
+            daemon._on_connect(None, None, None, 0)
+            not_reset = not daemon.scheduler.is_due(contract_id, VOLATILE)
+            await daemon._poll_accounts()
+            republished = len(daemon.mqtt_client.messages) - messages
+            await daemon._loop_stopped()
+            return due, not_reset, republished
+
+    due, not_reset, republished = asyncio.run(run())
+    assert due
+    assert not_reset
+    assert republished > 0
+
+
+def test_reload_forgets_removed_contracts(tmp_path, monkeypatch):
+    """Test that the contracts removed from the config are not scheduled anymore."""
+    async def run():
+        async with FakePortal(accounts=2) as portal:
+            daemon = build_daemon(portal, tmp_path, monkeypatch, {"frequency": 600})
+            clock = FakeClock()
+            daemon.scheduler = Scheduler(600, jitter=0, clock=clock)
+            # pylint: disable=protected-access
+            await daemon._poll_accounts()
+            config_path = tmp_path / "config.yaml"
+            config = json.loads(config_path.read_text())
+            config['accounts'] = config['accounts'][:1]
+            config_path.write_text(json.dumps(config))
+            daemon._request_reload()
+            clock.now += 600
+            await daemon._poll_accounts()
+            # The sensors of the removed contract are not published again
+            removed_id = portal.contract_id("user1", 0)
+            published = " ".join(daemon._published_states)
+            await daemon._loop_stopped()
+            return daemon.scheduler.next_poll(), removed_id not in published
+
+    next_poll, forgotten = asyncio.run(run())
+    assert next_poll > 0
+    assert forgotten
@@ -0,0 +1,62 @@
+"""Tests for series module."""
+import asyncio
+
+from fake_portal import FakePortal, FakePortalClient
+from pyhydroquebec.series import DailySeries, HourlySeries
+
+
+def _hourly_day(consumption):
+    """Build the hourly data of one day."""
+    return {'day_mean_temp': -3, 'day_min_temp': -5, 'day_max_temp': 0,
+            'hours': {hour: {'average_temperature': -3,
+                             'lower_price_consumption': consumption,
+                             'higher_price_consumption': 0,
+                             'total_consumption': consumption}
+                      for hour in range(24)}}
+
+
+def test_daily_series():
+    """Test dict compatibility, slicing and resampling of daily data."""
+    data = {"2020-02-01": {'total_consumption': 2, 'lower_price_consumption': 2,
+                           'higher_price_consumption': 0, 'average_temperature': -10},
+            "2020-01-31": {'total_consumption': 1, 'lower_price_consumption': 1,
+                           'higher_price_consumption': None, 'average_temperature': -20}}
+    series = DailySeries(data)
+    assert list(series) == ["2020-01-31", "2020-02-01"]
+    assert series["2020-01-31"] == data["2020-01-31"]
+    assert dict(series) == data
+    series.update({"2020-01-15": data["2020-02-01"]})
+    assert len(series.slice("2020-01-01", "2020-01-31")) == 2
+    assert series.total('total_consumption', end_date="2020-01-31") == 3
+    assert series.resample('month') == {
+        "2020-01": {'total_consumption': 3, 'lower_price_consumption': 3,
+                    'higher_price_consumption': 0, 'average_temperature': -15},
+        "2020-02": {'total_consumption': 2, 'lower_price_consumption': 2,
+                    'higher_price_consumption': 0, 'average_temperature': -10}}
+    del series["2020-01-15"]
+    assert "2020-01-15" not in series
+
+
+def test_hourly_series():
+    """Test hourly data views and aggregations."""
+    series = HourlySeries({"2020-01-02": _hourly_day(2), "2020-01-01": _hourly_day(1)})
+    assert series["2020-01-01"] == _hourly_day(1)
+    assert series["2020-01-02"]['hours'][5]['total_consumption'] == 2
+    assert series.hour_profile('total_consumption')[0] == 1.5
+    assert series.daily()["2020-01-02"]['total_consumption'] == 48
+    assert series.resample('year')["2020"]['day_min_temp'] == -5
+
+
+def test_columnar_customer():
+    """Test that a columnar client gives the same data."""
+    async def run(columnar):
+        async with FakePortal() as portal:
+            client = FakePortalClient(portal, columnar=columnar)
+            await client.login()
+            customer = client.customers[0]
+            await customer.fetch_daily_data("2020-01-01", "2020-01-10")
+            await customer.fetch_hourly_data("2020-01-05")
+            await client.close_session()
+            return dict(customer.current_daily_data), dict(customer.hourly_data)
+
+    assert asyncio.run(run(True)) == asyncio.run(run(False))
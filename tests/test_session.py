@@ -0,0 +1,59 @@
+"""Tests for session module."""
+import asyncio
+
+from fake_portal import FakePortal, FakePortalClient
+from pyhydroquebec.consts import CONNECTOR_LIMIT_PER_HOST
+from pyhydroquebec.session import PortalSession, PortalSessionPool, build_connector
+
+
+class MockHTTPSession:  # pylint: disable=too-few-public-methods
+    """Mock class for aiohttp.ClientSession."""
+
+    closed = False
+
+    async def close(self):
+        """Close the session."""
+        self.closed = True
+
+
+def test_pool_lru_eviction():
+    """Test that the least recently used idle sessions are evicted."""
+
+    async def run():
+        pool = PortalSessionPool(maxsize=2)
+        sessions = [PortalSession(str(i), MockHTTPSession(), {}) for i in range(3)]
+        for portal_session in sessions:
+            pool.add(portal_session)
+        # 0 is used and 1 is the least recently used idle session
+        sessions[0].in_use = 1
+        pool.get("2")
+        await pool.evict()
+        return pool, sessions
+
+    pool, sessions = asyncio.run(run())
+    assert len(pool) == 2
+    assert "1" not in pool
+    assert sessions[1].http_session.closed
+    assert not sessions[0].http_session.closed
+
+
+def test_shared_connector():
+    """Test that clients share one connection pool but not their cookies."""
+    async def run():
+        async with FakePortal(accounts=2) as portal:
+            connector = build_connector()
+            clients = [FakePortalClient(portal, "user{}".format(index), connector=connector)
+                       for index in range(2)]
+            for client in clients:
+                await client.login()
+            contracts = [client.customers[0].contract_id for client in clients]
+            for client in clients:
+                await client.close_session()
+            closed = connector.closed
+            await connector.close()
+            return contracts, closed, len(portal.connections)
+
+    contracts, closed, connections = asyncio.run(run())
+    assert contracts == ["300000000", "300010000"]
+    assert not closed
+    assert connections <= CONNECTOR_LIMIT_PER_HOST
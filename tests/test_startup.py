@@ -0,0 +1,39 @@
+"""Tests of the modules loaded at startup."""
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ('asyncio', 'aiohttp', 'yaml', 'mqtt_hass_base', 'paho', 'dateutil', 'sqlite3')
+
+
+def loaded_modules(code):
+    """Run code in a new interpreter and return the heavy modules it loaded."""
+    code += "\nimport sys\nprint(' '.join(sorted(sys.modules)))"
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    output = subprocess.run([sys.executable, "-c", code], env=env, check=True,
+                            stdout=subprocess.PIPE).stdout.decode()
+    modules = output.split()
+    return set(module.split(".")[0] for module in modules
+               if module.split(".")[0] in HEAVY_MODULES)
+
+
+def test_version_startup():
+    """Test that --version loads no heavy module."""
+    assert loaded_modules("import sys\n"
+                          "sys.argv = ['pyhydroquebec', '--version']\n"
+                          "from pyhydroquebec.__main__ import main\n"
+                          "main()") == set()
+
+
+def test_client_startup():
+    """Test that the client does not load the daemon, store or timezone modules."""
+    assert loaded_modules("import pyhydroquebec.client") == {'asyncio', 'aiohttp'}
+
+
+def test_timezone_constant():
+    """Test that HQ_TIMEZONE is still importable and loads dateutil only on use."""
+    assert loaded_modules("import pyhydroquebec.consts") == set()
+    assert loaded_modules("from pyhydroquebec.consts import HQ_TIMEZONE\n"
+                          "from pyhydroquebec.consts import get_hq_timezone\n"
+                          "assert HQ_TIMEZONE is get_hq_timezone()") == {'dateutil'}
@@ -0,0 +1,115 @@
+"""Tests for store module."""
+import asyncio
+from datetime import date, datetime, timedelta
+
+from pyhydroquebec.consts import get_hq_timezone
+from pyhydroquebec.store import HistoryStore, group_ranges
+
+
+class MockCustomer:
+    """Mock class for Customer."""
+
+    contract_id = "foo_contract"
+
+    def __init__(self, first_day=None):
+        """Create new MockCustomer object, without data before `first_day`."""
+        self.first_day = first_day or date.min
+        self.current_daily_data = {}
+        self.daily_requests = []
+        self.hourly_requests = []
+
+    async def fetch_daily_data(self, start_date, end_date):
+        """Fake daily data fetcher."""
+        self.daily_requests.append((start_date, end_date))
+        day = start_date
+        while day <= end_date:
+            self.current_daily_data[str(day)] = {'total_consumption': 10.5,
+                                                 'lower_price_consumption': 10.5,
+                                                 'higher_price_consumption': 0,
+                                                 'average_temperature': -3}
+            day += timedelta(days=1)
+
+    async def iter_daily_data(self, start_date, end_date, chunk_days):
+        """Fake chunked daily data fetcher."""
+        while start_date <= end_date:
+            chunk_end = min(start_date + timedelta(days=chunk_days - 1), end_date)
+            await self.fetch_daily_data(max(start_date, self.first_day), chunk_end)
+            for day in sorted(self.current_daily_data):
+                if str(start_date) <= day <= str(chunk_end):
+                    yield day, self.current_daily_data[day]
+            start_date = chunk_end + timedelta(days=1)
+
+    async def iter_hourly_data(self, start_date, end_date, concurrency):
+        """Fake bulk hourly data fetcher, without data before the first day."""
+        assert concurrency > 0
+        while start_date <= end_date:
+            day = str(start_date)
+            self.hourly_requests.append(day)
+            start_date += timedelta(days=1)
+            if day < str(self.first_day):
+                continue
+            yield day, {'day_mean_temp': -3, 'day_min_temp': -5, 'day_max_temp': 0,
+                        'hours': {hour: {'average_temperature': -3,
+                                         'lower_price_consumption': 0.5,
+                                         'higher_price_consumption': 0,
+                                         'total_consumption': 0.5}
+                                  for hour in range(24)}}
+
+
+def test_group_ranges():
+    """Test contiguous day grouping."""
+    days = [date(2020, 1, 1), date(2020, 1, 2), date(2020, 1, 4)]
+    assert group_ranges(days) == [(date(2020, 1, 1), date(2020, 1, 2)),
+                                  (date(2020, 1, 4), date(2020, 1, 4))]
+
+
+def test_incremental_sync(tmp_path):
+    """Test that a second sync only requests the missing days."""
+    yesterday = datetime.now(get_hq_timezone()).date() - timedelta(days=1)
+    start_date = yesterday - timedelta(days=9)
+    store = HistoryStore(str(tmp_path / "history.db"))
+    customer = MockCustomer()
+
+    assert asyncio.run(store.sync(customer, start_date)) == (10, 10)
+    assert customer.daily_requests == [(start_date, yesterday)]
+
+    customer = MockCustomer()
+    assert asyncio.run(store.sync(customer, start_date - timedelta(days=1))) == (1, 1)
+    assert customer.daily_requests == [(start_date - timedelta(days=1),) * 2]
+    assert customer.hourly_requests == [str(start_date - timedelta(days=1))]
+
+    daily = store.load_daily("foo_contract", start_date, yesterday)
+    assert daily[str(yesterday)]['total_consumption'] == 10.5
+    hourly = store.load_hourly("foo_contract", yesterday, yesterday)
+    assert len(hourly[str(yesterday)]['hours']) == 24
+    assert store.last_sync("foo_contract", "hourly") is not None
+    store.close()
+
+
+def test_sync_resume_and_empty_days(tmp_path):
+    """Test that a sync resumes from the last one and skips the days without data."""
+    yesterday = datetime.now(get_hq_timezone()).date() - timedelta(days=1)
+    start_date = yesterday - timedelta(days=39)
+    first_day = yesterday - timedelta(days=29)
+    store = HistoryStore(str(tmp_path / "history.db"))
+    customer = MockCustomer(first_day)
+
+    assert asyncio.run(store.sync(customer, start_date, hourly=False, chunk_days=31)) == (30, 0)
+    assert len(customer.daily_requests) == 2
+
+    # Days before the contract start are not requested again
+    customer = MockCustomer(first_day)
+    assert asyncio.run(store.sync(customer, start_date)) == (0, 30)
+    assert not customer.daily_requests
+    assert len(customer.hourly_requests) == 40
+    customer = MockCustomer(first_day)
+    assert asyncio.run(store.sync(customer, start_date)) == (0, 0)
+    assert not customer.hourly_requests
+
+    # Without start date, only the days since the last sync are checked
+    store._conn.execute("DELETE FROM daily WHERE date < ?",  # pylint: disable=protected-access
+                        (str(yesterday - timedelta(days=5)),))
+    customer = MockCustomer(first_day)
+    assert asyncio.run(store.sync(customer)) == (0, 0)
+    assert not customer.daily_requests
+    store.close()